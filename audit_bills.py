@@ -0,0 +1,48 @@
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db_connection import get_database, DatabaseError
+from money import AUDIT_FIELDS, audit_bills
+
+# Re-checks the amounts of every bill saved in a financial year (April to
+# March): python audit_bills.py 2024 covers 1 April 2024 - 31 March 2025
+
+def financial_year(year):
+    # search_bills' end date is inclusive, so the year ends on the last
+    # microsecond of 31 March and a bill at midnight on 1 April is in the next
+    return datetime(year, 4, 1), datetime(year + 1, 4, 1) - timedelta(microseconds=1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute and check the totals of saved bills.")
+    parser.add_argument('year', type=int, help="first calendar year of the financial year, e.g. 2024 for 2024-25")
+    parser.add_argument('--type', choices=['gst', 'non-gst'], help="only this bill type")
+    args = parser.parse_args(argv)
+
+    start_date, end_date = financial_year(args.year)
+    try:
+        database = get_database()
+        started = time.perf_counter()
+        bills = database.search_bills(start_date=start_date, end_date=end_date, bill_type=args.type,
+                                      fields=AUDIT_FIELDS, sort_key='invoice_number', descending=False)
+        loaded = time.perf_counter()
+    except DatabaseError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    discrepancies = audit_bills(bills)
+    checked = time.perf_counter()
+
+    for problem in discrepancies:
+        # Legacy bills may have no bill_type or invoice_number
+        bill_type = (problem.get('bill_type') or '?').upper()
+        invoice_number = problem.get('invoice_number')
+        print(f"{bill_type:8} #{'?' if invoice_number is None else invoice_number:<8} {problem['field']:16} "
+              f"saved {problem['saved']:12.2f}  expected {problem['expected']:12.2f}")
+    print(f"FY {args.year}-{(args.year + 1) % 100:02d}: {len(bills)} bills checked, "
+          f"{len(discrepancies)} discrepancies (loaded in {loaded - started:.1f} s, "
+          f"checked in {checked - loaded:.2f} s)")
+    return 1 if discrepancies else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Run from the repository root: python -m benchmarks.bench_db
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datagen
+from money import AUDIT_FIELDS, audit_bills
+
+BENCH_DB_NAME = 'battery_shop_bench'
+
+# The mongo backend drops BENCH_DB_NAME, so it only runs against these hosts
+# unless --test-server says the server is a disposable one
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+DEFAULT_SIZES = [1000, 10000]
+
+def timings_summary(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'min_ms': round(samples[0], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return timings_summary(samples)
+
+def mongo_url_problem(url, test_server):
+    # None when the benchmark may write to (and drop a database on) url
+    from pymongo.errors import InvalidURI
+    from pymongo.uri_parser import parse_uri
+    if not url:
+        return "--backend mongo needs --url; DB_URL from .env is never used"
+    if url.startswith('mongodb+srv://'):
+        hosts = None
+    else:
+        try:
+            hosts = [host for host, _ in parse_uri(url)['nodelist']]
+        except InvalidURI as e:
+            return f"invalid --url: {e}"
+    if test_server or (hosts and all(host in LOCAL_HOSTS for host in hosts)):
+        return None
+    return "--url is not a local server; pass --test-server if it is a disposable test server"
+
+def open_database(backend, workdir, url=None):
+    # Imported late so DB_NAME / DB_PATH / DB_URL are set before Database
+    # reads them (.env never overrides them)
+    os.environ['DB_NAME'] = BENCH_DB_NAME
+    if backend == 'mongo':
+        os.environ['DB_URL'] = url
+    if backend == 'sqlite':
+        path = os.path.join(workdir, 'bench.sqlite3')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.environ['DB_PATH'] = path
+    from db_connection import Database
+    database = Database(backend)
+    if backend == 'mongo':
+        database.client.drop_database(BENCH_DB_NAME)
+    database.connect()
+    return database
+
+def run_size(backend, size, args, workdir):
+    from db_connection import BILL_SUMMARY_FIELDS
+    database = open_database(backend, workdir, args.url)
+    rng = random.Random(args.seed + size)
+    start = time.perf_counter()
+    models, customers = datagen.load(database, args.models, args.customers, size, args.gst_ratio, args.seed)
+    load_s = time.perf_counter() - start
+    print(f"[{backend} {size} bills] loaded in {load_s:.1f} s", file=sys.stderr)
+
+    first_date = datetime(2021, 1, 1)
+    results = {'load_s': round(load_s, 2)}
+    repeat = args.repeat
+
+    def customer_prefix():
+        return (rng.choice(customers)['name'][:rng.randint(2, 4)],)
+
+    def date_window():
+        start_date = first_date + timedelta(days=rng.randrange(3 * 365 - 30))
+        return (start_date, start_date + timedelta(days=30))
+
+    def new_bill():
+        bill_type = 'gst' if rng.random() < args.gst_ratio else 'non-gst'
+        return (datagen.make_bill(models, customers, rng, bill_type),)
+
+    page = {'fields': BILL_SUMMARY_FIELDS, 'page_size': 100}
+    results['search_bills (first page)'] = measure(lambda: database.search_bills(**page), repeat)
+    results['search_bills (name)'] = measure(
+        lambda prefix: database.search_bills(customer_name=prefix, **page), repeat, customer_prefix)
+    results['search_bills (date range)'] = measure(
+        lambda start_date, end_date: database.search_bills(start_date=start_date, end_date=end_date, **page),
+        repeat, date_window)
+    results['search_bills (type)'] = measure(
+        lambda bill_type: database.search_bills(bill_type=bill_type, **page),
+        repeat, lambda: (rng.choice(('gst', 'non-gst')),))
+    results['search_customers (prefix)'] = measure(
+        lambda prefix: database.search_customers(prefix), repeat, customer_prefix)
+    results['search_customers (substring)'] = measure(
+        lambda prefix: database.search_customers(prefix[1:], mode='substring'), repeat, customer_prefix)
+    results['get_inventory (refresh)'] = measure(lambda: database.get_inventory(refresh=True), repeat)
+    results['get_inventory (cached)'] = measure(lambda: database.get_inventory(), repeat)
+    # Every bill, as the financial year audit reads them
+    results['audit_bills (fetch + check)'] = measure(
+        lambda: audit_bills(database.search_bills(fields=AUDIT_FIELDS)), min(repeat, 3))
+
+    saved = []
+    def save(bill):
+        saved.append((database.save_bill(bill), bill['bill_type'], bill))
+    results['save_bill'] = measure(save, repeat, new_bill)
+
+    pending = list(saved)
+    def next_update():
+        invoice_number, bill_type, bill = pending.pop()
+        items = datagen.generate_items(models, rng, len(bill['items']))
+        return (invoice_number, dict(bill, items=items), bill_type)
+    results['update_bill'] = measure(database.update_bill, repeat, next_update)
+
+    pending = list(saved)
+    results['delete_bill'] = measure(
+        database.delete_bill, repeat, lambda: pending.pop()[:2])
+
+    if backend == 'mongo':
+        database.client.drop_database(BENCH_DB_NAME)
+    database.client.close()
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(report, baseline_path, tolerance):
+    # Returns the operations whose median got slower than the tolerance
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    for size, operations in report['results'].items():
+        for operation, result in operations.items():
+            before = baseline.get('results', {}).get(size, {}).get(operation)
+            if not isinstance(result, dict) or not isinstance(before, dict) or not before['median_ms']:
+                continue
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+            if change > tolerance:
+                regressions.append(f"{size} bills, {operation}: {before['median_ms']} -> "
+                                   f"{result['median_ms']} ms (+{change:.0f}%)")
+    return regressions
+
+def print_table(report):
+    for size, operations in report['results'].items():
+        print(f"\n{report['backend']}, {size} bills (load {operations['load_s']} s)")
+        print(f"  {'operation':32} {'median':>9} {'p95':>9} {'max':>9}")
+        for operation, result in operations.items():
+            if isinstance(result, dict):
+                print(f"  {operation:32} {result['median_ms']:9.2f} {result['p95_ms']:9.2f} {result['max_ms']:9.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Database layer against synthetic data.")
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite', 'mongo'],
+                        help="mongo needs --url")
+    parser.add_argument('--url', help="MongoDB server for the mongo backend; must be local unless --test-server")
+    parser.add_argument('--test-server', action='store_true',
+                        help="allow a non-local --url: the server holds nothing but test data")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated bill counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument('--models', type=int, default=50)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--gst-ratio', type=float, default=0.6)
+    parser.add_argument('--repeat', type=int, default=20, help="runs per operation")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="baseline JSON from an earlier run")
+    parser.add_argument('--tolerance', type=float, default=20, help="allowed median slowdown in percent")
+    args = parser.parse_args(argv)
+    if args.backend == 'mongo':
+        problem = mongo_url_problem(args.url, args.test_server)
+        if problem:
+            parser.error(problem)
+
+    report = {
+        'backend': args.backend,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {'models': args.models, 'customers': args.customers, 'gst_ratio': args.gst_ratio,
+                       'repeat': args.repeat, 'seed': args.seed},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(',')):
+            report['results'][str(size)] = run_size(args.backend, size, args, workdir)
+
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        regressions = compare(report, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
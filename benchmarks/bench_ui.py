@@ -0,0 +1,233 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+# Run from the repository root: python -m benchmarks.bench_ui
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+
+from benchmarks import datagen
+from benchmarks.bench_db import git_revision, timings_summary
+
+DEFAULT_ROWS = [1000, 10000, 50000]
+DEFAULT_ITEMS = [5, 20, 50, 100]
+
+def rss_bytes():
+    # Resident set size; Qt's widgets live outside tracemalloc's view
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def measure_fill(app, widget, fill, repeat, budget_s):
+    # Time to fill the table, then to lay it out and paint it once, with
+    # the Python and process memory it took
+    fill_samples = []
+    paint_samples = []
+    python_bytes = rss_delta = None
+    for run in range(repeat):
+        gc.collect()
+        rss_before = rss_bytes()
+        tracemalloc.start()
+        start = time.perf_counter()
+        fill()
+        filled = time.perf_counter()
+        app.processEvents()
+        widget.grab()
+        painted = time.perf_counter()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = rss_bytes()
+        fill_samples.append((filled - start) * 1000)
+        paint_samples.append((painted - filled) * 1000)
+        if run == 0:
+            python_bytes = current
+            rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        if painted - start > budget_s:
+            break
+    return {
+        'fill': timings_summary(fill_samples),
+        'layout_paint': timings_summary(paint_samples),
+        'python_bytes': python_bytes,
+        'rss_delta_bytes': rss_delta,
+    }
+
+def run_sizes(label, sizes, budget_s, bench_size):
+    # The per-row widget tables fill in worse than linear time; sizes whose
+    # fill is estimated (quadratically, from the last one) to exceed the
+    # budget are recorded as skipped rather than left to run for hours
+    results = {}
+    last = None
+    for size in sizes:
+        if last is not None:
+            estimate_s = last[1] / 1000 * (size / last[0]) ** 2
+            if estimate_s > budget_s:
+                results[str(size)] = {'skipped': f"estimated fill {estimate_s:.0f} s over the {budget_s} s budget"}
+                print(f"[{label}] {size} rows skipped", file=sys.stderr)
+                continue
+        result = results[str(size)] = bench_size(size)
+        last = (size, result['fill']['median_ms'])
+        print(f"[{label}] {size} rows done", file=sys.stderr)
+    return results
+
+def bench_search(app, sizes, args, rng, models, customers):
+    from search_module import SearchModule
+
+    def bench_size(size):
+        bills = [dict(bill, _id=index) for index, bill in
+                 enumerate(datagen.generate_bills(size, models, customers, rng))]
+        search = SearchModule(db=args.database)
+        search.resize(1200, 800)
+        search.show()
+
+        def fill():
+            search.search_filters = {}
+            search.results.reset()
+            search.on_bills_loaded(bills)
+
+        result = measure_fill(app, search, fill, args.repeat, args.budget)
+        search.close()
+        search.deleteLater()
+        app.processEvents()
+        return result
+
+    return run_sizes('search', sizes, args.budget, bench_size)
+
+def bench_inventory(app, sizes, args, rng, admin):
+    from inventory_module import InventoryModule
+
+    def bench_size(size):
+        inventory = [{'model': model['model'], 'quantity': rng.randrange(100)}
+                     for model in datagen.generate_models(size, rng)]
+        module = InventoryModule(db=args.database)
+        module.is_admin = admin
+        module.show_stock_actions(admin)
+        module.resize(1200, 800)
+        module.show()
+        result = measure_fill(app, module, lambda: module.populate_inventory(inventory), args.repeat, args.budget)
+        module.close()
+        module.deleteLater()
+        app.processEvents()
+        return result
+
+    return run_sizes('inventory (admin)' if admin else 'inventory', sizes, args.budget, bench_size)
+
+def bench_preview(app, item_counts, repeat, rng, models, customers):
+    from billing_module import BillPreviewDialog
+    from invoice_template import invoice_cache
+    results = {}
+    # The main window reuses one dialog and swaps each bill in
+    reused = BillPreviewDialog()
+    for count in item_counts:
+        bill = datagen.make_bill(models, customers, rng, 'gst', date=datetime.now(),
+                                 items=datagen.generate_items(models, rng, count))
+        bill['invoice_number'] = 1
+        samples = {key: [] for key in ('generate_html', 'construct', 'layout', 'construct_cached',
+                                       'swap', 'swap_cached')}
+
+        def timed(key, fn):
+            start = time.perf_counter()
+            result = fn()
+            samples[key].append((time.perf_counter() - start) * 1000)
+            return result
+
+        for _ in range(repeat):
+            # Uncached: the invoice is rendered and laid out from scratch,
+            # on its own and as part of opening a dialog
+            invoice_cache.clear()
+            timed('layout', lambda: invoice_cache.document(bill).size())
+            invoice_cache.clear()
+            dialog = timed('construct', lambda: BillPreviewDialog(bill))
+            dialog.deleteLater()
+            # Cached: the same bill again, as when a preview is reopened
+            dialog = timed('construct_cached', lambda: BillPreviewDialog(bill))
+            dialog.deleteLater()
+            timed('swap_cached', lambda: reused.show_bill(bill))
+            invoice_cache.clear()
+            timed('swap', lambda: reused.show_bill(bill))
+            timed('generate_html', dialog.generate_bill_html)
+            app.processEvents()
+        results[str(count)] = {key: timings_summary(values) for key, values in samples.items()}
+        print(f"[preview] {count} items done", file=sys.stderr)
+    reused.deleteLater()
+    return results
+
+def print_table(report):
+    for screen in ('search', 'inventory', 'inventory (admin)'):
+        for size, result in report['results'].get(screen, {}).items():
+            if 'skipped' in result:
+                print(f"{screen:18} {size:>7} rows  skipped: {result['skipped']}")
+                continue
+            print(f"{screen:18} {size:>7} rows  fill {result['fill']['median_ms']:9.1f} ms  "
+                  f"paint {result['layout_paint']['median_ms']:8.1f} ms  "
+                  f"rss +{(result['rss_delta_bytes'] or 0) / 2 ** 20:7.1f} MB")
+    for count, result in report['results'].get('preview', {}).items():
+        print(f"{'preview':18} {count:>7} items html {result['generate_html']['median_ms']:7.2f} ms  "
+              f"construct {result['construct']['median_ms']:7.2f} ms  layout {result['layout']['median_ms']:7.2f} ms  "
+              f"swap {result['swap']['median_ms']:7.2f} ms")
+        print(f"{'preview (cached)':18} {count:>7} items "
+              f"construct {result['construct_cached']['median_ms']:7.2f} ms  "
+              f"swap {result['swap_cached']['median_ms']:7.2f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the table-heavy screens offscreen.")
+    parser.add_argument('--rows', default=','.join(map(str, DEFAULT_ROWS)), help="comma-separated table sizes")
+    parser.add_argument('--items', default=','.join(map(str, DEFAULT_ITEMS)), help="comma-separated items per bill")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per table size")
+    parser.add_argument('--preview-repeat', type=int, default=20, help="runs per bill size")
+    parser.add_argument('--budget', type=int, default=120, help="seconds one table fill may take")
+    parser.add_argument('--only', choices=['search', 'inventory', 'preview'], help="run one screen only")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    # The screens are handed rows directly. Left unconnected, the in-memory
+    # Database keeps InventoryModule from loading its own on construction.
+    from db_connection import Database
+    args.database = Database('memory')
+
+    rng = random.Random(args.seed)
+    models = datagen.generate_models(50, rng)
+    customers = datagen.generate_customers(2000, rng)
+    sizes = [int(size) for size in args.rows.split(',')]
+    report = {
+        'platform_plugin': os.environ['QT_QPA_PLATFORM'],
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'results': {},
+    }
+    if args.only in (None, 'search'):
+        report['results']['search'] = bench_search(app, sizes, args, rng, models, customers)
+    if args.only in (None, 'inventory'):
+        report['results']['inventory'] = bench_inventory(app, sizes, args, rng, admin=False)
+        report['results']['inventory (admin)'] = bench_inventory(app, sizes, args, rng, admin=True)
+    if args.only in (None, 'preview'):
+        item_counts = [int(count) for count in args.items.split(',')]
+        report['results']['preview'] = bench_preview(app, item_counts, args.preview_repeat, rng, models, customers)
+
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+import random
+
+from money import to_paise, to_rupees, line_rate, bill_totals
+
+# Synthetic shop data shaped like what BillingModule saves
+
+FIRST_NAMES = ['Aarav', 'Vivaan', 'Aditya', 'Sai', 'Arjun', 'Reyansh', 'Krishna', 'Ishaan',
+               'Ananya', 'Diya', 'Priya', 'Kavya', 'Sneha', 'Pooja', 'Rahul', 'Amit',
+               'Suresh', 'Ramesh', 'Vijay', 'Sunil', 'Ganesh', 'Mahesh', 'Prakash', 'Nitin']
+LAST_NAMES = ['Patil', 'Deshmukh', 'Kulkarni', 'Joshi', 'Shinde', 'Pawar', 'Jadhav', 'Wagh',
+              'Sharma', 'Verma', 'Gupta', 'Agrawal', 'Thakre', 'Bhoyar', 'Raut', 'Meshram']
+BUSINESSES = ['Motors', 'Auto Works', 'Electricals', 'Traders', 'Agencies', 'Solar', 'Enterprises']
+MODEL_SERIES = ['Black', 'Harvest', 'Felix', 'Z', 'CRTT', 'Flo', 'Hi Life', 'Current', 'Go', 'Pro']
+
+# Items per bill ~ lognormal(ITEMS_MU, ITEMS_SIGMA): mostly 1-3, a long tail
+# of bulk orders
+ITEMS_MU = 0.3
+ITEMS_SIGMA = 0.8
+MAX_ITEMS = 100
+
+# Stock large enough that benchmark sales never run out
+INITIAL_STOCK = 10 ** 9
+
+def generate_models(count, rng):
+    models = []
+    for index in range(count):
+        series = MODEL_SERIES[index % len(MODEL_SERIES)]
+        models.append({
+            'model': f"{series} {100 + index}",
+            'quantity': INITIAL_STOCK,
+            # Not stored; used to price generated items
+            'price': rng.randrange(2000, 15000, 50),
+        })
+    return models
+
+def random_gstin(rng):
+    digits = '0123456789'
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return (''.join(rng.choice(digits) for _ in range(2)) + ''.join(rng.choice(letters) for _ in range(5))
+            + ''.join(rng.choice(digits) for _ in range(4)) + rng.choice(letters) + '1Z' + rng.choice(digits))
+
+def generate_customers(count, rng):
+    customers = []
+    for index in range(count):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        if rng.random() < 0.3:
+            name += f" {rng.choice(BUSINESSES)}"
+        # Keep names unique, as the customers collection requires
+        name += f" {index}"
+        customers.append({'name': name, 'name_key': name.lower(), 'gstin': random_gstin(rng)})
+    return customers
+
+def item_count(rng):
+    return min(max(1, round(rng.lognormvariate(ITEMS_MU, ITEMS_SIGMA))), MAX_ITEMS)
+
+def generate_items(models, rng, count=None, discount=0):
+    items = []
+    for _ in range(count or item_count(rng)):
+        model = rng.choice(models)
+        quantity = rng.choice((1, 1, 1, 2, 2, 4))
+        rate = line_rate(to_paise(model['price']), discount * 100)
+        items.append({
+            'model': model['model'],
+            'quantity': quantity,
+            'discounted_price': to_rupees(rate),
+            'total': to_rupees(rate * quantity),
+        })
+    return items
+
+def make_bill(models, customers, rng, bill_type, date=None, items=None):
+    discount = rng.choice((0, 0, 0, 2, 5))
+    items = items if items is not None else generate_items(models, rng, discount=discount)
+    subtotal = sum(to_paise(item['total']) for item in items)
+    bill = {'bill_type': bill_type, 'items': items, 'discount': discount}
+    if bill_type == 'gst':
+        customer = rng.choice(customers)
+        totals = bill_totals(subtotal, 18 * 100)
+        bill.update({
+            'customer_name': customer['name'],
+            'customer_gstin': customer['gstin'],
+            'gst_percent': 18,
+        })
+    else:
+        buyback = rng.choice((0, 0, 500, 1000))
+        totals = bill_totals(subtotal, buyback=to_paise(buyback))
+        bill.update({
+            'customer_name': rng.choice(customers)['name'] if rng.random() < 0.4 else 'Customer',
+            'buyback': buyback,
+        })
+    bill.update({
+        'subtotal': to_rupees(totals.subtotal),
+        'cgst': to_rupees(totals.cgst),
+        'sgst': to_rupees(totals.sgst),
+        'total': to_rupees(totals.total),
+    })
+    if date is not None:
+        bill['date'] = date
+    return bill
+
+def generate_bills(count, models, customers, rng, gst_ratio=0.6, start=datetime(2021, 1, 1), days=3 * 365):
+    # Yields bills in date order with per-type invoice numbers, so very
+    # large sets can be loaded without holding them all in memory
+    step = timedelta(days=days) / max(count, 1)
+    numbers = {'gst': 1, 'non-gst': 1}
+    for index in range(count):
+        bill_type = 'gst' if rng.random() < gst_ratio else 'non-gst'
+        numbers[bill_type] += 1
+        bill = make_bill(models, customers, rng, bill_type, date=start + step * index)
+        bill['invoice_number'] = numbers[bill_type]
+        yield bill
+
+def _chunks(documents, size):
+    chunk = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def load(database, model_count=50, customer_count=2000, bill_count=1000, gst_ratio=0.6, seed=1, chunk_size=10000):
+    # Replaces the contents of a connected Database with synthetic data.
+    # Returns (models, customers) for generating further bills.
+    rng = random.Random(seed)
+    models = generate_models(model_count, rng)
+    customers = generate_customers(customer_count, rng)
+    db = database.db
+    for collection in (db.inventory, db.customers, db.bills):
+        collection.delete_many({})
+    db.inventory.insert_many([{'model': model['model'], 'quantity': model['quantity']} for model in models])
+    for chunk in _chunks(customers, chunk_size):
+        db.customers.insert_many([dict(customer) for customer in chunk], ordered=False)
+    last_numbers = {'gst': 1, 'non-gst': 1}
+    for chunk in _chunks(generate_bills(bill_count, models, customers, rng, gst_ratio), chunk_size):
+        for bill in chunk:
+            last_numbers[bill['bill_type']] = bill['invoice_number']
+        db.bills.insert_many(chunk, ordered=False)
+    db.counters.update_one({'_id': 'gst_invoice_counter'}, {'$set': {'seq': last_numbers['gst']}}, upsert=True)
+    db.counters.update_one({'_id': 'non_gst_invoice_counter'}, {'$set': {'seq': last_numbers['non-gst']}}, upsert=True)
+    database.inventory_cache.invalidate()
+    return models, customers
@@ -1,21 +1,130 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
-                            QTableWidget, QTableWidgetItem, QLabel, QLineEdit, 
+                            QTableView, QHeaderView, QLabel, QLineEdit, 
                             QComboBox, QSpinBox, QDoubleSpinBox, QMessageBox,
-                            QDialog, QTextEdit, QSizePolicy, QCompleter)
-from PyQt5.QtCore import Qt, pyqtSignal, QEvent, QStringListModel
+                            QDialog, QTextEdit, QSizePolicy, QCompleter, QScrollArea)
+from PyQt5.QtCore import (Qt, pyqtSignal, QEvent, QStringListModel, QTimer,
+                          QModelIndex, QAbstractTableModel, QRectF)
 from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
-from PyQt5.QtGui import QTextDocument, QFont, QPixmap
-from db_connection import Database, DatabaseError
+from PyQt5.QtGui import QTextDocument, QFont, QPixmap, QPainter
+from db_connection import get_database, DatabaseError, InsufficientStockError, StockContentionError, stock_quantities
+from db_worker import get_worker, show_error, BusyMixin
+from button_delegate import ButtonDelegate
+from money import to_paise, to_basis_points, to_rupees, format_rupees, line_rate, bill_totals
+from invoice_template import render_invoice_html, invoice_cache, branding
 from datetime import datetime
-import os
 import math
-import sys
+
+# Delay after the last keystroke before customer suggestions are refreshed
+CUSTOMER_SEARCH_DEBOUNCE_MS = 150
+CUSTOMER_SUGGESTION_LIMIT = 10
+# objectName of the preview dialog each window reuses
+PREVIEW_DIALOG_NAME = 'billPreviewDialog'
+
+LINE_ITEM_HEADERS = ['Model', 'Quantity', 'Price', 'Total', 'Actions']
+LINE_ITEM_ACTIONS_COLUMN = 4
+
+class LineItem:
+    # One row of the bill being built; rate is the per-unit price shown
+    # (after discount, and before GST on GST bills). Amounts are in paise.
+    __slots__ = ('model', 'quantity', 'rate', 'total')
+    
+    def __init__(self, model, quantity, rate, total):
+        self.model = model
+        self.quantity = quantity
+        self.rate = rate
+        self.total = total
+    
+    def to_dict(self):
+        return {
+            'model': self.model,
+            'quantity': self.quantity,
+            'discounted_price': to_rupees(self.rate),
+            'total': to_rupees(self.total)
+        }
+
+class LineItemsModel(QAbstractTableModel):
+    # The bill's line items and their running subtotal: the one source for
+    # the table, the totals and the saved bill
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+        self.subtotal = 0
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(LINE_ITEM_HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return LINE_ITEM_HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        item = self.items[index.row()]
+        column = index.column()
+        if column == 0:
+            return item.model
+        if column == 1:
+            return str(item.quantity)
+        if column == 2:
+            return format_rupees(item.rate)
+        if column == 3:
+            return format_rupees(item.total)
+        return None
+    
+    def append(self, item):
+        row = len(self.items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.items.append(item)
+        self.subtotal += item.total
+        self.endInsertRows()
+    
+    def remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        item = self.items.pop(row)
+        self.subtotal -= item.total
+        self.endRemoveRows()
+    
+    def clear(self):
+        self.beginResetModel()
+        self.items = []
+        self.subtotal = 0
+        self.endResetModel()
+    
+    def bill_items(self):
+        return [item.to_dict() for item in self.items]
+
+class InvoicePage(QWidget):
+    # Paints an invoice document as it is laid out. A QTextEdit lays its
+    # document out again on every setDocument, which would undo the cache.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = None
+    
+    def set_document(self, document):
+        self.document = document
+        size = document.size()
+        self.setFixedSize(math.ceil(size.width()), math.ceil(size.height()))
+        self.update()
+    
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), Qt.white)
+        if self.document is not None:
+            self.document.drawContents(painter, QRectF(event.rect()))
 
 class BillPreviewDialog(QDialog):
-    def __init__(self, bill_data, parent=None):
+    def __init__(self, bill_data=None, parent=None):
         super().__init__(parent)
-        self.bill_data = bill_data
+        self.bill_data = None
+        self.document = None
         self.setup_ui()
+        if bill_data is not None:
+            self.show_bill(bill_data)
     
     def setup_ui(self):
         try:
@@ -23,12 +132,11 @@ class BillPreviewDialog(QDialog):
             self.setModal(True)
             layout = QVBoxLayout()
             
-            # Create text widget for bill preview
-            self.text_edit = QTextEdit()
-            self.text_edit.setReadOnly(True)
-            self.text_edit.setFont(QFont('Arial', 12))
-            self.text_edit.setHtml(self.generate_bill_html())
-            layout.addWidget(self.text_edit)
+            self.page = InvoicePage()
+            self.preview = QScrollArea()
+            self.preview.setAlignment(Qt.AlignHCenter)
+            self.preview.setWidget(self.page)
+            layout.addWidget(self.preview)
             
             # Buttons
             btn_layout = QHBoxLayout()
@@ -49,207 +157,66 @@ class BillPreviewDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to setup bill preview: {str(e)}")
     
+    def show_bill(self, bill_data):
+        self.bill_data = bill_data
+        # Shared with earlier previews of the same bill, already laid out
+        self.document = invoice_cache.document(bill_data)
+        self.page.set_document(self.document)
+        self.preview.verticalScrollBar().setValue(0)
+    
     def generate_bill_html(self):
-        bill = self.bill_data
-        shop_gstin = "27DUSPS0660B1ZF"
-        shop_contact = "9922444406, 9405903830"
-        bank_details = {
-            'name': 'Bank of Maharashtra',
-            'branch': 'Hinganghat Branch',
-            'account': '60211537562',
-            'ifsc': 'MAHB0000059',
-            'pan': 'DUSPS0660B'
-        }
-        
-        def number_to_words(number):
-            units = ["", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine"]
-            teens = ["Ten", "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen"]
-            tens = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
-            if number == 0:
-                return "Zero"
-            def convert_less_than_thousand(n):
-                if n == 0:
-                    return ""
-                elif n < 10:
-                    return units[n]
-                elif n < 20:
-                    return teens[n - 10]
-                elif n < 100:
-                    return tens[n // 10] + (" " + units[n % 10] if n % 10 != 0 else "")
-                else:
-                    return units[n // 100] + " Hundred" + (" and " + convert_less_than_thousand(n % 100) if n % 100 != 0 else "")
-            def convert(n):
-                if n == 0:
-                    return ""
-                elif n < 1000:
-                    return convert_less_than_thousand(n)
-                elif n < 100000:
-                    return convert_less_than_thousand(n // 1000) + " Thousand" + (" " + convert_less_than_thousand(n % 1000) if n % 1000 != 0 else "")
-                elif n < 10000000:
-                    return convert_less_than_thousand(n // 100000) + " Lakh" + (" " + convert(n % 100000) if n % 100000 != 0 else "")
-                else:
-                    return convert_less_than_thousand(n // 10000000) + " Crore" + (" " + convert(n % 10000000) if n % 10000000 != 0 else "")
-            rupees = int(number)
-            paise = int((number - rupees) * 100)
-            result = convert(rupees) + " Rupees"
-            if paise > 0:
-                result += " and " + convert_less_than_thousand(paise) + " Paise"
-            return result
-        amount_in_words = number_to_words(bill['total'])
-        
-        # Get the correct path for the logo image
-        if getattr(sys, 'frozen', False):
-            # If the application is run as a bundle
-            application_path = sys._MEIPASS
-        else:
-            # If the application is run from a Python interpreter
-            application_path = os.path.dirname(os.path.abspath(__file__))
-            
-        logo_path = os.path.join(application_path, 'Amaron-Logo.png').replace('\\', '/') # Use forward slashes for HTML
-
-        html = f"""
-        <div style='font-family: Arial; font-size: 14px; padding: 24px;'>
-            <table width='800' style=' border-collapse: collapse; margin-bottom: 0;'>
-                <tr>
-                    <td width='600' style='vertical-align: top; padding: 0;'>
-                        <div style='font-size: 28px; font-weight: bold;'>Vaibhav Sales</div>
-                        <div style='font-size: 15px; margin-top: 2px;'>Deals Inverter, UPS and All Types of Batteries</div>
-                        <div style='font-size: 14px; margin-top: 2px;'>Tukdoji Square, Nehru Ward,<br>Hinganghat- 442301, Dist. Wardha (M.S.)</div>
-                    </td>
-                    <td style='vertical-align: top; width: 40%; text-align: right; padding: 0;'>
-                        <div style='font-size: 13px;'>Subject to Hinganghat Jurisdiction</div>
-                        <div style='font-size: 13px;'>GSTIN: {shop_gstin}</div>
-                        <div style='font-size: 13px;'>{shop_contact}</div>
-                        <div style='font-size: 13px; margin-top: 8px;'>Authorised Dealer:     </div><br>
-                        <img src='{logo_path}' width='160' height='40' style='object-fit: contain;'>
-                    </td>
-                </tr>
-            </table>
-            <hr style='border: 1px solid #000; margin: 10px 0 16px 0;'>
-            <table width='800' style='border-collapse: collapse; margin-bottom: 0;'>
-                <tr>
-                    <td width='650' style=' vertical-align: top; padding: 0;'>
-                        <span style='font-size: 17px; font-weight: bold;'>M/s. {bill['customer_name']}</span><br>
-                        {f"<span style='font-size: 13px;'>GSTIN: {bill.get('customer_gstin', '')}</span>" if bill['bill_type'] == 'gst' else ""}
-                    </td>
-                    <td width='150' style=' text-align: left; vertical-align: top; padding: 0;'>
-                        <span style='font-size: 13px;'><b>Bill No.:</b> {bill['invoice_number']}</span><br>
-                        <span style='font-size: 13px;'><b>Date:</b> {bill['date'].strftime('%Y-%m-%d')}</span>
-                    </td>
-                </tr>
-            </table>
-            <hr style='border: 1px solid #000; margin: 10px 0 16px 0;'>
-            <table cellpadding='10' border='0' width='800' style=' border-collapse: collapse; margin: 0 0 20px 0;'>
-                <tr style='background: #f0f0f0;'>
-                    <th width='50' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Sr. No.</th>
-                    <th width='470' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Particulars</th>
-                    <th width='80' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Qty</th>
-                    <th width='100' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Rate</th>
-                    <th width='100' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Amount</th>
-                </tr>
-        """
-        total_items = 0
-        for idx, item in enumerate(bill['items'], 1):
-            total_items += 1
-            html += f"""
-                <tr>
-                    <td style='border: 1px solid #000; padding: 8px; text-align: center;'>{idx}</td>
-                    <td style='border: 1px solid #000; padding: 8px;'>{item['model']}</td>
-                    <td style='border: 1px solid #000; padding: 8px; text-align: center;'>{item['quantity']}</td>
-                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{item['discounted_price']:.2f}</td>
-                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{item['total']:.2f}</td>
-                </tr>
-            """
-        if total_items<10:
-            for _ in range(10 - total_items):
-                html += """
-                    <tr>
-                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
-                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
-                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
-                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
-                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
-                    </tr>
-                """
-        if bill['bill_type'] == 'gst':
-            html += f"""
-                <tr>
-                    <td rowspan='4' colspan='2' align='left' valign='bottom' style='border: 1px solid #000; padding: 8px;'><p><strong>Amount in words:</strong> {amount_in_words}</p></td>
-                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Subtotal</strong></td>
-                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{bill['subtotal']:.2f}</td>
-                </tr>
-                <tr>
-                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>CGST ({bill['gst_percent']/2:.1f}%)</strong></td>
-                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{bill['cgst']:.2f}</td>
-                </tr>
-                <tr>
-                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>SGST ({bill['gst_percent']/2:.1f}%)</strong></td>
-                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{bill['sgst']:.2f}</td>
-                </tr>
-            """
-        else:
-            html += f"""
-                <tr>
-                    <td rowspan='3' colspan='2' align='left' valign='bottom' style='border: 1px solid #000; padding: 8px;'><p><strong>Amount in words:</strong> {amount_in_words}</p></td>
-                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Subtotal</strong></td>
-                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{bill['subtotal']:.2f}</td>
-                </tr>
-                <tr>
-                    <td colspan='2' style='border: 1px solid #000; padding: 8px; text-align: right;'><strong>Buyback Amount</strong></td>
-                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{bill['buyback']:.2f}</td>
-                </tr>
-            """
-        html += f"""
-                <tr>
-                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Grand Total</strong></td>
-                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{bill['total']:.2f}</td>
-                </tr>
-            </table>
-            <div style='display: flex; margin: 20px 0;'>
-                <div style='width: 70%;'>
-                    
-                    <p style='margin: 10px 0;'>
-                        <strong>Bank Details:</strong><br>
-                        Name of Bank: {bank_details['name']}<br>
-                        {bank_details['branch']}<br>
-                        A/c No.: {bank_details['account']}<br>
-                        IFSC: {bank_details['ifsc']}<br>
-                        PAN: {bank_details['pan']}
-                    </p>
-                </div>
-                <div style='width: 30%; text-align: right;'>
-                    <p style='margin: 0;'>For, Vaibhav Sales</p>
-                    <div style='height: 50px;'></div>
-                    <p style='margin: 0;'>Auth. Signatory</p>
-                </div>
-            </div>
-            <hr style='border: 1px solid #000; margin: 20px 0;'>
-            <div style='display: flex; justify-content: space-between; font-size: 12px;'>
-                <div style='width: 70%;'>
-                    <p style='margin: 0;'>No Exchange, No Return. Receipt subject to clearance of cheque. Warranty applicable as per companies norms. No warranty for damage to any part.</p>
-                    <p style='margin: 5px 0;'>Thanks!</p>
-                </div>
-            </div>
-        </div>
-        """
-        return html
+        return render_invoice_html(self.bill_data)
     
     def print_bill(self):
         try:
             printer = QPrinter()
             dialog = QPrintDialog(printer, self)
             if dialog.exec_() == QDialog.Accepted:
-                self.text_edit.print_(printer)
+                self.document.print_(printer)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to print bill: {str(e)}")
 
-class BillingModule(QDialog):
-    bill_generated = pyqtSignal()
-    def __init__(self, parent=None):
+def preview_dialog(widget):
+    # The preview dialog of the widget's main window, made on first use and
+    # then reused for every bill, so opening a preview only swaps the
+    # document. An edit dialog opened from Search is a window of its own, so
+    # its parents are followed up to the main window's pre-warmed dialog.
+    window = widget.window()
+    while window.parentWidget() is not None:
+        window = window.parentWidget().window()
+    dialog = window.findChild(QDialog, PREVIEW_DIALOG_NAME, Qt.FindDirectChildrenOnly)
+    if dialog is None:
+        dialog = BillPreviewDialog(parent=window)
+        dialog.setObjectName(PREVIEW_DIALOG_NAME)
+    return dialog
+
+def warm_up_preview(widget):
+    # Builds the window's preview dialog and its native window, and decodes
+    # the invoice images, ahead of the first bill
+    dialog = preview_dialog(widget)
+    dialog.ensurePolished()
+    dialog.layout().activate()
+    dialog.winId()
+    branding.images()
+
+def preview_bill(widget, bill_data):
+    dialog = preview_dialog(widget)
+    dialog.show_bill(bill_data)
+    # Already open (a second request while it was showing): the new bill
+    # has been swapped in
+    if not dialog.isVisible():
+        dialog.exec_()
+
+class BillingModule(BusyMixin, QDialog):
+    # {model: change in stock} of the saved bill
+    bill_generated = pyqtSignal(object)
+    def __init__(self, parent=None, db=None):
         super().__init__(parent)
         try:
-            self.db = Database()
+            self.db = db if db is not None else get_database()
+            self.worker = get_worker()
             self.editing_invoice_number = None
+            self.editing_bill_type = None
             self.setup_ui()
             # Prefill customer name for non-GST bills
             if self.bill_type.currentText() == "Non-GST":
@@ -282,11 +249,17 @@ class BillingModule(QDialog):
             self._customer_completer = QCompleter(self)
             self._customer_completer.setCaseSensitivity(Qt.CaseInsensitive)
             self._customer_completer.setFilterMode(Qt.MatchContains)
-            self._customer_completer.setCompletionMode(QCompleter.PopupCompletion)
+            # Suggestions are already filtered by the customer index (which
+            # also matches GSTINs), so the completer shows them as given
+            self._customer_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
             self._customer_model = QStringListModel([], self)
             self._customer_completer.setModel(self._customer_model)
             self.customer_name.setCompleter(self._customer_completer)
             self._customer_completer.activated[str].connect(self._on_customer_chosen)
+            self._customer_search_timer = QTimer(self)
+            self._customer_search_timer.setSingleShot(True)
+            self._customer_search_timer.setInterval(CUSTOMER_SEARCH_DEBOUNCE_MS)
+            self._customer_search_timer.timeout.connect(self.update_customer_suggestions)
             
             # GST number
             self.gst_label = QLabel("GST Number:")
@@ -330,15 +303,20 @@ class BillingModule(QDialog):
             layout.addLayout(customer_layout)
             
             # Items table
-            self.table = QTableWidget()
-            self.table.setColumnCount(5)
-            self.table.setHorizontalHeaderLabels(['Model', 'Quantity', 'Price', 'Total', 'Actions'])
+            self.line_items = LineItemsModel(self)
+            self.table = QTableView()
+            self.table.setModel(self.line_items)
+            # The delegate reports the row clicked, so removals never act on a stale index
+            self.remove_buttons = ButtonDelegate(("×",), QFont('Arial', 12), button_size=(35, 35), parent=self.table)
+            self.remove_buttons.clicked.connect(lambda row, button: self.delete_item(row))
+            self.table.setItemDelegateForColumn(LINE_ITEM_ACTIONS_COLUMN, self.remove_buttons)
             self.table.horizontalHeader().setStretchLastSection(True)
             self.table.setFont(QFont('Arial', 14))
             self.table.horizontalHeader().setDefaultSectionSize(250)
+            self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
             self.table.verticalHeader().setDefaultSectionSize(50)
             self.table.setStyleSheet("""
-                QTableWidget {
+                QTableView {
                     font-size: 14px;
                 }
                 QHeaderView::section {
@@ -359,7 +337,8 @@ class BillingModule(QDialog):
             self.model_combo = QComboBox()
             self.model_combo.setFont(QFont('Arial', 12))
             self.model_combo.setMinimumHeight(35)
-            self.update_model_list()
+            if self.db.connected:
+                self.update_model_list()
             add_layout.addWidget(self.model_combo)
             
             quantity_label = QLabel("Quantity:")
@@ -385,11 +364,11 @@ class BillingModule(QDialog):
             self.price_spin.setDecimals(2)
             add_layout.addWidget(self.price_spin)
             
-            add_btn = QPushButton("Add Item")
-            add_btn.setFont(QFont('Arial', 12))
-            add_btn.setMinimumHeight(35)
-            add_btn.clicked.connect(self.add_item)
-            add_layout.addWidget(add_btn)
+            self.add_btn = QPushButton("Add Item")
+            self.add_btn.setFont(QFont('Arial', 12))
+            self.add_btn.setMinimumHeight(35)
+            self.add_btn.clicked.connect(self.add_item)
+            add_layout.addWidget(self.add_btn)
             
             layout.addLayout(add_layout)
             
@@ -442,20 +421,24 @@ class BillingModule(QDialog):
             calculate_btn.setFont(QFont('Arial', 12))
             calculate_btn.setMinimumHeight(40)
             calculate_btn.clicked.connect(self.calculate_total)
-            generate_btn = QPushButton("Generate Bill")
-            generate_btn.setFont(QFont('Arial', 12))
-            generate_btn.setMinimumHeight(40)
-            generate_btn.clicked.connect(self.generate_bill)
+            self.generate_btn = QPushButton("Generate Bill")
+            self.generate_btn.setFont(QFont('Arial', 12))
+            self.generate_btn.setMinimumHeight(40)
+            self.generate_btn.clicked.connect(self.generate_bill)
             clear_btn = QPushButton("Clear")
             clear_btn.setFont(QFont('Arial', 12))
             clear_btn.setMinimumHeight(40)
             clear_btn.clicked.connect(self.clear_bill)
             
             btn_layout.addWidget(calculate_btn)
-            btn_layout.addWidget(generate_btn)
+            btn_layout.addWidget(self.generate_btn)
             btn_layout.addWidget(clear_btn)
             layout.addLayout(btn_layout)
             
+            self.status_label = QLabel("")
+            self.status_label.setFont(QFont('Arial', 12))
+            layout.addWidget(self.status_label)
+            
             self.setLayout(layout)
             self.resize(1200, 800)
             self.toggle_gst(self.bill_type.currentText())
@@ -463,31 +446,55 @@ class BillingModule(QDialog):
             QMessageBox.critical(self, "Error", f"Failed to setup billing interface: {str(e)}")
     
     def on_customer_name_changed(self, text):
-        try:
-            if self.bill_type.currentText() != "GST":
-                self._customer_model.setStringList([])
-                return
-            names = [c['name'] for c in self.db.search_customers(text)]
-            if not names:
-                self._customer_model.setStringList([])
-                return
-            self._customer_model.setStringList(names)
+        if self.bill_type.currentText() != "GST" or not text.strip():
+            self._customer_search_timer.stop()
+            self._customer_model.setStringList([])
+            return
+        self._customer_search_timer.start()
+    
+    def busy_widgets(self):
+        return [self.add_btn, self.generate_btn]
+    
+    def _search_customers(self, text):
+        # Runs on the worker; the first call may have to load the index
+        return self.db.get_customer_index().search(text, CUSTOMER_SUGGESTION_LIMIT)
+    
+    def update_customer_suggestions(self):
+        text = self.customer_name.text()
+        if self.bill_type.currentText() != "GST" or not text.strip():
+            self._customer_model.setStringList([])
+            return
+        self.worker.submit(
+            self._search_customers, text, key=('customer-suggestions', id(self)),
+            on_result=self.show_customer_suggestions,
+            on_error=lambda error: show_error(self, error, "search customers")
+        )
+    
+    def show_customer_suggestions(self, names):
+        self._customer_model.setStringList(names)
+        if names:
             self.customer_name.completer().complete()
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to search customers: {str(e)}")
+    
+    def _lookup_gstin(self, name):
+        gstin = self.db.get_customer_index().get_gstin(name)
+        if gstin is None:
+            customer = self.db.get_customer(name) or {}
+            gstin = customer.get('gstin') or ''
+        return gstin
     
     def _on_customer_chosen(self, name):
-        try:
-            self.customer_name.setText(name)
-            customer = self.db.get_customer(name)
-            self.gst_input.setText(customer.get('gstin',''))
-            self.gst_input.setFocus()
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to get customer details: {str(e)}")
+        self.customer_name.setText(name)
+        self._customer_search_timer.stop()
+        self.worker.cancel(('customer-suggestions', id(self)))
+        self.worker.submit(
+            self._lookup_gstin, name, key=('customer-gstin', id(self)),
+            on_result=self.on_gstin_found,
+            on_error=lambda error: show_error(self, error, "get customer details")
+        )
+    
+    def on_gstin_found(self, gstin):
+        self.gst_input.setText(gstin)
+        self.gst_input.setFocus()
     
     def toggle_gst(self, bill_type):
         is_gst = bill_type == "GST"
@@ -505,92 +512,82 @@ class BillingModule(QDialog):
             self.customer_name.clear()
     
     def update_model_list(self):
-        try:
-            self.model_combo.clear()
-            inventory = self.db.get_inventory()
-            self.model_combo.addItems([item['model'] for item in inventory])
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to update model list: {str(e)}")
+        self.worker.submit(
+            self.db.get_inventory, key=('model-list', id(self)),
+            on_result=self.populate_model_list,
+            on_error=lambda error: show_error(self, error, "update model list")
+        )
+    
+    def populate_model_list(self, inventory):
+        self.model_combo.clear()
+        self.model_combo.addItems([item['model'] for item in inventory])
     
     def add_item(self):
         try:
             model = self.model_combo.currentText()
             quantity = self.quantity_spin.value()
-            price    = self.price_spin.value()
-            discount = self.discount_spin.value()
+            # Discounted, then reduced to the base price on GST bills
+            rate = line_rate(to_paise(self.price_spin.value()), to_basis_points(self.discount_spin.value()), self.gst())
 
-            if self.bill_type.currentText() == "GST":
-                gst_percent = self.gst_percent_input.value()
-                # 1. apply discount to entered price, then round
-                discounted_price = round(price * (1 - discount/100))
-                # 2. compute base price from discounted, then round
-                base_price = round(discounted_price / (1 + gst_percent/100))
-                # 3. amount = base_price * qty
-                amount = base_price * quantity
-                rate_to_display   = base_price
-                total_to_display  = amount
-            else:
-                # non-GST path unchanged
-                rate_to_display  = round(price * (1 - discount/100))
-                total_to_display = rate_to_display * quantity
-
-            inventory = self.db.get_inventory()
-            item = next((i for i in inventory if i['model'] == model), None)
-            if not item:
-                QMessageBox.warning(self, "Error", "Item not found in inventory")
-                return
-            if item['quantity'] < quantity:
-                QMessageBox.warning(self, "Error", "Insufficient stock")
-                return
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            self.table.setItem(row, 0, QTableWidgetItem(model))
-            self.table.setItem(row, 1, QTableWidgetItem(str(quantity)))
-            self.table.setItem(row, 2, QTableWidgetItem(f"₹{rate_to_display:.2f}"))
-            self.table.setItem(row, 3, QTableWidgetItem(f"₹{total_to_display:.2f}"))
-            delete_btn = QPushButton("×")
-            delete_btn.setFont(QFont('Arial', 12))
-            delete_btn.setFixedSize(35, 35)
-            delete_btn.clicked.connect(lambda: self.delete_item(row))
-            self.table.setCellWidget(row, 4, delete_btn)
+            def check_stock(stock):
+                if stock is None:
+                    QMessageBox.warning(self, "Error", "Item not found in inventory")
+                elif stock < quantity:
+                    QMessageBox.warning(self, "Error", "Insufficient stock")
+                else:
+                    self.append_item_row(model, quantity, rate, rate * quantity)
+            
+            self.set_busy(True, "Checking stock…")
+            self.worker.submit(
+                self.db.get_stock, model,
+                on_result=check_stock,
+                on_error=lambda error: show_error(self, error, "add item"),
+                on_done=lambda: self.set_busy(False)
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to add item: {str(e)}")
+    
+    def append_item_row(self, model, quantity, rate, total):
+        try:
+            self.line_items.append(LineItem(model, quantity, rate, total))
             self.calculate_total()
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to add item: {str(e)}")
     
     def delete_item(self, row):
-        self.table.removeRow(row)
+        self.line_items.remove(row)
         self.calculate_total()
     
+    def gst(self):
+        # GST rate in basis points, or None on a Non-GST bill
+        if self.bill_type.currentText() == "GST":
+            return to_basis_points(self.gst_percent_input.value())
+        return None
+    
+    def totals(self):
+        gst = self.gst()
+        buyback = 0 if gst is not None else to_paise(self.buyback_spin.value())
+        return bill_totals(self.line_items.subtotal, gst, buyback)
+    
     def calculate_total(self):
         try:
-            subtotal = 0
-            for row in range(self.table.rowCount()):
-                amt = float(self.table.item(row, 3).text().replace('₹',''))
-                subtotal += amt
+            totals = self.totals()
             if self.bill_type.currentText() == "GST":
-                gst_percent = self.gst_percent_input.value()
-                gst_amount = subtotal * gst_percent / 100
-                cgst = sgst = gst_amount / 2
-                final_total = round(subtotal + gst_amount)
                 self.gst_amount_label.setText(
-                    f"CGST: ₹{cgst:.2f} | SGST: ₹{sgst:.2f}"
+                    f"CGST: {format_rupees(totals.cgst)} | SGST: {format_rupees(totals.sgst)}"
                 )
             else:
-                buyback = self.buyback_spin.value()
-                gst_amount = cgst = sgst = 0
-                final_total = subtotal - buyback
                 self.gst_amount_label.setText("")  # or hide
-            self.subtotal_label.setText(f"Subtotal: ₹{subtotal:.2f}")
-            self.total_label   .setText(f"Total: ₹{final_total:.2f}")
+            self.subtotal_label.setText(f"Subtotal: {format_rupees(totals.subtotal)}")
+            self.total_label   .setText(f"Total: {format_rupees(totals.total)}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to calculate total: {str(e)}")
     
     def clear_bill(self):
         self.editing_invoice_number = None
+        self.editing_bill_type = None
+        self.bill_type.setEnabled(True)
+        self.bill_type.setToolTip("")
         if self.bill_type.currentText() == "Non-GST":
             self.customer_name.setText("Customer")
         else:
@@ -598,7 +595,7 @@ class BillingModule(QDialog):
         self.gst_percent_input.setValue(28)
         self.discount_spin.setValue(0)
         self.buyback_spin.setValue(0)
-        self.table.setRowCount(0)
+        self.line_items.clear()
         self.gst_input.clear()
         self.model_combo.setCurrentIndex(-1)
         self.quantity_spin.setValue(0)
@@ -608,12 +605,16 @@ class BillingModule(QDialog):
     def setup_for_edit(self, bill):
         try:
             self.editing_invoice_number = bill['invoice_number']
+            self.editing_bill_type = bill['bill_type']
             self.customer_name.setText(bill['customer_name'])
-            self.bill_type.setCurrentText(bill['bill_type'].upper())
+            self.bill_type.setCurrentText("GST" if bill['bill_type'] == 'gst' else "Non-GST")
+            # The invoice number belongs to this type's series
+            self.bill_type.setEnabled(False)
+            self.bill_type.setToolTip("The type of a saved bill cannot be changed")
             self.discount_spin.setValue(bill['discount'])
             self.buyback_spin.setValue(bill.get('buyback', 0))
             self.gst_input.clear()
-            self.table.setRowCount(0)
+            self.line_items.clear()
             self.model_combo.setCurrentIndex(-1)
             self.quantity_spin.setValue(0)
             self.price_spin.setValue(0)
@@ -621,25 +622,15 @@ class BillingModule(QDialog):
                 self.gst_percent_input.setValue(bill['gst_percent'])
                 self.gst_input.setText(bill.get('customer_gstin', ''))
             for item in bill['items']:
-                row = self.table.rowCount()
-                self.table.insertRow(row)
-                self.table.setItem(row, 0, QTableWidgetItem(item['model']))
-                self.table.setItem(row, 1, QTableWidgetItem(str(item['quantity'])))
                 price = item.get('discounted_price', item.get('price', 0))
-                self.table.setItem(row, 2, QTableWidgetItem(f"₹{price:.2f}"))
-                self.table.setItem(row, 3, QTableWidgetItem(f"₹{item['total']:.2f}"))
-                delete_btn = QPushButton("×")
-                delete_btn.setFont(QFont('Arial', 12))
-                delete_btn.setFixedSize(35, 35)
-                delete_btn.clicked.connect(lambda _, r=row: self.delete_item(r))
-                self.table.setCellWidget(row, 4, delete_btn)
+                self.line_items.append(LineItem(item['model'], item['quantity'], to_paise(price), to_paise(item['total'])))
             self.calculate_total()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to setup bill for editing: {str(e)}")
 
     def generate_bill(self):
         try:
-            if self.table.rowCount() == 0:
+            if not self.line_items.items:
                 QMessageBox.warning(self, "Error", "No items in bill")
                 return
             customer_name = self.customer_name.text()
@@ -652,66 +643,64 @@ class BillingModule(QDialog):
                     QMessageBox.warning(self, "Error", "Please enter GST number for GST bill")
                     return
             self.calculate_total()
-            items = []
-            for row in range(self.table.rowCount()):
-                model = self.table.item(row, 0).text()
-                quantity = int(self.table.item(row, 1).text())
-                discounted_price = float(self.table.item(row, 2).text().replace('₹', ''))
-                total = float(self.table.item(row, 3).text().replace('₹', ''))
-                items.append({
-                    'model': model,
-                    'quantity': quantity,
-                    'discounted_price': discounted_price,
-                    'total': total
-                })
+            items = self.line_items.bill_items()
             bill_data = {
                 'customer_name': customer_name,
                 'bill_type': self.bill_type.currentText().lower(),
                 'items': items,
                 'discount': self.discount_spin.value(),
             }
+            totals = self.totals()
+            bill_data.update({
+                'subtotal': to_rupees(totals.subtotal),
+                'cgst': to_rupees(totals.cgst),
+                'sgst': to_rupees(totals.sgst),
+                'total': to_rupees(totals.total),
+            })
             if self.bill_type.currentText() == "GST":
-                gst_percent = self.gst_percent_input.value()
-                subtotal = sum(item['total'] for item in items)
-                gst_amount = subtotal * gst_percent / 100
-                cgst = gst_amount / 2
-                sgst = gst_amount / 2
-                final_total = round(subtotal + gst_amount)
                 bill_data.update({
-                    'gst_percent': gst_percent,
-                    'subtotal': subtotal,
-                    'cgst': cgst,
-                    'sgst': sgst,
-                    'total': final_total,
+                    'gst_percent': self.gst_percent_input.value(),
                     'customer_gstin': self.gst_input.text().strip()
                 })
             else:
-                subtotal = sum(item['total'] for item in items)
-                buyback  = self.buyback_spin.value()
-                final_total = subtotal - buyback
-                bill_data.update({
-                    'subtotal': subtotal,
-                    'cgst': 0,
-                    'sgst': 0,
-                    'total': final_total,
-                    'buyback': buyback
-                })
-            if self.editing_invoice_number:
-                self.db.update_bill(self.editing_invoice_number, bill_data)
-                bill_data['invoice_number'] = self.editing_invoice_number
+                bill_data['buyback'] = self.buyback_spin.value()
+            editing = self.editing_invoice_number is not None
+            if editing:
+                invoice_number = self.editing_invoice_number
+                call = (self.db.update_bill, self.editing_invoice_number, bill_data, self.editing_bill_type)
             else:
-                invoice_number = self.db.save_bill(bill_data)
-                bill_data['invoice_number'] = invoice_number
-                
-                for item in items:
-                    model = item['model']
-                    qty   = item['quantity']
-                    self.db.update_inventory(model, -qty)
-            dialog = BillPreviewDialog(bill_data, self)
-            dialog.exec_()
-            self.clear_bill()
-            self.bill_generated.emit()
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+                # Also takes the sold items out of stock
+                invoice_number = None
+                call = (self.db.save_bill, bill_data)
+            
+            def saved(result):
+                # update_bill returns the stock changes; save_bill the number
+                if editing:
+                    bill_data['invoice_number'] = invoice_number
+                    deltas = result
+                else:
+                    bill_data['invoice_number'] = result
+                    deltas = {model: -quantity for model, quantity in stock_quantities(items).items()}
+                preview_bill(self, bill_data)
+                self.clear_bill()
+                self.bill_generated.emit(deltas)
+                if editing:
+                    self.accept()
+            
+            self.set_busy(True, "Saving bill…")
+            self.worker.submit(
+                *call,
+                on_result=saved,
+                on_error=self.on_save_failed,
+                on_done=lambda: self.set_busy(False)
+            )
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to generate bill: {str(e)}") 
\ No newline at end of file
+            QMessageBox.critical(self, "Error", f"Failed to generate bill: {str(e)}")
+    
+    def on_save_failed(self, error):
+        if isinstance(error, InsufficientStockError):
+            QMessageBox.warning(self, "Insufficient Stock", str(error))
+        elif isinstance(error, StockContentionError):
+            QMessageBox.warning(self, "Stock Changed", str(error))
+        else:
+            show_error(self, error, "generate bill") 
\ No newline at end of file
@@ -0,0 +1,67 @@
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+from PyQt5.QtCore import Qt, QEvent, QRect, pyqtSignal
+
+# Gap between fixed-size buttons
+BUTTON_SPACING = 6
+
+class ButtonDelegate(QStyledItemDelegate):
+    # Paints a row of push buttons in every cell of a column and hit-tests
+    # clicks on them, instead of the table holding real button widgets per
+    # row. clicked carries the row and the index of the button in labels.
+    clicked = pyqtSignal(int, int)
+
+    def __init__(self, labels, font, button_size=None, parent=None):
+        super().__init__(parent)
+        self.labels = labels
+        self.font = font
+        # (width, height) to centre fixed-size buttons; None splits the cell
+        self.button_size = button_size
+        self._pressed = None
+
+    def button_rects(self, rect):
+        count = len(self.labels)
+        if self.button_size is None:
+            width = rect.width() // count
+            return [QRect(rect.left() + width * n, rect.top(), width, rect.height()) for n in range(count)]
+        width, height = self.button_size
+        left = rect.left() + (rect.width() - width * count - BUTTON_SPACING * (count - 1)) // 2
+        top = rect.top() + (rect.height() - height) // 2
+        return [QRect(left + (width + BUTTON_SPACING) * n, top, width, height) for n in range(count)]
+
+    def button_at(self, rect, pos):
+        for button, button_rect in enumerate(self.button_rects(rect)):
+            if button_rect.contains(pos):
+                return button
+        return None
+
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget else QApplication.style()
+        painter.save()
+        painter.setFont(self.font)
+        for label, rect in zip(self.labels, self.button_rects(option.rect)):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = label
+            button.fontMetrics = painter.fontMetrics()
+            button.state = QStyle.State_Raised
+            if option.state & QStyle.State_Enabled:
+                button.state |= QStyle.State_Enabled
+            style.drawControl(QStyle.CE_PushButton, button, painter, option.widget)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        # Consumes every mouse click in the column, so a double-click on a
+        # button does not also trigger the view's doubleClicked
+        if event.type() not in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick):
+            return False
+        if event.button() != Qt.LeftButton:
+            return False
+        button = self.button_at(option.rect, event.pos())
+        if event.type() == QEvent.MouseButtonPress:
+            self._pressed = (index.row(), button)
+        elif event.type() == QEvent.MouseButtonRelease:
+            pressed, self._pressed = self._pressed, None
+            # A click counts only if released over the button it started on
+            if button is not None and pressed == (index.row(), button):
+                self.clicked.emit(index.row(), button)
+        return True
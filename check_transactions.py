@@ -0,0 +1,133 @@
+import argparse
+import os
+import sys
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# Saves, updates and deletes a bill in a scratch database and checks that
+# stock, the invoice counter and the bill all move together, and that a
+# stock shortfall rolls every one of them back. Needs a replica set for the
+# transactions; with no replica set at --url it prints "skipped" and exits 0:
+#   python check_transactions.py --url mongodb://localhost:27017/?replicaSet=rs0
+#   python check_transactions.py --backend memory    # the embedded store
+
+DEFAULT_URL = 'mongodb://localhost:27017/?replicaSet=rs0'
+CHECK_DB_NAME = 'battery_shop_transaction_check'
+MODEL_A = 'CHECK-A'
+MODEL_B = 'CHECK-B'
+
+def replica_set_problem(url):
+    # None when url answers as a replica set member, otherwise the reason not
+    client = MongoClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        hello = client.admin.command('hello')
+    except PyMongoError as e:
+        return f"no server at {url} ({e.__class__.__name__})"
+    finally:
+        client.close()
+    if 'setName' not in hello:
+        return f"{url} is a standalone server, transactions need a replica set"
+    return None
+
+def make_bill(items):
+    return {
+        'bill_type': 'gst',
+        'customer_name': 'Transaction Check',
+        'customer_gstin': '29ABCDE1234F1Z5',
+        'items': [{'model': model, 'quantity': quantity, 'price': 100.0} for model, quantity in items.items()],
+        'total': 100.0 * sum(items.values()),
+    }
+
+def run_checks(database):
+    from db_connection import InsufficientStockError, invoice_counter_id, stock_changes
+
+    failures = []
+
+    def check(name, passed):
+        print(f"{'ok' if passed else 'FAIL':5} {name}")
+        if not passed:
+            failures.append(name)
+
+    def state():
+        stock = {item['model']: item['quantity'] for item in database.inventory.find(
+            {'model': {'$in': [MODEL_A, MODEL_B]}}, {'_id': 0, 'model': 1, 'quantity': 1})}
+        counter = database.db.counters.find_one({'_id': invoice_counter_id('gst')})['seq']
+        return stock, counter, database.bills.count_documents({})
+
+    def rejected(call, expected):
+        before = state()
+        try:
+            call()
+        except InsufficientStockError as e:
+            return e.shortfalls == expected and state() == before
+        return False
+
+    database.add_new_model(MODEL_A)
+    database.add_new_model(MODEL_B)
+    database.update_inventory(MODEL_A, 5)
+    stock, counter, bills = state()
+    check("stock set up", stock == {MODEL_A: 5, MODEL_B: 0})
+
+    number = database.save_bill(make_bill({MODEL_A: 2}))
+    after = state()
+    check("save takes stock and a number", after == ({MODEL_A: 3, MODEL_B: 0}, counter + 1, bills + 1)
+          and number == counter + 1)
+    check("save upserts the customer", database.get_customer('Transaction Check') is not None)
+
+    check("save short of stock rolls back",
+          rejected(lambda: database.save_bill(make_bill({MODEL_A: 3, MODEL_B: 1})), {MODEL_B: 1}))
+
+    def number_then_fail(session):
+        # save_bill checks stock before taking a number; this fails after
+        database._next_invoice_number('gst', session)
+        database.inventory.bulk_write(stock_changes({MODEL_A: -1}), ordered=False, session=session)
+        raise InsufficientStockError({MODEL_A: 1})
+    check("failed transaction rolls back the counter",
+          rejected(lambda: database.run_transaction(number_then_fail), {MODEL_A: 1}))
+
+    database.update_bill(number, make_bill({MODEL_A: 4}), 'gst')
+    check("update takes the extra units", state()[0] == {MODEL_A: 1, MODEL_B: 0})
+    check("update short of stock rolls back",
+          rejected(lambda: database.update_bill(number, make_bill({MODEL_A: 4, MODEL_B: 1}), 'gst'), {MODEL_B: 1}))
+    items = database.get_bill(number, 'gst')['items']
+    check("rolled back update leaves the bill", [(item['model'], item['quantity']) for item in items] == [(MODEL_A, 4)])
+
+    check("delete removes the bill", database.delete_bill(number, 'gst') and database.get_bill(number, 'gst') is None)
+    check("delete returns the stock", state() == ({MODEL_A: 5, MODEL_B: 0}, counter + 1, bills))
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that bill writes commit and roll back as one transaction.")
+    parser.add_argument('--backend', choices=['mongo', 'memory'], default='mongo')
+    parser.add_argument('--url', default=DEFAULT_URL, help=f"replica set to check against (default {DEFAULT_URL})")
+    args = parser.parse_args(argv)
+
+    if args.backend == 'mongo':
+        problem = replica_set_problem(args.url)
+        if problem:
+            print(f"skipped: {problem}")
+            return 0
+        # Set before Database reads .env, which never overrides them
+        os.environ['DB_URL'] = args.url
+    os.environ['DB_NAME'] = CHECK_DB_NAME
+
+    from db_connection import Database
+    database = Database(args.backend)
+    if args.backend == 'mongo':
+        database.client.drop_database(CHECK_DB_NAME)
+    try:
+        database.connect()
+        if not database.supports_transactions:
+            print("skipped: server does not support transactions")
+            return 0
+        failures = run_checks(database)
+    finally:
+        if args.backend == 'mongo':
+            database.client.drop_database(CHECK_DB_NAME)
+            database.client.close()
+    print(f"{len(failures)} checks failed" if failures else "All checks passed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import bisect
+import threading
+
+def customer_search_key(name):
+    # Lower-cased, trimmed copy of the customer name stored as name_key so
+    # case-insensitive prefix searches can be answered from an index
+    return (name or '').strip().lower()
+
+class CustomerIndex:
+    # In-memory prefix index over customer names and GSTINs. Both are kept as
+    # sorted (key, name) lists so a prefix lookup is a bisect plus a short walk.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._gstins = {}
+        self._by_name = []
+        self._by_gstin = []
+        self.loaded = False
+
+    def load(self, customers):
+        gstins = {}
+        for customer in customers:
+            gstins[customer['name']] = customer.get('gstin') or ''
+        by_name = sorted((customer_search_key(name), name) for name in gstins)
+        by_gstin = sorted((gstin.lower(), name) for name, gstin in gstins.items() if gstin)
+        with self._lock:
+            self._gstins = gstins
+            self._by_name = by_name
+            self._by_gstin = by_gstin
+            self.loaded = True
+
+    def add(self, name, gstin=None):
+        gstin = gstin or ''
+        with self._lock:
+            if name in self._gstins:
+                old_gstin = self._gstins[name]
+                if old_gstin == gstin:
+                    return
+                if old_gstin:
+                    self._remove(self._by_gstin, (old_gstin.lower(), name))
+            else:
+                bisect.insort(self._by_name, (customer_search_key(name), name))
+            self._gstins[name] = gstin
+            if gstin:
+                bisect.insort(self._by_gstin, (gstin.lower(), name))
+
+    def _remove(self, entries, entry):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def _prefix_matches(self, entries, key, limit):
+        matches = []
+        position = bisect.bisect_left(entries, (key,))
+        while position < len(entries) and len(matches) < limit:
+            entry_key, name = entries[position]
+            if not entry_key.startswith(key):
+                break
+            matches.append(name)
+            position += 1
+        return matches
+
+    def search(self, text, limit=10):
+        key = customer_search_key(text)
+        if not key:
+            return []
+        with self._lock:
+            names = self._prefix_matches(self._by_name, key, limit)
+            if len(names) < limit:
+                for name in self._prefix_matches(self._by_gstin, key, limit):
+                    if name not in names:
+                        names.append(name)
+                        if len(names) == limit:
+                            break
+        return names
+
+    def get_gstin(self, name):
+        with self._lock:
+            return self._gstins.get(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._gstins
+
+    def __len__(self):
+        with self._lock:
+            return len(self._gstins)
@@ -0,0 +1,361 @@
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+import asyncio
+import os
+from db_connection import (
+    DatabaseError, InsufficientStockError, StockContentionError, STOCK_RETRIES, CUSTOMER_INDEX_FIELDS, client_options, database_name,
+    get_database, load_env, is_saved_customer, stock_quantities, stock_changes, reservation_changes,
+    stock_shortfalls, check_bill_type_unchanged, stock_deltas, invoice_counter_id, bill_filter, changed_fields,
+    customer_search_query, customer_update, bill_search_query
+)
+from customer_index import CustomerIndex
+from db_metrics import instrument
+
+# main.load_startup_data runs this many reads at once, so the pool needs
+# no more sockets than that
+STARTUP_QUERIES = 3
+
+@instrument
+class AsyncDatabase:
+    # asyncio counterpart of db_connection.Database with the same public
+    # methods as coroutines, for DbWorker.submit_async. MongoDB only, so
+    # there is no outbox. It shares the Database's inventory cache, customer
+    # index and server capabilities, and builds every query with the same
+    # db_connection helpers. The pool is sized for the startup reads
+    # MainWindow runs concurrently; close() it when done.
+    def __init__(self, database):
+        try:
+            load_env()
+            self.database = database
+            self.metrics = database.metrics
+            options = client_options()
+            options.update(maxPoolSize=STARTUP_QUERIES, minPoolSize=0)
+            self.client = AsyncMongoClient(os.getenv('DB_URL'), **options)
+            self.db = self.client[database_name()]
+
+            # Collections
+            self.inventory = self.db['inventory']
+            self.bills = self.db['bills']
+            self.customers = self.db['customers']
+
+            self.inventory_cache = database.inventory_cache
+        except Exception as e:
+            raise DatabaseError(f"Database initialization error: {str(e)}")
+
+    async def connect(self):
+        if not self.database.connected:
+            await asyncio.to_thread(self.database.connect)
+
+    async def run_transaction(self, callback):
+        # Same contract as Database.run_transaction, with callback a coroutine
+        if not self.database.supports_transactions:
+            return await callback(None)
+        async with self.client.start_session() as session:
+            return await session.with_transaction(callback)
+
+    async def _next_invoice_number(self, bill_type, session=None):
+        counter = await self.db.counters.find_one_and_update(
+            {'_id': invoice_counter_id(bill_type)},
+            {'$inc': {'seq': 1}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        return counter['seq']
+
+    async def get_next_invoice_number(self, bill_type):
+        try:
+            return await self._next_invoice_number(bill_type)
+        except Exception as e:
+            raise DatabaseError(f"Failed to generate invoice number: {str(e)}")
+
+    async def add_new_model(self, model):
+        try:
+            record = {'model': model, 'quantity': 0}
+            with self.inventory_cache.writing():
+                await self.inventory.insert_one(record)
+                self.inventory_cache.add(record)
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            raise DatabaseError(f"Failed to add new model: {str(e)}")
+
+    async def update_inventory(self, model, quantity):
+        try:
+            with self.inventory_cache.writing():
+                await self.inventory.update_one({'model': model}, {'$inc': {'quantity': quantity}})
+                self.inventory_cache.apply({model: quantity})
+        except Exception as e:
+            raise DatabaseError(f"Failed to update inventory: {str(e)}")
+
+    async def get_stock(self, model):
+        await self._ensure_inventory_cache()
+        item = self.inventory_cache.get(model)
+        return item['quantity'] if item else None
+
+    async def _reserve_stock(self, model, quantity, session=None):
+        result = await self.inventory.update_one(
+            {'model': model, 'quantity': {'$gte': quantity}},
+            {'$inc': {'quantity': -quantity}},
+            session=session
+        )
+        if result.matched_count:
+            return 0
+        item = await self.inventory.find_one({'model': model}, {'_id': 0, 'quantity': 1}, session=session)
+        return stock_shortfalls({model: quantity}, {model: item['quantity'] if item else 0})[model]
+
+    async def _reserve_stock_batch(self, quantities, session=None):
+        # See Database._reserve_stock_batch
+        if not quantities:
+            return {}
+        if session is None:
+            reserved = {}
+            try:
+                for model, quantity in quantities.items():
+                    shortfall = await self._reserve_stock(model, quantity)
+                    if shortfall:
+                        return {model: shortfall}
+                    reserved[model] = quantity
+                reserved = {}
+                return {}
+            finally:
+                if reserved:
+                    await self.inventory.bulk_write(stock_changes(reserved), ordered=False)
+        result = await self.inventory.bulk_write(reservation_changes(quantities), ordered=False, session=session)
+        if result.matched_count == len(quantities):
+            return {}
+        # Read outside the session to see stock as it was before this transaction
+        cursor = self.inventory.find({'model': {'$in': list(quantities)}}, {'_id': 0, 'model': 1, 'quantity': 1})
+        available = {item['model']: item['quantity'] for item in await cursor.to_list()}
+        return stock_shortfalls(quantities, available)
+
+    async def _retry_reservation(self, callback):
+        # See Database._retry_reservation
+        for attempt in range(STOCK_RETRIES):
+            try:
+                return await callback()
+            except StockContentionError:
+                if attempt == STOCK_RETRIES - 1:
+                    raise
+
+    async def reserve_stock(self, model, quantity):
+        try:
+            with self.inventory_cache.writing():
+                shortfall = await self._retry_reservation(lambda: self._reserve_stock(model, quantity))
+                if not shortfall:
+                    self.inventory_cache.apply({model: -quantity})
+            return shortfall
+        except StockContentionError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to reserve stock: {str(e)}")
+
+    async def reserve_stock_batch(self, items):
+        try:
+            quantities = stock_quantities(items)
+            async def commit(session):
+                shortfalls = await self._reserve_stock_batch(quantities, session)
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+            with self.inventory_cache.writing():
+                await self._retry_reservation(lambda: self.run_transaction(commit))
+                self.inventory_cache.apply({model: -quantity for model, quantity in quantities.items()})
+            return {}
+        except InsufficientStockError as e:
+            return e.shortfalls
+        except StockContentionError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to reserve stock: {str(e)}")
+
+    async def refresh_inventory(self):
+        try:
+            generation = self.inventory_cache.load_generation()
+            self.inventory_cache.load(await self.inventory.find().to_list(), generation)
+        except Exception as e:
+            raise DatabaseError(f"Failed to get inventory: {str(e)}")
+
+    async def _ensure_inventory_cache(self):
+        if not self.inventory_cache.is_fresh():
+            await self.refresh_inventory()
+
+    async def get_inventory(self, refresh=False):
+        if refresh:
+            await self.refresh_inventory()
+        else:
+            await self._ensure_inventory_cache()
+        return self.inventory_cache.items()
+
+    async def search_customers(self, name, mode='prefix', limit=10):
+        try:
+            query, sort_field = customer_search_query(name, mode)
+            cursor = self.customers.find(query).sort(sort_field, 1)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list()
+        except DatabaseError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to search customers: {str(e)}")
+
+    async def get_customer_index(self):
+        index = self.database._customer_index
+        if index is None:
+            try:
+                customers = await self.customers.find({}, CUSTOMER_INDEX_FIELDS).to_list()
+            except Exception as e:
+                raise DatabaseError(f"Failed to load customers: {str(e)}")
+            index = CustomerIndex()
+            index.load(customers)
+            index = self.database.set_customer_index(index)
+        return index
+
+    async def get_customer(self, name):
+        try:
+            return await self.customers.find_one({'name': name})
+        except Exception as e:
+            raise DatabaseError(f"Failed to get customer: {str(e)}")
+
+    async def _upsert_customer(self, name, gstin=None, session=None):
+        await self.customers.update_one({'name': name}, customer_update(name, gstin), upsert=True, session=session)
+
+    async def save_customer(self, name, gstin=None):
+        try:
+            await self._upsert_customer(name, gstin)
+            self.database._customer_saved(name, gstin)
+        except Exception as e:
+            raise DatabaseError(f"Failed to save customer: {str(e)}")
+
+    async def save_bill(self, bill_data):
+        try:
+            bill_data['date'] = datetime.now()
+            quantities = stock_quantities(bill_data['items'])
+
+            async def commit(session):
+                shortfalls = await self._reserve_stock_batch(quantities, session)
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+                bill = dict(bill_data)
+                bill['invoice_number'] = await self._next_invoice_number(bill['bill_type'], session)
+                if is_saved_customer(bill):
+                    await self._upsert_customer(bill['customer_name'], bill.get('customer_gstin'), session)
+                await self.bills.insert_one(bill, session=session)
+                return bill
+
+            with self.inventory_cache.writing():
+                bill = await self._retry_reservation(lambda: self.run_transaction(commit))
+                self.inventory_cache.apply({model: -quantity for model, quantity in quantities.items()})
+            bill_data['invoice_number'] = bill['invoice_number']
+            bill_data['_id'] = bill['_id']
+            if is_saved_customer(bill_data):
+                self.database._customer_saved(bill_data['customer_name'], bill_data.get('customer_gstin'))
+            return bill_data['invoice_number']
+        except (InsufficientStockError, StockContentionError):
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to save bill: {str(e)}")
+
+    async def update_bill(self, invoice_number, bill_data, bill_type=None):
+        try:
+            bill_key = bill_filter(invoice_number, bill_type)
+            bill_data['date'] = datetime.now()
+            new_items = stock_quantities(bill_data['items'])
+
+            async def commit(session):
+                old_bill = await self.bills.find_one(bill_key, session=session)
+                if not old_bill:
+                    raise DatabaseError(f"Bill #{invoice_number} not found")
+                check_bill_type_unchanged(old_bill, bill_data)
+                deltas = stock_deltas(stock_quantities(old_bill['items']), new_items)
+                shortfalls = await self._reserve_stock_batch(
+                    {model: -delta for model, delta in deltas.items() if delta < 0}, session
+                )
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+                changes = stock_changes({model: delta for model, delta in deltas.items() if delta > 0})
+                if changes:
+                    await self.inventory.bulk_write(changes, ordered=False, session=session)
+
+                changed = changed_fields(old_bill, bill_data)
+                if changed:
+                    await self.bills.update_one(bill_key, {'$set': changed}, session=session)
+
+                if is_saved_customer(bill_data):
+                    await self._upsert_customer(bill_data['customer_name'], bill_data.get('customer_gstin'), session)
+                return deltas
+
+            with self.inventory_cache.writing():
+                deltas = await self._retry_reservation(lambda: self.run_transaction(commit))
+                self.inventory_cache.apply(deltas)
+            if is_saved_customer(bill_data):
+                self.database._customer_saved(bill_data['customer_name'], bill_data.get('customer_gstin'))
+            return deltas
+        except (InsufficientStockError, StockContentionError):
+            raise
+        except DatabaseError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to update bill: {str(e)}")
+
+    async def delete_bill(self, invoice_number, bill_type=None):
+        try:
+            bill_key = bill_filter(invoice_number, bill_type)
+
+            async def commit(session):
+                bill = await self.bills.find_one_and_delete(bill_key, {'items': 1}, session=session)
+                if not bill:
+                    return None
+                deltas = stock_quantities(bill['items'])
+                changes = stock_changes(deltas)
+                if changes:
+                    await self.inventory.bulk_write(changes, ordered=False, session=session)
+                return deltas
+
+            with self.inventory_cache.writing():
+                deltas = await self.run_transaction(commit)
+                if deltas is None:
+                    return False
+                self.inventory_cache.apply(deltas)
+            return True
+        except Exception as e:
+            raise DatabaseError(f"Failed to delete bill: {str(e)}")
+
+    async def get_bill(self, invoice_number, bill_type=None):
+        try:
+            return await self.bills.find_one(bill_filter(invoice_number, bill_type))
+        except Exception as e:
+            raise DatabaseError(f"Failed to get bill: {str(e)}")
+
+    async def search_bills(self, customer_name=None, start_date=None, end_date=None, bill_type=None,
+                           fields=None, sort_key='date', descending=True, page_size=None, after=None):
+        try:
+            query, projection, sort = bill_search_query(
+                customer_name, start_date, end_date, bill_type, fields, sort_key, descending, after
+            )
+            cursor = self.bills.find(query, projection).sort(sort)
+            if page_size:
+                cursor = cursor.limit(page_size)
+            return await cursor.to_list()
+        except Exception as e:
+            raise DatabaseError(f"Failed to search bills: {str(e)}")
+
+    async def close(self):
+        await self.client.close()
+
+_async_database = None
+
+def get_async_database():
+    # Companion to db_connection.get_database; only use it from coroutines
+    # run by DbWorker.submit_async
+    global _async_database
+    if _async_database is None:
+        _async_database = AsyncDatabase(get_database(connect=False))
+    return _async_database
+
+async def close_async_database():
+    # Leaves the shared Database's pool as the only one
+    global _async_database
+    if _async_database is not None:
+        database, _async_database = _async_database, None
+        await database.close()
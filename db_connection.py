@@ -1,63 +1,440 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from datetime import datetime
+import bisect
+import contextlib
 import os
+import re
 import sys
+import threading
+import logging
+import time
 from dotenv import load_dotenv
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError
+from db_indexes import ensure_indexes
+from customer_index import CustomerIndex, customer_search_key
+from local_store import LocalClient, UpdateRequest
+from db_metrics import get_metrics, instrument
+
+logger = logging.getLogger(__name__)
 
 class DatabaseError(Exception):
     pass
 
-class Database:
+class InsufficientStockError(DatabaseError):
+    def __init__(self, shortfalls):
+        # shortfalls maps model -> number of units missing
+        self.shortfalls = shortfalls
+        details = ", ".join(f"{model} (short by {missing})" for model, missing in sorted(shortfalls.items()))
+        super().__init__(f"Insufficient stock: {details}")
+
+class StockContentionError(DatabaseError):
+    # A reservation that found neither enough stock nor a shortfall: another
+    # counter changed the stock at the same moment
     def __init__(self):
+        super().__init__("Stock was changed at another counter while saving. Please try again.")
+
+def get_application_path():
+    if getattr(sys, 'frozen', False):
+        # If the application is run as a bundle
+        return sys._MEIPASS
+    # If the application is run from a Python interpreter
+    return os.path.dirname(os.path.abspath(__file__))
+
+_env_loaded = False
+
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv(os.path.join(get_application_path(), '.env'))
+        _env_loaded = True
+
+def _int_env(name, default):
+    value = os.getenv(name)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+def client_options():
+    # Pool and wire settings shared by every connection the app opens.
+    # Defaults suit a single counter PC on a slow link to Atlas.
+    load_env()
+    options = {
+        'maxPoolSize': _int_env('DB_MAX_POOL_SIZE', 10),
+        'minPoolSize': _int_env('DB_MIN_POOL_SIZE', 1),
+        'maxIdleTimeMS': _int_env('DB_MAX_IDLE_TIME_MS', 300000),
+        'connectTimeoutMS': _int_env('DB_CONNECT_TIMEOUT_MS', 10000),
+        'serverSelectionTimeoutMS': _int_env('DB_SERVER_SELECTION_TIMEOUT_MS', 30000),
+        'retryWrites': True,
+    }
+    metrics = get_metrics()
+    if metrics is not None:
+        options['event_listeners'] = [metrics]
+    compressors = os.getenv('DB_COMPRESSORS', 'zlib').strip()
+    if compressors:
+        options['compressors'] = compressors
+        if 'zlib' in compressors:
+            options['zlibCompressionLevel'] = _int_env('DB_ZLIB_LEVEL', 6)
+    return options
+
+def get_data_path():
+    # Writable folder for local data; a bundle's own folder is temporary
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return get_application_path()
+
+def create_client(backend):
+    # backend is DB_BACKEND: MongoDB (Atlas or a local server), an embedded
+    # SQLite file, or a throwaway in-memory store for benchmarks and tests.
+    # 'offline' is the SQLite file plus an outbox synced to MongoDB.
+    # The local stores offer the subset of the PyMongo API Database uses.
+    if backend == 'mongo':
+        # MongoClient connects lazily in the background; nothing here blocks
+        return MongoClient(os.getenv('DB_URL'), **client_options())
+    if backend in ('sqlite', 'offline'):
+        return LocalClient(os.getenv('DB_PATH') or os.path.join(get_data_path(), 'battery_shop.sqlite3'))
+    if backend == 'memory':
+        return LocalClient()
+    raise DatabaseError(f"Unknown storage backend: {backend}")
+
+def database_name():
+    # Benchmarks point this elsewhere so they never touch the shop's data
+    return os.getenv('DB_NAME') or 'battery_shop'
+
+# Times a stock reservation that lost a race is tried again
+STOCK_RETRIES = 3
+
+# Fields shown in the search results table
+BILL_SUMMARY_FIELDS = ['invoice_number', 'date', 'customer_name', 'bill_type',
+                       'items.model', 'items.quantity', 'total']
+# Fields the customer autocomplete index is built from
+CUSTOMER_INDEX_FIELDS = {'_id': 0, 'name': 1, 'gstin': 1}
+
+class InventoryCache:
+    # model -> record map plus a sorted view, kept current in place by the
+    # Database write paths. Other counters' changes are picked up when the
+    # cache is older than max_age seconds or refreshed explicitly.
+    #
+    # A load that overlaps a write may or may not have read it, while the
+    # write's delta is applied regardless. So writes run in writing(), which
+    # bumps the generation, and a load is only kept if no write started
+    # while it was reading; the deltas keep the records already held right.
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._items = {}
+        self._sorted = []
+        self._loaded = False
+        self._generation = 0
+        self._writes = 0
+
+    def is_fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+    @contextlib.contextmanager
+    def writing(self):
+        # From before the write reaches the server until its delta is applied
+        with self._lock:
+            self._writes += 1
+            self._generation += 1
         try:
-            # Get the correct path for .env file
-            if getattr(sys, 'frozen', False):
-                # If the application is run as a bundle
-                application_path = sys._MEIPASS
-            else:
-                # If the application is run from a Python interpreter
-                application_path = os.path.dirname(os.path.abspath(__file__))
-
-            # Load .env file from the correct location
-            env_path = os.path.join(application_path, '.env')
-            load_dotenv(env_path)
-            
-            # Connect to MongoDB Atlas
-            self.client = MongoClient(os.getenv('DB_URL'))
-            # Verify connection
-            self.client.admin.command('ping')
+            yield
+        finally:
+            with self._lock:
+                self._writes -= 1
+
+    def load_generation(self):
+        # Taken before reading the records passed to load()
+        with self._lock:
+            return None if self._writes else self._generation
+
+    def load(self, records, generation):
+        # Returns False if a write overlapped the read. The records are then
+        # dropped, unless there are none to fall back on: they are used but
+        # left stale, so the next read loads again.
+        records = list(records)
+        with self._lock:
+            current = generation is not None and generation == self._generation and not self._writes
+            if not current and self._loaded:
+                return False
+            self._items = {record['model']: record for record in records}
+            self._sorted = sorted(self._items.values(), key=lambda record: record['model'])
+            self._loaded = True
+            self.loaded_at = time.monotonic() if current else None
+            return current
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def items(self):
+        with self._lock:
+            return [dict(record) for record in self._sorted]
+
+    def get(self, model):
+        with self._lock:
+            record = self._items.get(model)
+            return dict(record) if record else None
+
+    def add(self, record):
+        with self._lock:
+            if record['model'] not in self._items:
+                self._items[record['model']] = record
+                position = bisect.bisect([item['model'] for item in self._sorted], record['model'])
+                self._sorted.insert(position, record)
+
+    def apply(self, deltas):
+        # {model: change in quantity}
+        with self._lock:
+            for model, delta in deltas.items():
+                record = self._items.get(model)
+                if record is not None:
+                    record['quantity'] += delta
+
+def is_saved_customer(bill_data):
+    return bill_data['bill_type'] == 'gst' and bill_data['customer_name'] != 'Customer'
+
+def stock_quantities(items):
+    quantities = {}
+    for item in items:
+        quantities[item['model']] = quantities.get(item['model'], 0) + item['quantity']
+    return quantities
+
+def stock_changes(deltas):
+    # One $inc per model with a non-zero change, for a single bulk_write
+    return [
+        UpdateRequest({'model': model}, {'$inc': {'quantity': delta}})
+        for model, delta in deltas.items() if delta != 0
+    ]
+
+def reservation_changes(quantities):
+    # Conditional decrements: each only matches when enough units are left
+    return [
+        UpdateRequest({'model': model, 'quantity': {'$gte': quantity}}, {'$inc': {'quantity': -quantity}})
+        for model, quantity in quantities.items()
+    ]
+
+def stock_shortfalls(quantities, available):
+    shortfalls = {
+        model: quantity - max(available.get(model, 0), 0)
+        for model, quantity in quantities.items() if available.get(model, 0) < quantity
+    }
+    if not shortfalls:
+        # Stock changed between the two reads, so nothing is short
+        raise StockContentionError()
+    return shortfalls
+
+def check_bill_type_unchanged(old_bill, bill_data):
+    # The type picks the invoice series the number belongs to, so a saved
+    # bill keeps it; to change it the bill is deleted and billed again
+    bill_type = old_bill.get('bill_type', bill_data['bill_type'])
+    if bill_data['bill_type'] != bill_type:
+        raise DatabaseError(
+            f"Bill #{old_bill['invoice_number']} is a {bill_type.upper()} bill; its type cannot be changed"
+        )
+
+def stock_deltas(old_items, new_items):
+    # Units to put back (positive) or take out (negative) when a bill's
+    # items change from old_items to new_items
+    return {
+        model: old_items.get(model, 0) - new_items.get(model, 0)
+        for model in set(old_items) | set(new_items)
+    }
+
+def invoice_counter_id(bill_type):
+    return 'gst_invoice_counter' if bill_type == 'gst' else 'non_gst_invoice_counter'
+
+def bill_filter(invoice_number, bill_type=None):
+    # GST and Non-GST invoices are numbered independently, so the type
+    # is needed to identify a bill (and to use the unique index)
+    if bill_type:
+        return {'bill_type': bill_type, 'invoice_number': invoice_number}
+    return {'invoice_number': invoice_number}
+
+def changed_fields(old_bill, bill_data):
+    return {key: value for key, value in bill_data.items() if old_bill.get(key) != value}
+
+def customer_search_query(name, mode):
+    # Returns (filter, sort field). 'prefix' seeks the name_key index;
+    # 'substring' matches anywhere in the name but scans every customer
+    if mode == 'prefix':
+        return {'name_key': {'$regex': '^' + re.escape(customer_search_key(name))}}, 'name_key'
+    if mode == 'substring':
+        return {'name': {'$regex': re.escape(name), '$options': 'i'}}, 'name'
+    raise DatabaseError(f"Unknown customer search mode: {mode}")
+
+def customer_update(name, gstin=None):
+    return {'$set': {'name': name, 'name_key': customer_search_key(name), 'gstin': gstin}}
+
+def bill_search_query(customer_name=None, start_date=None, end_date=None, bill_type=None,
+                      fields=None, sort_key='date', descending=True, after=None):
+    # Returns (filter, projection, sort) for search_bills. Either date bound
+    # may be left open. `after` is the last bill of the previous page (keyset
+    # pagination on sort_key then _id, so pages stay stable while bills are added).
+    query = {}
+    if customer_name:
+        query['customer_name'] = {'$regex': customer_name, '$options': 'i'}
+    if start_date or end_date:
+        query['date'] = {}
+        if start_date:
+            query['date']['$gte'] = start_date
+        if end_date:
+            query['date']['$lte'] = end_date
+    if bill_type:
+        query['bill_type'] = bill_type
+    
+    direction = -1 if descending else 1
+    if after is not None:
+        op = '$lt' if descending else '$gt'
+        query = {'$and': [query, {'$or': [
+            {sort_key: {op: after[sort_key]}},
+            {sort_key: after[sort_key], '_id': {op: after['_id']}}
+        ]}]}
+    
+    projection = None
+    if fields:
+        projection = dict.fromkeys(fields, 1)
+        projection[sort_key] = 1
+    return query, projection, [(sort_key, direction), ('_id', direction)]
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database(connect=True):
+    # One Database per process; every module shares its client and pool.
+    # Pass connect=False to get the instance without touching the network
+    # (the caller is then responsible for calling connect()).
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+    if connect:
+        _database.connect()
+    return _database
+
+@instrument
+class Database:
+    def __init__(self, backend=None):
+        try:
+            load_env()
             
-            self.db = self.client['battery_shop']
+            # Per-method timings and slow-call log, when DB_METRICS is set
+            self.metrics = get_metrics()
+            self.backend = (backend or os.getenv('DB_BACKEND') or 'mongo').lower()
+            self.client = create_client(self.backend)
+            self.db = self.client[database_name()]
             
             # Collections
             self.inventory = self.db['inventory']
             self.bills = self.db['bills']
             self.customers = self.db['customers']
             
-            # Initialize inventory if empty
-            if self.inventory.count_documents({}) == 0:
-                self.initialize_inventory()
+            # Offline mode: every change is also queued here for SyncWorker
+            self.outbox = self.db['outbox'] if self.backend == 'offline' else None
+            self.sync = None
             
-            # Initialize invoice counters if not exists
-            if not self.db.counters.find_one({'_id': 'gst_invoice_counter'}):
-                self.db.counters.insert_one({'_id': 'gst_invoice_counter', 'seq': 1})
-            if not self.db.counters.find_one({'_id': 'non_gst_invoice_counter'}):
-                self.db.counters.insert_one({'_id': 'non_gst_invoice_counter', 'seq': 1})
-        except ConnectionFailure:
-            raise DatabaseError("Failed to connect to database. Please check your internet connection and database URL.")
+            self.connected = False
+            self.supports_transactions = False
+            self._connect_lock = threading.Lock()
+            self._customer_index = None
+            self._customer_index_lock = threading.Lock()
+            self.inventory_cache = InventoryCache(_int_env('INVENTORY_CACHE_MAX_AGE', 60))
+        except DatabaseError:
+            raise
         except Exception as e:
             raise DatabaseError(f"Database initialization error: {str(e)}")
     
+    def connect(self):
+        if self.connected:
+            return
+        with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                # Verify connection; a replica set or mongos (Atlas is always
+                # one) is needed for multi-document transactions
+                hello = self.client.admin.command('hello')
+                self.supports_transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+                if not self.supports_transactions:
+                    logger.warning("Server is standalone; bills will be written without transactions")
+                
+                # Initialize inventory if empty
+                if self.inventory.find_one({}, {'_id': 1}) is None:
+                    self.initialize_inventory()
+                
+                # Initialize invoice counters if not exists
+                existing = {c['_id'] for c in self.db.counters.find(
+                    {'_id': {'$in': ['gst_invoice_counter', 'non_gst_invoice_counter']}}, {'_id': 1})}
+                for counter_id in ('gst_invoice_counter', 'non_gst_invoice_counter'):
+                    if counter_id not in existing:
+                        self.db.counters.insert_one({'_id': counter_id, 'seq': 1})
+                
+                # Create any indexes added since this database was last opened
+                for problem in ensure_indexes(self.db):
+                    logger.warning("Index bootstrap failed: %s", problem)
+                self.connected = True
+                if self.outbox is not None and self.sync is None:
+                    from db_sync import SyncWorker
+                    self.sync = SyncWorker(self, Database('mongo'))
+                    self.sync.start()
+            except ConnectionFailure:
+                raise DatabaseError("Failed to connect to database. Please check your internet connection and database URL.")
+            except DatabaseError:
+                raise
+            except Exception as e:
+                raise DatabaseError(f"Database initialization error: {str(e)}")
+    
+    def run_transaction(self, callback):
+        # Runs callback(session) in a multi-document transaction, retried by
+        # the driver on transient errors. Exceptions raised inside callback
+        # must be left unwrapped so the driver can see their error labels.
+        if not self.supports_transactions:
+            return callback(None)
+        with self.client.start_session() as session:
+            return session.with_transaction(callback)
+    
+    def _run_logged(self, callback):
+        # Single writes only need a transaction in offline mode, to keep
+        # them and their outbox entry together
+        if self.outbox is None:
+            return callback(None)
+        return self.run_transaction(callback)
+    
+    def _queue(self, session, op, **entry):
+        # Offline mode: record a change for SyncWorker to replay to MongoDB,
+        # in the same local transaction as the change itself
+        if self.outbox is None:
+            return
+        counter = self.db.counters.find_one_and_update(
+            {'_id': 'outbox_seq'},
+            {'$inc': {'seq': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        entry.update(op=op, seq=counter['seq'], queued_at=datetime.now())
+        self.outbox.insert_one(entry, session=session)
+        if self.sync is not None:
+            self.sync.wake()
+    
+    def sync_status(self):
+        # None unless running in offline mode
+        return self.sync.status() if self.sync is not None else None
+    
+    def _next_invoice_number(self, bill_type, session=None):
+        counter = self.db.counters.find_one_and_update(
+            {'_id': invoice_counter_id(bill_type)},
+            {'$inc': {'seq': 1}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        return counter['seq']
+    
     def get_next_invoice_number(self, bill_type):
         try:
-            counter_id = 'gst_invoice_counter' if bill_type == 'gst' else 'non_gst_invoice_counter'
-            counter = self.db.counters.find_one_and_update(
-                {'_id': counter_id},
-                {'$inc': {'seq': 1}},
-                return_document=True
-            )
-            return counter['seq']
+            return self._next_invoice_number(bill_type)
         except Exception as e:
             raise DatabaseError(f"Failed to generate invoice number: {str(e)}")
     
@@ -71,118 +448,349 @@ class Database:
                 {'model': 'CRTT150', 'quantity': 0},
                 {'model': 'Felix 1000', 'quantity': 0}
             ]
-            self.inventory.insert_many(initial_products)
+            with self.inventory_cache.writing():
+                self.inventory.insert_many(initial_products)
+                self.inventory_cache.invalidate()
         except Exception as e:
             raise DatabaseError(f"Failed to initialize inventory: {str(e)}")
     
     def add_new_model(self, model):
         try:
-            if not self.inventory.find_one({'model': model}):
-                self.inventory.insert_one({'model': model, 'quantity': 0})
-                return True
+            # The unique model index rejects duplicates in the same round trip
+            record = {'model': model, 'quantity': 0}
+            def commit(session):
+                self.inventory.insert_one(record, session=session)
+                self._queue(session, 'add_model', model=model)
+            with self.inventory_cache.writing():
+                self._run_logged(commit)
+                self.inventory_cache.add(record)
+            return True
+        except DuplicateKeyError:
             return False
         except Exception as e:
             raise DatabaseError(f"Failed to add new model: {str(e)}")
     
     def update_inventory(self, model, quantity):
         try:
-            self.inventory.update_one(
-                {'model': model},
-                {'$inc': {'quantity': quantity}}
-            )
+            def commit(session):
+                self.inventory.update_one(
+                    {'model': model},
+                    {'$inc': {'quantity': quantity}},
+                    session=session
+                )
+                self._queue(session, 'stock', deltas={model: quantity})
+            with self.inventory_cache.writing():
+                self._run_logged(commit)
+                self.inventory_cache.apply({model: quantity})
         except Exception as e:
             raise DatabaseError(f"Failed to update inventory: {str(e)}")
     
-    def get_inventory(self):
+    def get_stock(self, model):
+        # Quantity in stock for one model, or None if the model is unknown.
+        # Served from the inventory cache; the commit paths re-check on the server.
+        self._ensure_inventory_cache()
+        item = self.inventory_cache.get(model)
+        return item['quantity'] if item else None
+    
+    def _reserve_stock(self, model, quantity, session=None):
+        # Conditional decrement: only applies when enough units are left.
+        # Returns the shortfall, 0 meaning the units were taken.
+        result = self.inventory.update_one(
+            {'model': model, 'quantity': {'$gte': quantity}},
+            {'$inc': {'quantity': -quantity}},
+            session=session
+        )
+        if result.matched_count:
+            return 0
+        item = self.inventory.find_one({'model': model}, {'_id': 0, 'quantity': 1}, session=session)
+        return stock_shortfalls({model: quantity}, {model: item['quantity'] if item else 0})[model]
+    
+    def _reserve_stock_batch(self, quantities, session=None):
+        # All-or-nothing reservation of {model: quantity}. Returns
+        # {model: shortfall} for the models that could not be reserved.
+        if not quantities:
+            return {}
+        if session is None:
+            # No transaction to roll back, so reserve model by model and
+            # put back what was taken if any of them falls short
+            reserved = {}
+            try:
+                for model, quantity in quantities.items():
+                    shortfall = self._reserve_stock(model, quantity)
+                    if shortfall:
+                        return {model: shortfall}
+                    reserved[model] = quantity
+                # Every model was reserved, so nothing goes back
+                reserved = {}
+                return {}
+            finally:
+                if reserved:
+                    self.inventory.bulk_write(stock_changes(reserved), ordered=False)
+        result = self.inventory.bulk_write(reservation_changes(quantities), ordered=False, session=session)
+        if result.matched_count == len(quantities):
+            return {}
+        # Read outside the session to see stock as it was before this transaction
+        available = {
+            item['model']: item['quantity']
+            for item in self.inventory.find({'model': {'$in': list(quantities)}}, {'_id': 0, 'model': 1, 'quantity': 1})
+        }
+        return stock_shortfalls(quantities, available)
+    
+    def _retry_reservation(self, run, callback):
+        # run is run_transaction or _run_logged. A reservation that raced
+        # another counter's write is simply tried again.
+        for attempt in range(STOCK_RETRIES):
+            try:
+                return run(callback)
+            except StockContentionError:
+                if attempt == STOCK_RETRIES - 1:
+                    raise
+    
+    def reserve_stock(self, model, quantity):
+        try:
+            def commit(session):
+                shortfall = self._reserve_stock(model, quantity, session)
+                if not shortfall:
+                    self._queue(session, 'stock', deltas={model: -quantity})
+                return shortfall
+            with self.inventory_cache.writing():
+                shortfall = self._retry_reservation(self._run_logged, commit)
+                if not shortfall:
+                    self.inventory_cache.apply({model: -quantity})
+            return shortfall
+        except StockContentionError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to reserve stock: {str(e)}")
+    
+    def reserve_stock_batch(self, items):
+        # Takes every line of a bill out of stock, or none of them.
+        # Returns {} on success, otherwise {model: shortfall}.
+        try:
+            quantities = stock_quantities(items)
+            def commit(session):
+                shortfalls = self._reserve_stock_batch(quantities, session)
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+                self._queue(session, 'stock', deltas={model: -quantity for model, quantity in quantities.items()})
+            with self.inventory_cache.writing():
+                self._retry_reservation(self.run_transaction, commit)
+                self.inventory_cache.apply({model: -quantity for model, quantity in quantities.items()})
+            return {}
+        except InsufficientStockError as e:
+            return e.shortfalls
+        except StockContentionError:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"Failed to reserve stock: {str(e)}")
+    
+    def refresh_inventory(self):
         try:
-            return list(self.inventory.find().sort('model', 1))
+            generation = self.inventory_cache.load_generation()
+            self.inventory_cache.load(self.inventory.find(), generation)
         except Exception as e:
             raise DatabaseError(f"Failed to get inventory: {str(e)}")
     
-    def search_customers(self, name):
+    def _ensure_inventory_cache(self):
+        if not self.inventory_cache.is_fresh():
+            self.refresh_inventory()
+    
+    def get_inventory(self, refresh=False):
+        # Sorted by model. Costs no round trip while the cache is fresh.
+        if refresh:
+            self.refresh_inventory()
+        else:
+            self._ensure_inventory_cache()
+        return self.inventory_cache.items()
+    
+    def search_customers(self, name, mode='prefix', limit=10):
         try:
-            return list(self.customers.find(
-                {'name': {'$regex': name, '$options': 'i'}}
-            ).sort('name', 1))
+            query, sort_field = customer_search_query(name, mode)
+            cursor = self.customers.find(query).sort(sort_field, 1)
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        except DatabaseError:
+            raise
         except Exception as e:
             raise DatabaseError(f"Failed to search customers: {str(e)}")
     
+    def get_customer_index(self):
+        # Loaded once on first use, then kept current by save_customer
+        if self._customer_index is None:
+            with self._customer_index_lock:
+                if self._customer_index is None:
+                    try:
+                        index = CustomerIndex()
+                        index.load(self.customers.find({}, CUSTOMER_INDEX_FIELDS))
+                        self._customer_index = index
+                    except Exception as e:
+                        raise DatabaseError(f"Failed to load customers: {str(e)}")
+        return self._customer_index
+    
+    def set_customer_index(self, index):
+        # For callers that loaded the customers themselves (AsyncDatabase);
+        # an index that is already in use wins
+        with self._customer_index_lock:
+            if self._customer_index is None:
+                self._customer_index = index
+            return self._customer_index
+    
     def get_customer(self, name):
         try:
             return self.customers.find_one({'name': name})
         except Exception as e:
             raise DatabaseError(f"Failed to get customer: {str(e)}")
     
+    def _upsert_customer(self, name, gstin=None, session=None):
+        self.customers.update_one(
+            {'name': name},
+            customer_update(name, gstin),
+            upsert=True,
+            session=session
+        )
+        self._queue(session, 'customer', name=name, gstin=gstin)
+    
+    def _customer_saved(self, name, gstin=None):
+        if self._customer_index is not None:
+            self._customer_index.add(name, gstin)
+    
     def save_customer(self, name, gstin=None):
         try:
-            self.customers.update_one(
-                {'name': name},
-                {'$set': {'name': name, 'gstin': gstin}},
-                upsert=True
-            )
+            self._run_logged(lambda session: self._upsert_customer(name, gstin, session))
+            self._customer_saved(name, gstin)
         except Exception as e:
             raise DatabaseError(f"Failed to save customer: {str(e)}")
     
     def save_bill(self, bill_data):
+        # Counter, customer, bill and stock are written in one transaction:
+        # at most five round trips (including the commit) for any number of
+        # items, and nothing is left half-applied if the link drops.
         try:
             bill_data['date'] = datetime.now()
-            bill_data['invoice_number'] = self.get_next_invoice_number(bill_data['bill_type'])
+            quantities = stock_quantities(bill_data['items'])
             
-            if bill_data['bill_type'] == 'gst' and bill_data['customer_name'] != 'Customer':
-                self.save_customer(bill_data['customer_name'], bill_data.get('customer_gstin'))
+            def commit(session):
+                # Stock is reserved first so a shortfall aborts before an
+                # invoice number is used up
+                shortfalls = self._reserve_stock_batch(quantities, session)
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+                self._queue(session, 'stock', deltas={model: -quantity for model, quantity in quantities.items()})
+                # The driver may call this again on a transient error, so
+                # work on a fresh copy each time
+                bill = dict(bill_data)
+                bill['invoice_number'] = self._next_invoice_number(bill['bill_type'], session)
+                if self.outbox is not None:
+                    # Provisional until SyncWorker gets the number from MongoDB
+                    bill['pending_sync'] = True
+                if is_saved_customer(bill):
+                    self._upsert_customer(bill['customer_name'], bill.get('customer_gstin'), session)
+                self.bills.insert_one(bill, session=session)
+                self._queue(session, 'insert_bill', bill=bill)
+                return bill
             
-            self.bills.insert_one(bill_data)
+            with self.inventory_cache.writing():
+                bill = self._retry_reservation(self.run_transaction, commit)
+                self.inventory_cache.apply({model: -quantity for model, quantity in quantities.items()})
+            bill_data['invoice_number'] = bill['invoice_number']
+            bill_data['_id'] = bill['_id']
+            if is_saved_customer(bill_data):
+                self._customer_saved(bill_data['customer_name'], bill_data.get('customer_gstin'))
             return bill_data['invoice_number']
+        except (InsufficientStockError, StockContentionError):
+            raise
         except Exception as e:
             raise DatabaseError(f"Failed to save bill: {str(e)}")
     
-    def update_bill(self, invoice_number, bill_data):
+    def update_bill(self, invoice_number, bill_data, bill_type=None):
+        # Stock reconciliation (one bulk_write) and a $set of only the changed
+        # fields are applied together in one transaction
         try:
-            old_bill = self.bills.find_one({'invoice_number': invoice_number})
-            old_items = {item['model']: item['quantity'] for item in old_bill['items']} if old_bill else {}
-            new_items = {item['model']: item['quantity'] for item in bill_data['items']}
-            
-            all_models = set(old_items.keys()) | set(new_items.keys())
-            for model in all_models:
-                old_qty = old_items.get(model, 0)
-                new_qty = new_items.get(model, 0)
-                diff = old_qty - new_qty
-                if diff != 0:
-                    self.update_inventory(model, diff)
-            
+            bill_key = bill_filter(invoice_number, bill_type)
             bill_data['date'] = datetime.now()
-            self.bills.update_one(
-                {'invoice_number': invoice_number},
-                {'$set': bill_data}
-            )
+            new_items = stock_quantities(bill_data['items'])
+            
+            def commit(session):
+                old_bill = self.bills.find_one(bill_key, session=session)
+                if not old_bill:
+                    raise DatabaseError(f"Bill #{invoice_number} not found")
+                check_bill_type_unchanged(old_bill, bill_data)
+                deltas = stock_deltas(stock_quantities(old_bill['items']), new_items)
+                # Extra units sold must be in stock; returned units go straight back
+                shortfalls = self._reserve_stock_batch(
+                    {model: -delta for model, delta in deltas.items() if delta < 0}, session
+                )
+                if shortfalls:
+                    raise InsufficientStockError(shortfalls)
+                changes = stock_changes({model: delta for model, delta in deltas.items() if delta > 0})
+                if changes:
+                    self.inventory.bulk_write(changes, ordered=False, session=session)
+                if any(deltas.values()):
+                    self._queue(session, 'stock', deltas=deltas)
+                
+                changed = changed_fields(old_bill, bill_data)
+                if changed:
+                    self.bills.update_one(bill_key, {'$set': changed}, session=session)
+                    self._queue(session, 'update_bill', bill_id=old_bill['_id'], changes=changed)
+                
+                if is_saved_customer(bill_data):
+                    self._upsert_customer(bill_data['customer_name'], bill_data.get('customer_gstin'), session)
+                return deltas
             
-            if bill_data['bill_type'] == 'gst' and bill_data['customer_name'] != 'Customer':
-                self.save_customer(bill_data['customer_name'], bill_data.get('customer_gstin'))
+            with self.inventory_cache.writing():
+                deltas = self._retry_reservation(self.run_transaction, commit)
+                self.inventory_cache.apply(deltas)
+            if is_saved_customer(bill_data):
+                self._customer_saved(bill_data['customer_name'], bill_data.get('customer_gstin'))
+            return deltas
+        except (InsufficientStockError, StockContentionError):
+            raise
+        except DatabaseError:
+            raise
         except Exception as e:
             raise DatabaseError(f"Failed to update bill: {str(e)}")
     
-    def delete_bill(self, invoice_number):
+    def delete_bill(self, invoice_number, bill_type=None):
         try:
-            bill = self.bills.find_one({'invoice_number': invoice_number})
-            if bill:
-                for item in bill['items']:
-                    self.update_inventory(item['model'], item['quantity'])
-                self.bills.delete_one({'invoice_number': invoice_number})
-                return True
-            return False
+            bill_key = bill_filter(invoice_number, bill_type)
+            
+            def commit(session):
+                bill = self.bills.find_one_and_delete(bill_key, {'items': 1}, session=session)
+                if not bill:
+                    return None
+                deltas = stock_quantities(bill['items'])
+                changes = stock_changes(deltas)
+                if changes:
+                    self.inventory.bulk_write(changes, ordered=False, session=session)
+                self._queue(session, 'delete_bill', bill_id=bill['_id'])
+                self._queue(session, 'stock', deltas=deltas)
+                return deltas
+            
+            with self.inventory_cache.writing():
+                deltas = self.run_transaction(commit)
+                if deltas is None:
+                    return False
+                self.inventory_cache.apply(deltas)
+            return True
         except Exception as e:
             raise DatabaseError(f"Failed to delete bill: {str(e)}")
     
-    def search_bills(self, customer_name=None, start_date=None, end_date=None):
+    def get_bill(self, invoice_number, bill_type=None):
         try:
-            query = {}
-            if customer_name:
-                query['customer_name'] = {'$regex': customer_name, '$options': 'i'}
-            if start_date and end_date:
-                query['date'] = {
-                    '$gte': start_date,
-                    '$lte': end_date
-                }
-            return list(self.bills.find(query).sort('date', -1))
+            return self.bills.find_one(bill_filter(invoice_number, bill_type))
+        except Exception as e:
+            raise DatabaseError(f"Failed to get bill: {str(e)}")
+    
+    def search_bills(self, customer_name=None, start_date=None, end_date=None, bill_type=None,
+                     fields=None, sort_key='date', descending=True, page_size=None, after=None):
+        try:
+            query, projection, sort = bill_search_query(
+                customer_name, start_date, end_date, bill_type, fields, sort_key, descending, after
+            )
+            cursor = self.bills.find(query, projection).sort(sort)
+            if page_size:
+                cursor = cursor.limit(page_size)
+            return list(cursor)
         except Exception as e:
-            raise DatabaseError(f"Failed to search bills: {str(e)}") 
\ No newline at end of file
+            raise DatabaseError(f"Failed to search bills: {str(e)}")
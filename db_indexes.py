@@ -0,0 +1,168 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from datetime import datetime
+import argparse
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Bump INDEX_VERSION whenever INDEX_SPECS changes so every install
+# re-runs the bootstrap on its next start.
+INDEX_VERSION = 1
+
+INDEX_SPECS = {
+    'inventory': [
+        {'name': 'model_unique', 'keys': [('model', ASCENDING)], 'unique': True},
+    ],
+    'bills': [
+        {'name': 'bill_type_invoice_number_unique',
+         'keys': [('bill_type', ASCENDING), ('invoice_number', ASCENDING)], 'unique': True},
+        {'name': 'date_id_desc', 'keys': [('date', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'bill_type_date_id', 'keys': [('bill_type', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'customer_name_date', 'keys': [('customer_name', ASCENDING), ('date', DESCENDING)]},
+    ],
+    'customers': [
+        {'name': 'name_unique', 'keys': [('name', ASCENDING)], 'unique': True},
+        {'name': 'name_key', 'keys': [('name_key', ASCENDING)]},
+    ],
+}
+
+# The queries Database issues, as (label, collection, filter, sort). Used to
+# report which of them the server still answers with a collection scan.
+TRACKED_QUERIES = [
+    ('get_inventory', 'inventory', {}, [('model', ASCENDING)]),
+    ('update_inventory', 'inventory', {'model': ''}, None),
+    ('get_customer', 'customers', {'name': ''}, None),
+    ('search_customers (prefix)', 'customers', {'name_key': {'$regex': '^a'}}, [('name_key', ASCENDING)]),
+    ('search_customers (substring)', 'customers', {'name': {'$regex': 'a', '$options': 'i'}}, [('name', ASCENDING)]),
+    ('search_bills', 'bills', {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('search_bills (bill type)', 'bills', {'bill_type': 'gst'}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('search_bills (date range)', 'bills',
+     {'date': {'$gte': datetime(2000, 1, 1), '$lte': datetime(2000, 1, 2)}},
+     [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('search_bills (customer)', 'bills',
+     {'customer_name': {'$regex': 'a', '$options': 'i'}}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('update_bill / delete_bill', 'bills', {'bill_type': 'gst', 'invoice_number': 0}, None),
+]
+
+META_ID = 'indexes'
+
+def _backfill_customer_name_keys(db):
+    # Same normalisation as db_connection.customer_search_key, done server side
+    db.customers.update_many(
+        {'name_key': {'$exists': False}},
+        [{'$set': {'name_key': {'$toLower': {'$trim': {'input': '$name'}}}}}]
+    )
+
+# Data migrations run before the indexes of the matching version are built
+MIGRATIONS = {
+    1: _backfill_customer_name_keys,
+}
+
+def _key_pattern(keys):
+    return tuple((field, int(direction)) for field, direction in keys)
+
+def existing_key_patterns(collection):
+    return {_key_pattern(info['key']): name for name, info in collection.index_information().items()}
+
+def missing_indexes(db):
+    missing = []
+    for collection_name, specs in INDEX_SPECS.items():
+        existing = existing_key_patterns(db[collection_name])
+        for spec in specs:
+            if _key_pattern(spec['keys']) not in existing:
+                missing.append((collection_name, spec))
+    return missing
+
+def ensure_indexes(db, force=False):
+    # Returns a list of problems; an empty list means every index exists.
+    meta = db.schema_meta.find_one({'_id': META_ID})
+    if not force and meta and meta.get('version', 0) >= INDEX_VERSION:
+        return []
+    problems = []
+    stored_version = meta.get('version', 0) if meta else 0
+    for version in sorted(MIGRATIONS):
+        if version > stored_version:
+            try:
+                MIGRATIONS[version](db)
+                logger.info("Applied migration %s", version)
+            except OperationFailure as e:
+                problems.append(f"migration {version}: {e}")
+    for collection_name, spec in missing_indexes(db):
+        try:
+            db[collection_name].create_index(
+                spec['keys'], name=spec['name'], unique=spec.get('unique', False)
+            )
+            logger.info("Created index %s.%s", collection_name, spec['name'])
+        except OperationFailure as e:
+            # Most likely duplicate data blocking a unique index; leave the
+            # version unchanged so the next start tries again.
+            problems.append(f"{collection_name}.{spec['name']}: {e}")
+    if not problems:
+        db.schema_meta.update_one(
+            {'_id': META_ID},
+            {'$set': {'version': INDEX_VERSION, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+    return problems
+
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child_key in ('inputStage', 'queryPlan'):
+        if child_key in plan:
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+def explain_tracked_queries(db):
+    report = []
+    for label, collection_name, query, sort in TRACKED_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        stages = _plan_stages(plan)
+        report.append({
+            'query': label,
+            'collection': collection_name,
+            'stages': stages,
+            'collection_scan': 'COLLSCAN' in stages,
+        })
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create, verify and report on MongoDB indexes.")
+    parser.add_argument('--verify', action='store_true', help="only list missing indexes")
+    parser.add_argument('--report', action='store_true', help="explain the tracked queries and flag collection scans")
+    args = parser.parse_args(argv)
+
+    from db_connection import get_database
+    database = get_database()
+    db = database.db
+
+    status = 0
+    if args.verify:
+        missing = missing_indexes(db)
+        status = 1 if missing else 0
+        for collection_name, spec in missing:
+            print(f"missing: {collection_name}.{spec['name']}")
+        if not missing:
+            print("All indexes present")
+    elif not args.report:
+        problems = ensure_indexes(db, force=True)
+        for problem in problems:
+            print(f"error: {problem}")
+        status = 1 if problems else 0
+        if not problems:
+            print(f"Indexes at version {INDEX_VERSION}")
+
+    if args.report:
+        for entry in explain_tracked_queries(db):
+            flag = "COLLSCAN" if entry['collection_scan'] else "ok"
+            print(f"{flag:8} {entry['query']:30} {' > '.join(entry['stages'])}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+from pymongo import monitoring
+from bson import encode
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Slow calls kept in memory for the summary
+SLOW_LOG_SIZE = 200
+
+# CallRecord of the Database method running in this thread or task
+_current_call = ContextVar('db_current_call', default=None)
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.commands = 0
+        self.documents = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls
+        target = self.calls * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + [None], self.buckets):
+            seen += count
+            if count and seen >= target:
+                return bound if bound is not None else round(self.max_ms, 1)
+        return 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 1),
+            'mean_ms': round(self.total_ms / self.calls, 1) if self.calls else 0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 1),
+            'histogram': dict(zip([f"<={bound}" for bound in LATENCY_BUCKETS_MS] + ['>5000'], self.buckets)),
+            'commands': self.commands,
+            'documents': self.documents,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+
+class CallRecord:
+    # Commands issued by one Database call, filled in by the listener
+    def __init__(self, method):
+        self.method = method
+        self.commands = []
+        self.documents = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+class QueryMetrics(monitoring.CommandListener):
+    # Per-method call counts, latency histograms, documents returned and
+    # bytes on the wire for Database, plus a log of slow calls. Commands are
+    # attributed to the outermost Database method running when they are
+    # sent. Registered with the MongoClient as a command listener.
+    def __init__(self, slow_ms=500):
+        self.slow_ms = slow_ms
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._started_at = datetime.now()
+
+    # Command monitoring. These run on the thread (or task) that sent the
+    # command, so _current_call identifies the Database method.
+    def started(self, event):
+        record = _current_call.get()
+        if record is not None:
+            record.commands.append(event.command_name)
+            record.bytes_sent += len(encode(event.command))
+
+    def succeeded(self, event):
+        record = _current_call.get()
+        if record is not None:
+            record.bytes_received += len(encode(event.reply))
+            record.documents += _reply_documents(event.reply)
+
+    def failed(self, event):
+        pass
+
+    def measure(self, method, fn, args, kwargs):
+        if not self.enabled or _current_call.get() is not None:
+            return fn(*args, **kwargs)
+        record = CallRecord(method)
+        token = _current_call.set(record)
+        start = time.perf_counter()
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current_call.reset(token)
+            self._record(record, (time.perf_counter() - start) * 1000, failed)
+
+    async def measure_async(self, method, fn, args, kwargs):
+        if not self.enabled or _current_call.get() is not None:
+            return await fn(*args, **kwargs)
+        record = CallRecord(method)
+        token = _current_call.set(record)
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current_call.reset(token)
+            self._record(record, (time.perf_counter() - start) * 1000, failed)
+
+    def _record(self, record, elapsed_ms, failed):
+        with self._lock:
+            stats = self._stats.get(record.method)
+            if stats is None:
+                stats = self._stats[record.method] = CallStats()
+            stats.calls += 1
+            stats.errors += failed
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            bucket = 0
+            while bucket < len(LATENCY_BUCKETS_MS) and elapsed_ms > LATENCY_BUCKETS_MS[bucket]:
+                bucket += 1
+            stats.buckets[bucket] += 1
+            stats.commands += len(record.commands)
+            stats.documents += record.documents
+            stats.bytes_sent += record.bytes_sent
+            stats.bytes_received += record.bytes_received
+            if elapsed_ms >= self.slow_ms:
+                self._slow.append({
+                    'at': datetime.now().isoformat(timespec='seconds'),
+                    'method': record.method,
+                    'ms': round(elapsed_ms, 1),
+                    'commands': list(record.commands),
+                    'documents': record.documents,
+                    'bytes_received': record.bytes_received,
+                    'failed': failed,
+                })
+        if elapsed_ms >= self.slow_ms:
+            logger.warning("Slow database call %s: %.0f ms, %d commands, %d documents, %d bytes received",
+                           record.method, elapsed_ms, len(record.commands), record.documents, record.bytes_received)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._slow.clear()
+            self._started_at = datetime.now()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self._started_at.isoformat(timespec='seconds'),
+                'slow_ms': self.slow_ms,
+                'methods': {method: stats.to_dict() for method, stats in sorted(self._stats.items())},
+                'slow_calls': list(self._slow),
+            }
+
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = [
+            f"Database calls since {snapshot['since']}",
+            "",
+            f"{'method':36} {'calls':>6} {'errors':>6} {'mean':>8} {'p50':>6} {'p95':>6} {'max':>8} "
+            f"{'cmds':>6} {'docs':>8} {'KB in':>9}",
+        ]
+        for method, stats in snapshot['methods'].items():
+            lines.append(
+                f"{method:36} {stats['calls']:6} {stats['errors']:6} {stats['mean_ms']:8.1f} "
+                f"{stats['p50_ms']:6} {stats['p95_ms']:6} {stats['max_ms']:8.1f} "
+                f"{stats['commands']:6} {stats['documents']:8} {stats['bytes_received'] / 1024:9.1f}"
+            )
+        lines += ["", f"Calls slower than {snapshot['slow_ms']} ms (latest last):"]
+        for call in snapshot['slow_calls']:
+            lines.append(f"{call['at']}  {call['method']:36} {call['ms']:8.1f} ms  {', '.join(call['commands'])}")
+        if not snapshot['slow_calls']:
+            lines.append("none")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        # .json gets the raw snapshot, anything else the text summary
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.lower().endswith('.json'):
+                json.dump(self.snapshot(), f, indent=2)
+            else:
+                f.write(self.summary())
+
+def _reply_documents(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    if isinstance(reply.get('value'), dict):
+        # findAndModify
+        return 1
+    return 0
+
+def instrument(cls):
+    # Class decorator timing every public method through self.metrics,
+    # recorded as 'Class.method'
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_') or not callable(attribute):
+            continue
+        label = f"{cls.__name__}.{name}"
+        if inspect.iscoroutinefunction(attribute):
+            @functools.wraps(attribute)
+            async def wrapper(self, *args, _fn=attribute, _name=label, **kwargs):
+                metrics = self.metrics
+                if metrics is None:
+                    return await _fn(self, *args, **kwargs)
+                return await metrics.measure_async(_name, _fn, (self,) + args, kwargs)
+        else:
+            @functools.wraps(attribute)
+            def wrapper(self, *args, _fn=attribute, _name=label, **kwargs):
+                metrics = self.metrics
+                if metrics is None:
+                    return _fn(self, *args, **kwargs)
+                return metrics.measure(_name, _fn, (self,) + args, kwargs)
+        setattr(cls, name, wrapper)
+    return cls
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    # Shared by every client in the process; None unless DB_METRICS is set
+    global _metrics
+    if _metrics is None and os.getenv('DB_METRICS', '').lower() in ('1', 'true', 'yes'):
+        with _metrics_lock:
+            if _metrics is None:
+                try:
+                    slow_ms = int(os.getenv('DB_SLOW_MS') or 500)
+                except ValueError:
+                    slow_ms = 500
+                _metrics = QueryMetrics(slow_ms)
+                slow_log = os.getenv('DB_SLOW_LOG')
+                if slow_log:
+                    handler = logging.FileHandler(slow_log, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                    logger.addHandler(handler)
+    return _metrics
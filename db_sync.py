@@ -0,0 +1,309 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from db_connection import (
+    _int_env, CUSTOMER_INDEX_FIELDS, stock_changes, customer_update, invoice_counter_id,
+    bill_search_query
+)
+from local_store import UpdateRequest
+
+logger = logging.getLogger(__name__)
+
+# Bills changed this long before the newest one already pulled are fetched
+# again, to allow for clock differences between counters
+PULL_OVERLAP = timedelta(hours=1)
+
+SYNC_STATE_ID = 'pull'
+
+# Server bill _ids read per round trip when looking for deleted bills
+RECONCILE_PAGE_SIZE = 5000
+
+class SyncWorker(threading.Thread):
+    # Replays the offline Database's outbox to MongoDB and pulls other
+    # counters' changes back. Runs every SYNC_INTERVAL seconds, and straight
+    # after each local change. Any failure (usually no internet) leaves the
+    # outbox as it is for the next round.
+    def __init__(self, database, remote):
+        super().__init__(name='db-sync', daemon=True)
+        self.database = database
+        self.remote = remote
+        self.interval = _int_env('SYNC_INTERVAL', 30)
+        self.batch_size = _int_env('SYNC_BATCH_SIZE', 100)
+        self.pull_page_size = _int_env('SYNC_PULL_PAGE_SIZE', 500)
+        self.reconcile_interval = _int_env('SYNC_RECONCILE_INTERVAL', 600)
+        self._reconciled_at = None
+        self._wake = threading.Event()
+        self.last_synced_at = None
+        self.last_error = None
+        self.pending = 0
+
+    def wake(self):
+        self._wake.set()
+
+    def status(self):
+        # Read from the GUI thread, so it never waits on the local store
+        return {
+            'pending': self.pending,
+            'last_synced_at': self.last_synced_at,
+            'last_error': self.last_error,
+        }
+
+    def run(self):
+        while True:
+            try:
+                self.pending = self.database.outbox.count_documents({})
+                self.remote.connect()
+                self.sync_once()
+                self.last_synced_at = datetime.now()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Sync failed: %s", e)
+            self.pending = self.database.outbox.count_documents({})
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def sync_once(self):
+        while self.push_batch():
+            pass
+        self.pull()
+
+    def push_batch(self):
+        # Returns True while there may be more entries waiting
+        outbox = self.database.outbox
+        entries = list(outbox.find().sort('seq', 1).limit(self.batch_size))
+        if not entries:
+            return False
+
+        def commit(session):
+            # Each entry is marked as applied in the same transaction, so a
+            # batch resent after a lost reply is not applied twice
+            numbers = {}
+            for entry in entries:
+                if self.remote.db.sync_applied.find_one({'_id': entry['_id']}, {'_id': 1}, session=session):
+                    number = self._synced_number(entry, session)
+                else:
+                    number = self._apply(entry, session)
+                    self.remote.db.sync_applied.insert_one(
+                        {'_id': entry['_id'], 'applied_at': datetime.now()}, session=session
+                    )
+                if number is not None:
+                    numbers[entry['bill']['_id']] = (entry['bill']['bill_type'], number)
+            return numbers
+
+        numbers = self.remote.run_transaction(commit)
+
+        def reconcile(session):
+            for bill_id, (bill_type, number) in numbers.items():
+                self._renumber(bill_id, bill_type, number, session)
+            outbox.delete_many({'_id': {'$in': [entry['_id'] for entry in entries]}}, session=session)
+
+        self.database.run_transaction(reconcile)
+        logger.info("Synced %d queued changes", len(entries))
+        return len(entries) == self.batch_size
+
+    def _apply(self, entry, session):
+        # Replays one outbox entry on the server. Returns the server's
+        # invoice number for a new bill, otherwise None.
+        remote = self.remote
+        op = entry['op']
+        if op == 'stock':
+            # The goods have already left the shop, so this is not checked
+            # against the server's stock; other counters' sales may take it
+            # below zero, which shows up in the inventory for correction
+            changes = stock_changes(entry['deltas'])
+            if changes:
+                remote.inventory.bulk_write(changes, ordered=False, session=session)
+        elif op == 'add_model':
+            if remote.inventory.find_one({'model': entry['model']}, {'_id': 1}, session=session) is None:
+                remote.inventory.insert_one({'model': entry['model'], 'quantity': 0}, session=session)
+        elif op == 'customer':
+            remote.customers.update_one(
+                {'name': entry['name']}, customer_update(entry['name'], entry.get('gstin')),
+                upsert=True, session=session
+            )
+        elif op == 'insert_bill':
+            bill = dict(entry['bill'])
+            bill.pop('pending_sync', None)
+            # Offline numbers are provisional: the server's counter decides
+            bill['invoice_number'] = remote._next_invoice_number(bill['bill_type'], session)
+            remote.bills.insert_one(bill, session=session)
+            return bill['invoice_number']
+        elif op == 'update_bill':
+            changes = dict(entry['changes'])
+            changes.pop('invoice_number', None)
+            changes.pop('pending_sync', None)
+            if changes:
+                result = remote.bills.update_one({'_id': entry['bill_id']}, {'$set': changes}, session=session)
+                if not result.matched_count:
+                    logger.warning("Bill %s was deleted on the server; offline edit dropped", entry['bill_id'])
+        elif op == 'delete_bill':
+            remote.bills.delete_one({'_id': entry['bill_id']}, session=session)
+        else:
+            logger.warning("Unknown outbox entry %s dropped", op)
+        return None
+
+    def _synced_number(self, entry, session):
+        # A bill the server already has, from a batch whose reply was lost
+        if entry['op'] != 'insert_bill':
+            return None
+        bill = self.remote.bills.find_one({'_id': entry['bill']['_id']}, {'invoice_number': 1}, session=session)
+        return bill['invoice_number'] if bill else None
+
+    def _renumber(self, bill_id, bill_type, number, session):
+        # Gives a synced local bill its server invoice number. A bill still
+        # waiting to sync that holds the number moves to a fresh provisional one.
+        bills = self.database.bills
+        bill = bills.find_one({'_id': bill_id}, {'invoice_number': 1}, session=session)
+        if bill is None:
+            return
+        if bill['invoice_number'] != number:
+            clash = bills.find_one({'bill_type': bill_type, 'invoice_number': number}, {'_id': 1}, session=session)
+            if clash is not None:
+                self._raise_counter(bill_type, number, session)
+                bills.update_one(
+                    {'_id': clash['_id']},
+                    {'$set': {'invoice_number': self.database._next_invoice_number(bill_type, session)}},
+                    session=session
+                )
+        bills.update_one({'_id': bill_id}, {'$set': {'invoice_number': number, 'pending_sync': False}}, session=session)
+        self._raise_counter(bill_type, number, session)
+
+    def _raise_counter(self, bill_type, number, session):
+        # Provisional numbers continue from the highest number seen
+        self.database.db.counters.update_one(
+            {'_id': invoice_counter_id(bill_type), 'seq': {'$lt': number}},
+            {'$set': {'seq': number}},
+            session=session
+        )
+
+    def pull(self):
+        # Brings the local copy up to date with the server. Skipped while
+        # local changes are still queued, as the server does not have them yet.
+        database = self.database
+        if database.outbox.count_documents({}):
+            return
+        remote = self.remote
+        inventory = list(remote.inventory.find({}, {'_id': 0, 'model': 1, 'quantity': 1}))
+        customers = list(remote.customers.find({}, CUSTOMER_INDEX_FIELDS))
+        counters = {counter['_id']: counter['seq'] for counter in remote.db.counters.find()}
+
+        def apply(session):
+            if database.outbox.count_documents({}, session=session):
+                return False
+            if inventory:
+                database.inventory.bulk_write([
+                    UpdateRequest({'model': item['model']}, {'$set': {'quantity': item['quantity']}}, upsert=True)
+                    for item in inventory
+                ], ordered=False, session=session)
+            if customers:
+                database.customers.bulk_write([
+                    UpdateRequest({'name': customer['name']}, customer_update(customer['name'], customer.get('gstin')),
+                                  upsert=True)
+                    for customer in customers
+                ], ordered=False, session=session)
+            for bill_type in ('gst', 'non-gst'):
+                number = counters.get(invoice_counter_id(bill_type))
+                if number is not None:
+                    self._raise_counter(bill_type, number, session)
+            return True
+
+        with database.inventory_cache.writing():
+            applied = database.run_transaction(apply)
+            if applied:
+                database.inventory_cache.invalidate()
+        if not applied:
+            return
+        index = database._customer_index
+        if index is not None:
+            for customer in customers:
+                index.add(customer['name'], customer.get('gstin'))
+        if not self.pull_bills():
+            return
+        now = time.monotonic()
+        if self._reconciled_at is None or now - self._reconciled_at >= self.reconcile_interval:
+            if self.reconcile_deleted_bills():
+                self._reconciled_at = now
+
+    def pull_bills(self):
+        # Bills dated since the last pull, a page at a time in (date, _id)
+        # order. Each page is its own short transaction and records how far
+        # the pull got, so a first pull of a large shop can stop and resume.
+        # Returns False if local changes were queued meanwhile.
+        database = self.database
+        state = database.db.sync_state.find_one({'_id': SYNC_STATE_ID}) or {}
+        since = state.get('bills_since')
+        last = None
+        while True:
+            query, _, sort = bill_search_query(start_date=since, sort_key='date', descending=False, after=last)
+            bills = list(self.remote.bills.find(query).sort(sort).limit(self.pull_page_size))
+            if not bills:
+                return True
+
+            def apply(session):
+                if database.outbox.count_documents({}, session=session):
+                    return False
+                # The server's numbering wins over a stale local copy
+                clashes = []
+                for bill in bills:
+                    clash = database.bills.find_one(
+                        {'bill_type': bill['bill_type'], 'invoice_number': bill['invoice_number']},
+                        {'_id': 1}, session=session
+                    )
+                    if clash is not None and clash['_id'] != bill['_id']:
+                        clashes.append(clash['_id'])
+                if clashes:
+                    database.bills.delete_many({'_id': {'$in': clashes}}, session=session)
+                database.bills.bulk_write([
+                    UpdateRequest({'_id': bill['_id']}, {'$set': bill}, upsert=True) for bill in bills
+                ], ordered=False, session=session)
+                database.db.sync_state.update_one(
+                    {'_id': SYNC_STATE_ID}, {'$set': {'bills_since': bills[-1]['date'] - PULL_OVERLAP}},
+                    upsert=True, session=session
+                )
+                return True
+
+            if not database.run_transaction(apply):
+                return False
+            if len(bills) < self.pull_page_size:
+                return True
+            last = bills[-1]
+
+    def reconcile_deleted_bills(self):
+        # Removes the local copies of bills deleted on the server. The
+        # server's _ids are read a page at a time in _id order and compared
+        # with the same range of local _ids. Bills still waiting to sync are
+        # left alone. Returns False if local changes were queued meanwhile.
+        database = self.database
+        local_ids = sorted(
+            bill['_id'] for bill in database.bills.find({'pending_sync': {'$ne': True}}, {'_id': 1})
+        )
+        after = None
+        while True:
+            query = {'_id': {'$gt': after}} if after is not None else {}
+            remote_ids = [
+                bill['_id'] for bill in
+                self.remote.bills.find(query, {'_id': 1}).sort('_id', 1).limit(RECONCILE_PAGE_SIZE)
+            ]
+            # The last page covers everything after the previous one
+            end = remote_ids[-1] if len(remote_ids) == RECONCILE_PAGE_SIZE else None
+            start = bisect_right(local_ids, after) if after is not None else 0
+            stop = bisect_right(local_ids, end) if end is not None else len(local_ids)
+            remote_ids = set(remote_ids)
+            deleted = [bill_id for bill_id in local_ids[start:stop] if bill_id not in remote_ids]
+            if deleted:
+                def remove(session):
+                    if database.outbox.count_documents({}, session=session):
+                        return False
+                    database.bills.delete_many(
+                        {'_id': {'$in': deleted}, 'pending_sync': {'$ne': True}}, session=session
+                    )
+                    return True
+                if not database.run_transaction(remove):
+                    return False
+                logger.info("Removed %d bills deleted on the server", len(deleted))
+            if end is None:
+                return True
+            after = end
@@ -0,0 +1,179 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import QMessageBox
+from db_connection import DatabaseError
+import asyncio
+import itertools
+import threading
+
+class DbFuture:
+    # Handle for a call submitted to DbWorker. Cancelling cannot interrupt a
+    # query the server is already running, but it stops a queued call from
+    # starting and guarantees on_result/on_error never run. on_done always
+    # runs, so busy indicators are released either way.
+    def __init__(self, key, on_result, on_error, on_done):
+        self.key = key
+        self.on_result = on_result
+        self.on_error = on_error
+        self.on_done = on_done
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+class DbTask(QRunnable):
+    def __init__(self, worker, task_id, future, fn, args, kwargs):
+        super().__init__()
+        self.worker = worker
+        self.task_id = task_id
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if self.future.cancelled():
+            self.worker.task_failed.emit(self.task_id, None)
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.worker.task_failed.emit(self.task_id, e)
+            return
+        self.worker.task_finished.emit(self.task_id, result)
+
+class DbWorker(QObject):
+    # Runs Database calls on a thread pool (AsyncDatabase coroutines on an
+    # asyncio loop thread) and hands the results back to the GUI thread.
+    # Calls submitted with the same key supersede each other: only the
+    # newest one's callbacks run.
+    task_finished = pyqtSignal(int, object)
+    task_failed = pyqtSignal(int, object)
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None, max_threads=4):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._latest = {}
+        self._loop = None
+        # Emitted from pool threads, delivered on the thread owning the worker
+        self.task_finished.connect(self._deliver_result, Qt.QueuedConnection)
+        self.task_failed.connect(self._deliver_error, Qt.QueuedConnection)
+
+    def _register(self, key, on_result, on_error, on_done):
+        future = DbFuture(key, on_result, on_error, on_done)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = future
+        task_id = next(self._ids)
+        self._pending[task_id] = future
+        if len(self._pending) == 1:
+            self.busy_changed.emit(True)
+        return task_id, future
+
+    def submit(self, fn, *args, key=None, on_result=None, on_error=None, on_done=None, **kwargs):
+        task_id, future = self._register(key, on_result, on_error, on_done)
+        self.pool.start(DbTask(self, task_id, future, fn, args, kwargs))
+        return future
+
+    def submit_async(self, coro_fn, *args, key=None, on_result=None, on_error=None, on_done=None, **kwargs):
+        # Like submit, for AsyncDatabase coroutines. They all share one event
+        # loop, so calls submitted together run concurrently without taking
+        # a pool thread each.
+        task_id, future = self._register(key, on_result, on_error, on_done)
+        asyncio.run_coroutine_threadsafe(self._run_async(task_id, future, coro_fn, args, kwargs), self._async_loop())
+        return future
+
+    def _async_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name='db-async', daemon=True).start()
+        return self._loop
+
+    async def _run_async(self, task_id, future, coro_fn, args, kwargs):
+        if future.cancelled():
+            self.task_failed.emit(task_id, None)
+            return
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except Exception as e:
+            self.task_failed.emit(task_id, e)
+            return
+        self.task_finished.emit(task_id, result)
+
+    def cancel(self, key):
+        future = self._latest.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def is_busy(self):
+        return bool(self._pending)
+
+    def _finish(self, task_id):
+        future = self._pending.pop(task_id)
+        if future.key is not None and self._latest.get(future.key) is future:
+            del self._latest[future.key]
+        if not self._pending:
+            self.busy_changed.emit(False)
+        return future
+
+    @pyqtSlot(int, object)
+    def _deliver_result(self, task_id, result):
+        future = self._finish(task_id)
+        try:
+            if future.on_result is not None and not future.cancelled():
+                future.on_result(result)
+        finally:
+            if future.on_done is not None:
+                future.on_done()
+
+    @pyqtSlot(int, object)
+    def _deliver_error(self, task_id, error):
+        future = self._finish(task_id)
+        try:
+            if future.on_error is not None and not future.cancelled():
+                future.on_error(error)
+        finally:
+            if future.on_done is not None:
+                future.on_done()
+
+_worker = None
+
+def get_worker():
+    # Shared by every module; must first be called from the GUI thread
+    global _worker
+    if _worker is None:
+        _worker = DbWorker()
+    return _worker
+
+class BusyMixin:
+    # For widgets that run DbWorker calls and have a status_label. Calls
+    # nest: the status clears and busy_widgets() are enabled again once
+    # every pending call is done.
+    _busy_count = 0
+
+    def busy_widgets(self):
+        return []
+
+    def set_busy(self, busy, message=""):
+        self._busy_count = max(self._busy_count + (1 if busy else -1), 0)
+        if busy:
+            self.status_label.setText(message)
+        elif not self._busy_count:
+            self.status_label.setText("")
+        idle = not self._busy_count
+        for widget in self.busy_widgets():
+            widget.setEnabled(idle)
+
+def show_error(parent, error, action):
+    if isinstance(error, DatabaseError):
+        QMessageBox.critical(parent, "Database Error", str(error))
+    else:
+        QMessageBox.critical(parent, "Error", f"Failed to {action}: {str(error)}")
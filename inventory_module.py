@@ -1,37 +1,74 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
-                            QTableWidget, QTableWidgetItem, QDialog, QLabel, 
-                            QLineEdit, QMessageBox, QInputDialog, QStyledItemDelegate)
-from PyQt5.QtCore import Qt, pyqtSignal
+                            QTableView, QHeaderView, QDialog, QLabel, 
+                            QLineEdit, QMessageBox, QInputDialog,
+                            QPlainTextEdit, QFileDialog)
+from PyQt5.QtCore import Qt, QModelIndex, QAbstractTableModel, pyqtSignal
 from PyQt5.QtGui import QFont
-from db_connection import Database, DatabaseError
-from dotenv import load_dotenv
-import sys
+from db_connection import get_database, load_env, DatabaseError
+from db_worker import get_worker, show_error, BusyMixin
+from button_delegate import ButtonDelegate
+import bisect
 import os
 
-class ButtonDelegate(QStyledItemDelegate):
+INVENTORY_HEADERS = ['Model', 'Quantity', 'Actions']
+QUANTITY_COLUMN = 1
+ACTIONS_COLUMN = 2
+
+class InventoryTableModel(QAbstractTableModel):
+    # Inventory records sorted by model, with a model -> row index so a stock
+    # change repaints only its own row
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.buttons = {}
+        self.records = []
+        self.rows = {}
     
-    def createEditor(self, parent, option, index):
-        if index.column() == 2:  # Action column
-            widget = QWidget(parent)
-            layout = QHBoxLayout()
-            layout.setContentsMargins(0, 0, 0, 0)
-            
-            add_btn = QPushButton("+")
-            add_btn.setFixedSize(30, 30)
-            add_btn.clicked.connect(lambda: self.parent().add_stock(index.row()))
-            
-            sub_btn = QPushButton("-")
-            sub_btn.setFixedSize(30, 30)
-            sub_btn.clicked.connect(lambda: self.parent().subtract_stock(index.row()))
-            
-            layout.addWidget(add_btn)
-            layout.addWidget(sub_btn)
-            widget.setLayout(layout)
-            return widget
-        return super().createEditor(parent, option, index)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(INVENTORY_HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return INVENTORY_HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        record = self.records[index.row()]
+        if index.column() == 0:
+            return record['model']
+        if index.column() == QUANTITY_COLUMN:
+            return str(record['quantity'])
+        return None
+    
+    def set_records(self, records):
+        self.beginResetModel()
+        self.records = sorted(records, key=lambda record: record['model'])
+        self.rows = {record['model']: row for row, record in enumerate(self.records)}
+        self.endResetModel()
+    
+    def add_record(self, record):
+        if record['model'] in self.rows:
+            return
+        row = bisect.bisect([item['model'] for item in self.records], record['model'])
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.records.insert(row, record)
+        for position in range(row, len(self.records)):
+            self.rows[self.records[position]['model']] = position
+        self.endInsertRows()
+    
+    def apply_changes(self, deltas):
+        # {model: change in quantity}; models not listed here are left to
+        # the next full load
+        for model, delta in deltas.items():
+            row = self.rows.get(model)
+            if row is None or not delta:
+                continue
+            self.records[row]['quantity'] += delta
+            index = self.index(row, QUANTITY_COLUMN)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
 
 class AddModelDialog(QDialog):
     def __init__(self, parent=None):
@@ -67,16 +104,65 @@ class AddModelDialog(QDialog):
     def get_model_name(self):
         return self.model_input.text().strip()
 
-class InventoryModule(QWidget):
-    model_added = pyqtSignal()
+class MetricsDialog(QDialog):
+    # Admin view of the Database call statistics (db_metrics)
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.setWindowTitle("Database Statistics")
+        self.resize(1000, 600)
+        
+        layout = QVBoxLayout()
+        
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFont('Courier New', 10))
+        layout.addWidget(self.text)
+        
+        btn_layout = QHBoxLayout()
+        for label, handler in (("Refresh", self.refresh), ("Reset", self.reset),
+                               ("Save…", self.save), ("Close", self.accept)):
+            btn = QPushButton(label)
+            btn.setFont(QFont('Arial', 12))
+            btn.clicked.connect(handler)
+            btn_layout.addWidget(btn)
+        layout.addLayout(btn_layout)
+        
+        self.setLayout(layout)
+        self.refresh()
+    
+    def refresh(self):
+        self.text.setPlainText(self.metrics.summary())
+    
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+    
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save Database Statistics", "db_stats.txt", "Text Files (*.txt);;JSON Files (*.json)"
+        )
+        if path:
+            try:
+                self.metrics.dump(path)
+            except OSError as e:
+                QMessageBox.critical(self, "Error", f"Failed to save statistics: {str(e)}")
+
+class InventoryModule(BusyMixin, QWidget):
+    # Name of the new model
+    model_added = pyqtSignal(str)
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, db=None):
         super().__init__(parent)
         try:
-            self.db = Database()
+            self.db = db if db is not None else get_database()
+            self.worker = get_worker()
             self.is_admin = False
+            self.stock = InventoryTableModel(self)
             self.setup_ui()
-            self.load_inventory()
+            # With a background connection the main window loads us later
+            if self.db.connected:
+                self.load_inventory()
         except DatabaseError as e:
             QMessageBox.critical(self, "Database Error", str(e))
         except Exception as e:
@@ -89,11 +175,11 @@ class InventoryModule(QWidget):
         btn_layout = QHBoxLayout()
         
         # Refresh button
-        refresh_btn = QPushButton("Refresh")
-        refresh_btn.setFont(QFont('Arial', 12))
-        refresh_btn.setMinimumHeight(35)
-        refresh_btn.clicked.connect(self.load_inventory)
-        btn_layout.addWidget(refresh_btn)
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.setFont(QFont('Arial', 12))
+        self.refresh_btn.setMinimumHeight(35)
+        self.refresh_btn.clicked.connect(self.refresh_inventory)
+        btn_layout.addWidget(self.refresh_btn)
         
         # Admin login/logout button
         self.admin_btn = QPushButton("Admin Login")
@@ -102,18 +188,33 @@ class InventoryModule(QWidget):
         self.admin_btn.clicked.connect(self.toggle_admin)
         btn_layout.addWidget(self.admin_btn)
         
+        # Database statistics, admin only
+        self.stats_btn = QPushButton("Database Stats")
+        self.stats_btn.setFont(QFont('Arial', 12))
+        self.stats_btn.setMinimumHeight(35)
+        self.stats_btn.clicked.connect(self.show_metrics)
+        self.stats_btn.setVisible(False)
+        btn_layout.addWidget(self.stats_btn)
+        
         layout.addLayout(btn_layout)
         
+        self.status_label = QLabel("")
+        self.status_label.setFont(QFont('Arial', 12))
+        layout.addWidget(self.status_label)
+        
         # Create table
-        self.table = QTableWidget()
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(['Model', 'Quantity', 'Actions'])
+        self.table = QTableView()
+        self.table.setModel(self.stock)
+        # "+" / "-" are painted, and only while an admin is logged in
+        self.stock_actions = ButtonDelegate(("+", "-"), QFont('Arial', 14), button_size=(30, 30), parent=self.table)
+        self.stock_actions.clicked.connect(self.on_stock_action)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.horizontalHeader().setDefaultSectionSize(400)
         self.table.setFont(QFont('Arial', 14))
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.verticalHeader().setDefaultSectionSize(40)
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 font-size: 14px;
             }
             QHeaderView::section {
@@ -139,22 +240,13 @@ class InventoryModule(QWidget):
                 "Enter admin password:",
                 QLineEdit.Password
             )
-            # Get the correct path for .env file
-            if getattr(sys, 'frozen', False):
-                # If the application is run as a bundle
-                application_path = sys._MEIPASS
-            else:
-                # If the application is run from a Python interpreter
-                application_path = os.path.dirname(os.path.abspath(__file__))
-
-            # Load .env file from the correct location
-            env_path = os.path.join(application_path, '.env')
-            load_dotenv(env_path)
+            load_env()
             if ok and password == (os.getenv('PASS')):
                 self.is_admin = True
                 self.admin_btn.setText("Admin Logout")
                 self.add_model_btn.setVisible(True)
-                self.load_inventory()  # Reload to show action buttons
+                self.stats_btn.setVisible(True)
+                self.show_stock_actions(True)
                 QMessageBox.information(self, "Success", "Admin login successful")
             elif ok:
                 QMessageBox.warning(self, "Error", "Incorrect password")
@@ -163,54 +255,73 @@ class InventoryModule(QWidget):
             self.is_admin = False
             self.admin_btn.setText("Admin Login")
             self.add_model_btn.setVisible(False)
-            self.load_inventory()  # Reload to hide action buttons
+            self.stats_btn.setVisible(False)
+            self.show_stock_actions(False)
             QMessageBox.information(self, "Success", "Admin logout successful")
     
-    def load_inventory(self):
+    def show_stock_actions(self, visible):
+        # Swapping the column's delegate repaints it; no rows are rebuilt
+        self.table.setItemDelegateForColumn(ACTIONS_COLUMN, self.stock_actions if visible else None)
+        self.table.viewport().update()
+    
+    def show_metrics(self):
+        if self.db.metrics is None:
+            QMessageBox.information(self, "Database Statistics",
+                                    "Set DB_METRICS=1 in .env and restart to collect database statistics.")
+            return
+        MetricsDialog(self.db.metrics, self).exec_()
+    
+    def busy_widgets(self):
+        return [self.refresh_btn, self.add_model_btn, self.table]
+    
+    def refresh_inventory(self):
+        # Explicit refresh re-reads the server, picking up other counters' sales
+        self.load_inventory(refresh=True)
+    
+    def load_inventory(self, refresh=False):
+        self.set_busy(True, "Loading inventory…")
+        self.worker.submit(
+            self.db.get_inventory, refresh=bool(refresh), key=('inventory', id(self)),
+            on_result=self.populate_inventory,
+            on_error=lambda error: show_error(self, error, "load inventory"),
+            on_done=lambda: self.set_busy(False)
+        )
+    
+    def populate_inventory(self, inventory):
         try:
-            self.table.setRowCount(0)
-            inventory = self.db.get_inventory()
-            
-            for row, item in enumerate(inventory):
-                self.table.insertRow(row)
-                self.table.setItem(row, 0, QTableWidgetItem(item['model']))
-                self.table.setItem(row, 1, QTableWidgetItem(str(item['quantity'])))
-                
-                # Add action buttons only if admin is logged in
-                if self.is_admin:
-                    action_widget = QWidget()
-                    action_layout = QHBoxLayout()
-                    action_layout.setContentsMargins(0, 0, 0, 0)
-                    
-                    add_btn = QPushButton("+")
-                    add_btn.setFixedSize(30, 30)
-                    add_btn.clicked.connect(lambda checked, r=row: self.add_stock(r))
-                    
-                    sub_btn = QPushButton("-")
-                    sub_btn.setFixedSize(30, 30)
-                    sub_btn.clicked.connect(lambda checked, r=row: self.subtract_stock(r))
-                    
-                    action_layout.addWidget(add_btn)
-                    action_layout.addWidget(sub_btn)
-                    action_widget.setLayout(action_layout)
-                    
-                    self.table.setCellWidget(row, 2, action_widget)
-                else:
-                    # Empty cell when not admin
-                    self.table.setItem(row, 2, QTableWidgetItem(""))
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+            self.stock.set_records(inventory)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load inventory: {str(e)}")
     
+    def apply_stock_changes(self, deltas):
+        # Stock moved by a bill or an admin; {model: change in quantity}
+        self.stock.apply_changes(deltas)
+    
+    def change_stock(self, model, quantity, message):
+        def done(_):
+            self.apply_stock_changes({model: quantity})
+            QMessageBox.information(self, "Success", message)
+        self.set_busy(True, "Saving…")
+        self.worker.submit(
+            self.db.update_inventory, model, quantity,
+            on_result=done,
+            on_error=lambda error: show_error(self, error, "update stock"),
+            on_done=lambda: self.set_busy(False)
+        )
+    
+    def on_stock_action(self, row, button):
+        if button == 0:
+            self.add_stock(row)
+        else:
+            self.subtract_stock(row)
+    
     def add_stock(self, row):
         if not self.is_admin:
             QMessageBox.warning(self, "Error", "Admin access required")
             return
             
         try:
-            model = self.table.item(row, 0).text()
-            current_qty = int(self.table.item(row, 1).text())
+            model = self.stock.records[row]['model']
             
             quantity, ok = QInputDialog.getInt(
                 self, "Add Stock",
@@ -219,11 +330,7 @@ class InventoryModule(QWidget):
             )
             
             if ok:
-                self.db.update_inventory(model, quantity)
-                self.load_inventory()
-                QMessageBox.information(self, "Success", "Stock added successfully")
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+                self.change_stock(model, quantity, "Stock added successfully")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to add stock: {str(e)}")
     
@@ -233,8 +340,9 @@ class InventoryModule(QWidget):
             return
             
         try:
-            model = self.table.item(row, 0).text()
-            current_qty = int(self.table.item(row, 1).text())
+            record = self.stock.records[row]
+            model = record['model']
+            current_qty = record['quantity']
             
             quantity, ok = QInputDialog.getInt(
                 self, "Remove Stock",
@@ -243,11 +351,7 @@ class InventoryModule(QWidget):
             )
             
             if ok:
-                self.db.update_inventory(model, -quantity)
-                self.load_inventory()
-                QMessageBox.information(self, "Success", "Stock removed successfully")
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+                self.change_stock(model, -quantity, "Stock removed successfully")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to remove stock: {str(e)}")
     
@@ -261,13 +365,20 @@ class InventoryModule(QWidget):
             if dialog.exec_():
                 model_name = dialog.get_model_name()
                 if model_name:
-                    if self.db.add_new_model(model_name):
-                        self.load_inventory()
-                        self.model_added.emit()
-                        QMessageBox.information(self, "Success", "New model added successfully")
-                    else:
-                        QMessageBox.warning(self, "Error", "Model already exists")
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+                    self.set_busy(True, "Saving…")
+                    self.worker.submit(
+                        self.db.add_new_model, model_name,
+                        on_result=lambda added: self.on_model_added(added, model_name),
+                        on_error=lambda error: show_error(self, error, "add new model"),
+                        on_done=lambda: self.set_busy(False)
+                    )
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to add new model: {str(e)}") 
\ No newline at end of file
+            QMessageBox.critical(self, "Error", f"Failed to add new model: {str(e)}")
+    
+    def on_model_added(self, added, model):
+        if added:
+            self.stock.add_record({'model': model, 'quantity': 0})
+            self.model_added.emit(model)
+            QMessageBox.information(self, "Success", "New model added successfully")
+        else:
+            QMessageBox.warning(self, "Error", "Model already exists")
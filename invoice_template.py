@@ -0,0 +1,292 @@
+from PyQt5.QtGui import QTextDocument, QFont, QImage
+from PyQt5.QtCore import QUrl
+from collections import OrderedDict
+from db_connection import get_application_path
+from money import to_paise
+import functools
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Rendered invoices kept for reopening and reprinting
+INVOICE_CACHE_SIZE = 32
+
+# The invoice table is padded with blank rows up to this many lines
+MIN_INVOICE_ROWS = 10
+# Width invoices are laid out at, once per cached document
+INVOICE_PAGE_WIDTH = 850
+
+SHOP_GSTIN = "27DUSPS0660B1ZF"
+SHOP_CONTACT = "9922444406, 9405903830"
+BANK_DETAILS = {
+    'name': 'Bank of Maharashtra',
+    'branch': 'Hinganghat Branch',
+    'account': '60211537562',
+    'ifsc': 'MAHB0000059',
+    'pan': 'DUSPS0660B'
+}
+
+LOGO_PATH = os.path.join(get_application_path(), 'Amaron-Logo.png')
+# Name the invoice HTML uses for the logo, served from memory
+LOGO_RESOURCE = 'branding/amaron-logo.png'
+
+UNITS = ["", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine"]
+TEENS = ["Ten", "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen"]
+TENS = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
+
+def _less_than_thousand(n):
+    if n == 0:
+        return ""
+    elif n < 10:
+        return UNITS[n]
+    elif n < 20:
+        return TEENS[n - 10]
+    elif n < 100:
+        return TENS[n // 10] + (" " + UNITS[n % 10] if n % 10 != 0 else "")
+    else:
+        return UNITS[n // 100] + " Hundred" + (" and " + _less_than_thousand(n % 100) if n % 100 != 0 else "")
+
+def _number_to_words(n):
+    # Indian grouping: thousand, lakh, crore
+    if n == 0:
+        return ""
+    elif n < 1000:
+        return _less_than_thousand(n)
+    elif n < 100000:
+        return _less_than_thousand(n // 1000) + " Thousand" + (" " + _less_than_thousand(n % 1000) if n % 1000 != 0 else "")
+    elif n < 10000000:
+        return _less_than_thousand(n // 100000) + " Lakh" + (" " + _number_to_words(n % 100000) if n % 100000 != 0 else "")
+    else:
+        return _less_than_thousand(n // 10000000) + " Crore" + (" " + _number_to_words(n % 10000000) if n % 10000000 != 0 else "")
+
+@functools.lru_cache(maxsize=4096)
+def amount_in_words(paise):
+    if paise == 0:
+        return "Zero"
+    rupees, paise = divmod(paise, 100)
+    result = _number_to_words(rupees) + " Rupees"
+    if paise > 0:
+        result += " and " + _less_than_thousand(paise) + " Paise"
+    return result
+
+# The invoice in pieces, with everything that never changes filled in once.
+# Filled with str.format; the markup has no other braces.
+INVOICE_HEADER = """
+        <div style='font-family: Arial; font-size: 14px; padding: 24px;'>
+            <table width='800' style=' border-collapse: collapse; margin-bottom: 0;'>
+                <tr>
+                    <td width='600' style='vertical-align: top; padding: 0;'>
+                        <div style='font-size: 28px; font-weight: bold;'>Vaibhav Sales</div>
+                        <div style='font-size: 15px; margin-top: 2px;'>Deals Inverter, UPS and All Types of Batteries</div>
+                        <div style='font-size: 14px; margin-top: 2px;'>Tukdoji Square, Nehru Ward,<br>Hinganghat- 442301, Dist. Wardha (M.S.)</div>
+                    </td>
+                    <td style='vertical-align: top; width: 40%; text-align: right; padding: 0;'>
+                        <div style='font-size: 13px;'>Subject to Hinganghat Jurisdiction</div>
+                        <div style='font-size: 13px;'>GSTIN: SHOP_GSTIN</div>
+                        <div style='font-size: 13px;'>SHOP_CONTACT</div>
+                        <div style='font-size: 13px; margin-top: 8px;'>Authorised Dealer:     </div><br>
+                        <img src='LOGO_RESOURCE' width='160' height='40' style='object-fit: contain;'>
+                    </td>
+                </tr>
+            </table>
+            <hr style='border: 1px solid #000; margin: 10px 0 16px 0;'>
+            <table width='800' style='border-collapse: collapse; margin-bottom: 0;'>
+                <tr>
+                    <td width='650' style=' vertical-align: top; padding: 0;'>
+                        <span style='font-size: 17px; font-weight: bold;'>M/s. {customer_name}</span><br>
+                        {customer_gstin}
+                    </td>
+                    <td width='150' style=' text-align: left; vertical-align: top; padding: 0;'>
+                        <span style='font-size: 13px;'><b>Bill No.:</b> {invoice_number}</span><br>
+                        <span style='font-size: 13px;'><b>Date:</b> {date}</span>
+                    </td>
+                </tr>
+            </table>
+            <hr style='border: 1px solid #000; margin: 10px 0 16px 0;'>
+            <table cellpadding='10' border='0' width='800' style=' border-collapse: collapse; margin: 0 0 20px 0;'>
+                <tr style='background: #f0f0f0;'>
+                    <th width='50' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Sr. No.</th>
+                    <th width='470' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Particulars</th>
+                    <th width='80' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Qty</th>
+                    <th width='100' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Rate</th>
+                    <th width='100' style='border: 1px solid #000; padding: 8px;  font-size: 14px;'>Amount</th>
+                </tr>
+        """.replace('SHOP_GSTIN', SHOP_GSTIN).replace('SHOP_CONTACT', SHOP_CONTACT).replace('LOGO_RESOURCE', LOGO_RESOURCE)
+
+CUSTOMER_GSTIN = "<span style='font-size: 13px;'>GSTIN: {}</span>"
+
+ITEM_ROW = """
+                <tr>
+                    <td style='border: 1px solid #000; padding: 8px; text-align: center;'>{0}</td>
+                    <td style='border: 1px solid #000; padding: 8px;'>{1}</td>
+                    <td style='border: 1px solid #000; padding: 8px; text-align: center;'>{2}</td>
+                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{3:.2f}</td>
+                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{4:.2f}</td>
+                </tr>
+            """
+
+BLANK_ROW = """
+                    <tr>
+                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
+                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
+                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
+                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
+                        <td style='border-left: 1px solid #000; border-right: 1px solid #000;'>&nbsp;</td>
+                    </tr>
+                """
+# Padding for every item count below MIN_INVOICE_ROWS
+BLANK_ROWS = [BLANK_ROW * (MIN_INVOICE_ROWS - count) for count in range(MIN_INVOICE_ROWS)]
+
+GST_TOTALS = """
+                <tr>
+                    <td rowspan='4' colspan='2' align='left' valign='bottom' style='border: 1px solid #000; padding: 8px;'><p><strong>Amount in words:</strong> {amount_in_words}</p></td>
+                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Subtotal</strong></td>
+                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{subtotal:.2f}</td>
+                </tr>
+                <tr>
+                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>CGST ({half_gst_percent:.1f}%)</strong></td>
+                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{cgst:.2f}</td>
+                </tr>
+                <tr>
+                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>SGST ({half_gst_percent:.1f}%)</strong></td>
+                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{sgst:.2f}</td>
+                </tr>
+            """
+
+NON_GST_TOTALS = """
+                <tr>
+                    <td rowspan='3' colspan='2' align='left' valign='bottom' style='border: 1px solid #000; padding: 8px;'><p><strong>Amount in words:</strong> {amount_in_words}</p></td>
+                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Subtotal</strong></td>
+                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{subtotal:.2f}</td>
+                </tr>
+                <tr>
+                    <td colspan='2' style='border: 1px solid #000; padding: 8px; text-align: right;'><strong>Buyback Amount</strong></td>
+                    <td style='border: 1px solid #000; padding: 8px; text-align: right;'>₹{buyback:.2f}</td>
+                </tr>
+            """
+
+INVOICE_FOOTER = """
+                <tr>
+                    <td colspan='2' style='text-align:right; border:1px solid #000; padding:8px;'><strong>Grand Total</strong></td>
+                    <td style='border:1px solid #000; padding:8px; text-align:right;'>₹{total:.2f}</td>
+                </tr>
+            </table>
+            <div style='display: flex; margin: 20px 0;'>
+                <div style='width: 70%;'>
+                    
+                    <p style='margin: 10px 0;'>
+                        <strong>Bank Details:</strong><br>
+                        Name of Bank: BANK_NAME<br>
+                        BANK_BRANCH<br>
+                        A/c No.: BANK_ACCOUNT<br>
+                        IFSC: BANK_IFSC<br>
+                        PAN: BANK_PAN
+                    </p>
+                </div>
+                <div style='width: 30%; text-align: right;'>
+                    <p style='margin: 0;'>For, Vaibhav Sales</p>
+                    <div style='height: 50px;'></div>
+                    <p style='margin: 0;'>Auth. Signatory</p>
+                </div>
+            </div>
+            <hr style='border: 1px solid #000; margin: 20px 0;'>
+            <div style='display: flex; justify-content: space-between; font-size: 12px;'>
+                <div style='width: 70%;'>
+                    <p style='margin: 0;'>No Exchange, No Return. Receipt subject to clearance of cheque. Warranty applicable as per companies norms. No warranty for damage to any part.</p>
+                    <p style='margin: 5px 0;'>Thanks!</p>
+                </div>
+            </div>
+        </div>
+        """
+for _field, _value in BANK_DETAILS.items():
+    INVOICE_FOOTER = INVOICE_FOOTER.replace(f"BANK_{_field.upper()}", _value)
+
+class BrandingResources:
+    # Branding images decoded once for the whole application and added to
+    # every invoice document, instead of each document reading the file
+    def __init__(self, files):
+        # {resource name: file path}
+        self.files = files
+        self._images = None
+
+    def images(self):
+        if self._images is None:
+            self._images = {}
+            for name, path in self.files.items():
+                image = QImage(path)
+                if image.isNull():
+                    logger.warning("Could not load invoice image %s", path)
+                    continue
+                self._images[name] = image
+        return self._images
+
+    def add_to(self, document):
+        # QImage is implicitly shared, so this copies no pixels
+        for name, image in self.images().items():
+            document.addResource(QTextDocument.ImageResource, QUrl(name), image)
+
+branding = BrandingResources({LOGO_RESOURCE: LOGO_PATH})
+
+def render_invoice_html(bill):
+    is_gst = bill['bill_type'] == 'gst'
+    parts = [INVOICE_HEADER.format(
+        customer_name=bill['customer_name'],
+        customer_gstin=CUSTOMER_GSTIN.format(bill.get('customer_gstin', '')) if is_gst else "",
+        invoice_number=bill['invoice_number'],
+        date=bill['date'].strftime('%Y-%m-%d'),
+    )]
+    items = bill['items']
+    parts.extend(ITEM_ROW.format(idx, item['model'], item['quantity'], item['discounted_price'], item['total'])
+                 for idx, item in enumerate(items, 1))
+    if len(items) < MIN_INVOICE_ROWS:
+        parts.append(BLANK_ROWS[len(items)])
+    words = amount_in_words(to_paise(bill['total']))
+    if is_gst:
+        parts.append(GST_TOTALS.format(amount_in_words=words, subtotal=bill['subtotal'],
+                                       half_gst_percent=bill['gst_percent'] / 2, cgst=bill['cgst'], sgst=bill['sgst']))
+    else:
+        parts.append(NON_GST_TOTALS.format(amount_in_words=words, subtotal=bill['subtotal'], buyback=bill['buyback']))
+    parts.append(INVOICE_FOOTER.format(total=bill['total']))
+    return "".join(parts)
+
+def invoice_key(bill):
+    # Invoice number plus a hash of everything printed, so an edited bill
+    # gets a fresh render
+    content = (
+        bill['customer_name'], bill.get('customer_gstin'), bill['date'],
+        tuple((item['model'], item['quantity'], item['discounted_price'], item['total']) for item in bill['items']),
+        bill.get('subtotal'), bill.get('gst_percent'), bill.get('cgst'), bill.get('sgst'),
+        bill.get('buyback'), bill['total'],
+    )
+    return bill['bill_type'], bill['invoice_number'], hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+class InvoiceCache:
+    # Laid-out invoice documents, least recently used dropped first. Only
+    # used from the GUI thread.
+    def __init__(self, size):
+        self.size = size
+        self._documents = OrderedDict()
+
+    def document(self, bill, font=None):
+        key = invoice_key(bill)
+        document = self._documents.get(key)
+        if document is not None:
+            self._documents.move_to_end(key)
+            return document
+        document = QTextDocument()
+        document.setDefaultFont(font or QFont('Arial', 12))
+        # Before setHtml, so the logo is never looked up on disk
+        branding.add_to(document)
+        document.setHtml(render_invoice_html(bill))
+        document.setTextWidth(INVOICE_PAGE_WIDTH)
+        self._documents[key] = document
+        while len(self._documents) > self.size:
+            self._documents.popitem(last=False)
+        return document
+
+    def clear(self):
+        self._documents.clear()
+
+invoice_cache = InvoiceCache(INVOICE_CACHE_SIZE)
@@ -0,0 +1,630 @@
+from bson import ObjectId, json_util
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from types import SimpleNamespace
+import copy
+import re
+import sqlite3
+import threading
+
+# Embedded stand-in for the part of the PyMongo API that Database and
+# db_indexes use: find/find_one with projection, sort and limit, the
+# insert/update/delete calls, bulk_write of UpdateRequest, unique indexes and
+# sessions with all-or-nothing transactions. LocalClient() keeps everything
+# in memory; LocalClient(path) also writes every change through to SQLite.
+
+INDEX_COLLECTION = 'system.indexes'
+
+# Canonical Extended JSON keeps ints, floats, ObjectIds and dates distinct;
+# dates come back naive, like the ones PyMongo returns by default
+JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=False)
+
+class UpdateRequest(UpdateOne):
+    # An UpdateOne that keeps its arguments as public attributes, so
+    # LocalCollection.bulk_write can apply it; MongoClient takes it as it is
+    def __init__(self, filter, update, upsert=False):
+        super().__init__(filter, update, upsert=upsert)
+        self.filter = filter
+        self.update = update
+        self.upsert = upsert
+
+def _get_path(doc, path):
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+def _index_key(value):
+    # Mongo indexes 5 and 5.0 as the same key, where repr() would not
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value)
+
+def _compare(op, value, operand):
+    if value is None:
+        return False
+    try:
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        return value <= operand
+    except TypeError:
+        # Mongo only compares values of the same type
+        return False
+
+def _match_operators(value, exists, condition):
+    for op, operand in condition.items():
+        if op in ('$gt', '$gte', '$lt', '$lte'):
+            if not _compare(op, value, operand):
+                return False
+        elif op == '$ne':
+            if value == operand:
+                return False
+        elif op == '$in':
+            if value not in operand:
+                return False
+        elif op == '$exists':
+            if exists != bool(operand):
+                return False
+        elif op == '$regex':
+            flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+            if not isinstance(value, str) or not re.search(operand, value, flags):
+                return False
+        elif op == '$options':
+            continue
+        else:
+            raise OperationFailure(f"unknown operator: {op}")
+    return True
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(doc, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, part) for part in condition):
+                return False
+        else:
+            value, exists = _get_path(doc, key)
+            if isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+                if not _match_operators(value, exists, condition):
+                    return False
+            elif value != condition:
+                return False
+    return True
+
+def _include(source, target, parts):
+    if parts[0] not in source:
+        return
+    value = source[parts[0]]
+    if len(parts) == 1:
+        target[parts[0]] = copy.deepcopy(value)
+    elif isinstance(value, dict):
+        _include(value, target.setdefault(parts[0], {}), parts[1:])
+    elif isinstance(value, list):
+        # 'items.model' picks the field out of every element, as Mongo does
+        elements = target.setdefault(parts[0], [{} for _ in value])
+        for element, element_target in zip(value, elements):
+            if isinstance(element, dict):
+                _include(element, element_target, parts[1:])
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    fields = {key: value for key, value in projection.items() if key != '_id'}
+    if any(fields.values()) or (not fields and projection.get('_id')):
+        result = {}
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        for path, include in fields.items():
+            if include:
+                _include(doc, result, path.split('.'))
+        return result
+    result = copy.deepcopy(doc)
+    for path, include in projection.items():
+        if not include:
+            result.pop(path, None)
+    return result
+
+def _evaluate(expression, doc):
+    # The few aggregation expressions used by update pipelines
+    if isinstance(expression, str) and expression.startswith('$'):
+        return _get_path(doc, expression[1:])[0]
+    if isinstance(expression, dict):
+        if '$toLower' in expression:
+            return str(_evaluate(expression['$toLower'], doc) or '').lower()
+        if '$trim' in expression:
+            return str(_evaluate(expression['$trim']['input'], doc) or '').strip()
+        raise OperationFailure(f"unsupported expression: {list(expression)}")
+    return expression
+
+def _set_path(doc, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+def apply_update(doc, update):
+    if isinstance(update, list):
+        for stage in update:
+            for path, expression in stage.get('$set', {}).items():
+                _set_path(doc, path, _evaluate(expression, doc))
+        return
+    for op, fields in update.items():
+        if op == '$set':
+            for path, value in fields.items():
+                _set_path(doc, path, copy.deepcopy(value))
+        elif op == '$inc':
+            for path, amount in fields.items():
+                _set_path(doc, path, (_get_path(doc, path)[0] or 0) + amount)
+        else:
+            raise OperationFailure(f"unsupported update operator: {op}")
+
+def _sort_key(spec):
+    def key(doc):
+        values = []
+        for path, direction in spec:
+            value, exists = _get_path(doc, path)
+            # Missing fields sort before everything else, as in Mongo
+            entry = (1, value) if exists and value is not None else (0, 0)
+            values.append(entry if direction > 0 else _Reversed(entry))
+        return values
+    return key
+
+class _Reversed:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class LocalCursor:
+    def __init__(self, collection, query, projection, session=None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.session = session
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def explain(self):
+        # Reported in the shape Mongo uses, for db_indexes --report
+        with self.collection.client.lock:
+            index = self.collection._plan(self.query)[0]
+        if index is None:
+            return {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+        if index == '_id_':
+            return {'queryPlanner': {'winningPlan': {'stage': 'IDHACK'}}}
+        return {'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': index}
+        }}}
+
+    def __iter__(self):
+        with self.collection.client.lock:
+            docs = self.collection._read(self.query, self.session)
+            if self._sort:
+                docs.sort(key=_sort_key(self._sort))
+            if self._limit:
+                docs = docs[:self._limit]
+            return iter([project(doc, self.projection) for doc in docs])
+
+class LocalCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._docs = {}
+        # index name -> {'key': [(field, direction)], 'unique': bool}
+        self._indexes = {'_id_': {'key': [('_id', 1)], 'unique': True}}
+        # unique index name -> {key values: _id}
+        self._unique = {}
+
+    def _unique_values(self, spec, doc):
+        return tuple(_index_key(_get_path(doc, field)[0]) for field, _ in spec['key'])
+
+    def _check_unique(self, doc):
+        for name, entries in self._unique.items():
+            owner = entries.get(self._unique_values(self._indexes[name], doc))
+            if owner is not None and owner != doc['_id']:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+
+    def _store(self, doc_id, doc):
+        # The one place documents change, so indexes, the transaction
+        # journal and the SQLite write-through all stay in step
+        old = self._docs.get(doc_id)
+        if doc is not None:
+            self._check_unique(doc)
+        self.client._record(self, doc_id, old)
+        for name, entries in self._unique.items():
+            if old is not None:
+                entries.pop(self._unique_values(self._indexes[name], old), None)
+            if doc is not None:
+                entries[self._unique_values(self._indexes[name], doc)] = doc_id
+        if doc is None:
+            self._docs.pop(doc_id, None)
+        else:
+            self._docs[doc_id] = doc
+        self.client._dirty.add((self.name, doc_id))
+
+    def _plan(self, query):
+        # Returns (index name, candidate documents). Equality on _id, _id
+        # $in, or on every field of a unique index is answered from the
+        # index; anything else scans the collection. The candidates still
+        # go through matches() for the rest of the query.
+        query = query or {}
+        ids = query.get('_id')
+        if '_id' in query and not isinstance(ids, dict):
+            doc = self._docs.get(ids)
+            return '_id_', [doc] if doc is not None else []
+        if isinstance(ids, dict) and set(ids) == {'$in'}:
+            docs = (self._docs.get(doc_id) for doc_id in ids['$in'])
+            return '_id_', [doc for doc in docs if doc is not None]
+        for name, entries in self._unique.items():
+            fields = [field for field, _ in self._indexes[name]['key']]
+            values = [query.get(field) for field in fields]
+            if all(field in query for field in fields) and \
+                    not any(value is None or isinstance(value, dict) for value in values):
+                doc_id = entries.get(tuple(_index_key(value) for value in values))
+                return name, [self._docs[doc_id]] if doc_id is not None else []
+        return None, self._docs.values()
+
+    def _matching(self, query):
+        return [doc for doc in self._plan(query)[1] if matches(doc, query)]
+
+    def _committed(self, query):
+        # Documents as they were before the running transaction: the first
+        # journal entry for a document holds its committed version
+        before = {}
+        for collection, doc_id, old in self.client._journal:
+            if collection is self:
+                before.setdefault(doc_id, old)
+        docs = {doc['_id']: doc for doc in self._plan(query)[1]}
+        docs.update(before)
+        return [doc for doc in docs.values() if doc is not None and matches(doc, query)]
+
+    def _read(self, query, session):
+        # As on a replica set, a read made without the session while a
+        # transaction is running does not see that transaction's writes
+        if session is None and self.client._transaction:
+            return self._committed(query)
+        return self._matching(query)
+
+    def _first(self, query):
+        for doc in self._plan(query)[1]:
+            if matches(doc, query):
+                return doc
+        return None
+
+    def _upsert_doc(self, query, update):
+        doc = {key: copy.deepcopy(value) for key, value in (query or {}).items()
+               if not key.startswith('$') and not isinstance(value, dict)}
+        apply_update(doc, update)
+        doc.setdefault('_id', ObjectId())
+        return doc
+
+    def find(self, filter=None, projection=None, session=None):
+        return LocalCursor(self, filter, projection, session)
+
+    def find_one(self, filter=None, projection=None, session=None):
+        with self.client.lock:
+            if session is None and self.client._transaction:
+                docs = self._committed(filter)
+                doc = docs[0] if docs else None
+            else:
+                doc = self._first(filter)
+            return project(doc, projection) if doc is not None else None
+
+    def insert_one(self, document, session=None):
+        with self.client.operation():
+            # Like PyMongo, the caller's document gets the new _id
+            document.setdefault('_id', ObjectId())
+            if document['_id'] in self._docs:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+            self._store(document['_id'], copy.deepcopy(document))
+            return SimpleNamespace(inserted_id=document['_id'], acknowledged=True)
+
+    def insert_many(self, documents, ordered=True, session=None):
+        with self.client.operation():
+            return SimpleNamespace(
+                inserted_ids=[self.insert_one(document).inserted_id for document in documents],
+                acknowledged=True
+            )
+
+    def _update(self, filter, update, upsert, many):
+        with self.client.operation():
+            if many:
+                docs = self._matching(filter)
+            else:
+                doc = self._first(filter)
+                docs = [doc] if doc is not None else []
+            for doc in docs:
+                updated = copy.deepcopy(doc)
+                apply_update(updated, update)
+                self._store(doc['_id'], updated)
+            upserted_id = None
+            if not docs and upsert:
+                doc = self._upsert_doc(filter, update)
+                self._store(doc['_id'], doc)
+                upserted_id = doc['_id']
+            return SimpleNamespace(matched_count=len(docs), modified_count=len(docs),
+                                   upserted_id=upserted_id, acknowledged=True)
+
+    def update_one(self, filter, update, upsert=False, session=None):
+        return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False, session=None):
+        return self._update(filter, update, upsert, many=True)
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, session=None):
+        with self.client.operation():
+            doc = self._first(filter)
+            if doc is None:
+                if not upsert:
+                    return None
+                updated = self._upsert_doc(filter, update)
+            else:
+                updated = copy.deepcopy(doc)
+                apply_update(updated, update)
+            self._store(updated['_id'], updated)
+            result = updated if return_document == ReturnDocument.AFTER else doc
+            return project(result, projection) if result is not None else None
+
+    def find_one_and_delete(self, filter, projection=None, session=None):
+        with self.client.operation():
+            doc = self._first(filter)
+            if doc is None:
+                return None
+            self._store(doc['_id'], None)
+            return project(doc, projection)
+
+    def delete_one(self, filter, session=None):
+        with self.client.operation():
+            doc = self._first(filter)
+            if doc is not None:
+                self._store(doc['_id'], None)
+            return SimpleNamespace(deleted_count=int(doc is not None), acknowledged=True)
+
+    def delete_many(self, filter, session=None):
+        with self.client.operation():
+            docs = self._matching(filter)
+            for doc in docs:
+                self._store(doc['_id'], None)
+            return SimpleNamespace(deleted_count=len(docs), acknowledged=True)
+
+    def count_documents(self, filter, session=None):
+        with self.client.lock:
+            if filter or (session is None and self.client._transaction):
+                return len(self._read(filter, session))
+            return len(self._docs)
+
+    def bulk_write(self, requests, ordered=True, session=None):
+        # Only UpdateRequest is supported; Database issues nothing else
+        with self.client.operation():
+            matched = modified = 0
+            for request in requests:
+                if not isinstance(request, UpdateRequest):
+                    raise TypeError(f"unsupported bulk_write request: {request!r}")
+                result = self._update(request.filter, request.update, request.upsert, many=False)
+                matched += result.matched_count
+                modified += result.modified_count
+            return SimpleNamespace(matched_count=matched, modified_count=modified, acknowledged=True)
+
+    def create_index(self, keys, name=None, unique=False, session=None):
+        with self.client.operation():
+            keys = [(keys, 1)] if isinstance(keys, str) else [(field, int(direction)) for field, direction in keys]
+            name = name or '_'.join(f"{field}_{direction}" for field, direction in keys)
+            self._add_index(name, keys, unique)
+            self.client._collection(INDEX_COLLECTION)._store(
+                f"{self.name}.{name}", {'_id': f"{self.name}.{name}", 'ns': self.name, 'name': name,
+                                        'key': [list(entry) for entry in keys], 'unique': unique}
+            )
+            return name
+
+    def _add_index(self, name, keys, unique):
+        spec = {'key': [tuple(entry) for entry in keys], 'unique': unique}
+        if unique:
+            entries = {}
+            for doc in self._docs.values():
+                values = self._unique_values(spec, doc)
+                if values in entries:
+                    raise OperationFailure(f"E11000 duplicate key error collection: {self.name} index: {name}")
+                entries[values] = doc['_id']
+            self._unique[name] = entries
+        self._indexes[name] = spec
+
+    def drop_index(self, name, session=None):
+        with self.client.operation():
+            if name not in self._indexes or name == '_id_':
+                raise OperationFailure(f"index not found with name [{name}]")
+            del self._indexes[name]
+            self._unique.pop(name, None)
+            self.client._collection(INDEX_COLLECTION)._store(f"{self.name}.{name}", None)
+
+    def index_information(self):
+        with self.client.lock:
+            return {name: {'key': list(spec['key']), 'unique': spec['unique']}
+                    for name, spec in self._indexes.items()}
+
+class LocalDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return self.client._collection(name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def command(self, name):
+        if name in ('hello', 'ping'):
+            # Transactions are supported, so report it the way a replica set would
+            return {'ok': 1.0, 'isWritablePrimary': True, 'setName': 'local'}
+        raise OperationFailure(f"no such command: '{name}'")
+
+class LocalSession:
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def end_session(self):
+        pass
+
+    def with_transaction(self, callback):
+        # The client lock is held for the whole callback, so transactions run
+        # one at a time and other threads never see half of one
+        with self.client.lock:
+            self.client._journal = []
+            self.client._transaction = True
+            try:
+                result = callback(self)
+            except BaseException:
+                self.client._rollback()
+                raise
+            finally:
+                self.client._transaction = False
+                journal, self.client._journal = self.client._journal, None
+            self.client._flush()
+            return result
+
+class LocalClient:
+    # One database per client; the name passed to client[...] is ignored
+    # beyond being reported back. Documents are stored in one SQLite table
+    # keyed by (collection, _id) as canonical Extended JSON.
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.RLock()
+        self._collections = {}
+        self._journal = None
+        self._transaction = False
+        self._dirty = set()
+        self._connection = None
+        self.admin = LocalDatabase(self, 'admin')
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'collection TEXT NOT NULL, id TEXT NOT NULL, doc TEXT NOT NULL, '
+            'PRIMARY KEY (collection, id))'
+        )
+        self._connection.commit()
+
+    def _load(self, collection):
+        # Each collection is read from SQLite the first time it is used, so
+        # opening the store does not read collections nothing asks for
+        rows = self._connection.execute('SELECT doc FROM documents WHERE collection = ?', (collection.name,))
+        for (doc,) in rows:
+            doc = json_util.loads(doc, json_options=JSON_OPTIONS)
+            collection._docs[doc['_id']] = doc
+        if collection.name != INDEX_COLLECTION:
+            for spec in self._collection(INDEX_COLLECTION)._docs.values():
+                if spec['ns'] == collection.name:
+                    collection._add_index(spec['name'], spec['key'], spec['unique'])
+
+    def __getitem__(self, name):
+        return LocalDatabase(self, name)
+
+    def get_database(self, name):
+        return self[name]
+
+    def _collection(self, name):
+        with self.lock:
+            if name not in self._collections:
+                collection = self._collections[name] = LocalCollection(self, name)
+                if self._connection is not None:
+                    self._load(collection)
+            return self._collections[name]
+
+    def start_session(self):
+        return LocalSession(self)
+
+    def _record(self, collection, doc_id, old):
+        if self._journal is not None:
+            self._journal.append((collection, doc_id, old))
+
+    def _rollback(self):
+        journal, self._journal = self._journal, None
+        for collection, doc_id, old in reversed(journal):
+            collection._store(doc_id, old)
+        self._dirty.clear()
+
+    def operation(self):
+        return _Operation(self)
+
+    def _flush(self):
+        dirty, self._dirty = self._dirty, set()
+        if self._connection is None or not dirty:
+            return
+        with self._connection:
+            for name, doc_id in dirty:
+                key = json_util.dumps(doc_id, json_options=JSON_OPTIONS)
+                doc = self._collections[name]._docs.get(doc_id)
+                if doc is None:
+                    self._connection.execute('DELETE FROM documents WHERE collection = ? AND id = ?', (name, key))
+                else:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO documents (collection, id, doc) VALUES (?, ?, ?)',
+                        (name, key, json_util.dumps(doc, json_options=JSON_OPTIONS))
+                    )
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class _Operation:
+    # Holds the client lock for one write. Outside a transaction the write
+    # is flushed as soon as the outermost operation finishes; a failed write
+    # is undone so a bulk_write or insert_many never half-applies.
+    def __init__(self, client):
+        self.client = client
+        self.owns_journal = False
+
+    def __enter__(self):
+        self.client.lock.acquire()
+        if self.client._journal is None:
+            self.client._journal = []
+            self.owns_journal = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.owns_journal:
+                if exc_type is not None:
+                    self.client._rollback()
+                else:
+                    self.client._journal = None
+                    self.client._flush()
+        finally:
+            self.client.lock.release()
+        return False
@@ -1,16 +1,38 @@
 import sys
 import os
-from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QMessageBox
+import time
+import logging
+from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QMessageBox, QLabel, QPushButton
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QEvent, QTimer
+
+# Taken as early as possible so time-to-first-paint includes imports
+_process_start = time.perf_counter()
+
 from inventory_module import InventoryModule
-from billing_module import BillingModule
+from billing_module import BillingModule, warm_up_preview
 from search_module import SearchModule
-from db_connection import DatabaseError
+from db_connection import get_database, get_data_path, load_env, _int_env, BILL_SUMMARY_FIELDS
+from db_async import get_async_database, close_async_database, STARTUP_QUERIES
+from db_worker import get_worker, show_error
+from search_module import SEARCH_PAGE_SIZE
+from ui_watchdog import StallWatchdog, profile_slot, setup_log
+
+logger = logging.getLogger(__name__)
+
+# How often the status bar re-reads the offline sync state
+SYNC_STATUS_INTERVAL_MS = 5000
+# Wait before a failed startup connection is tried again
+CONNECT_RETRY_INTERVAL_MS = 30000
+
+def connect_database(db):
+    # Runs on the worker thread pool
+    db.connect()
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, background_connect=True):
         super().__init__()
+        self.first_paint_ms = None
         
         # Set window icon
         if getattr(sys, 'frozen', False):
@@ -30,10 +52,13 @@ class MainWindow(QMainWindow):
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
         
-        # Create modules
-        self.inventory = InventoryModule()
-        self.billing = BillingModule()
-        self.search = SearchModule()
+        # Create modules sharing a single database connection. In background
+        # mode the modules are built before the connection exists and are
+        # filled in once the connector thread reports back.
+        self.db = get_database(connect=not background_connect)
+        self.inventory = InventoryModule(db=self.db)
+        self.billing = BillingModule(db=self.db)
+        self.search = SearchModule(db=self.db)
         
         # Add tabs
         self.tabs.addTab(self.inventory, "Inventory")
@@ -42,14 +67,153 @@ class MainWindow(QMainWindow):
         
         # Connect signals
         self.inventory.model_added.connect(self.billing.update_model_list)
-        self.inventory.model_added.connect(self.inventory.load_inventory)
-        self.billing.bill_generated.connect(self.inventory.load_inventory)
-        self.search.bill_changed.connect(self.inventory.load_inventory)
+        # Bills carry their stock changes; the table applies them in place
+        self.billing.bill_generated.connect(self.inventory.apply_stock_changes)
+        self.search.bill_changed.connect(self.inventory.apply_stock_changes)
+        
+        self.worker = get_worker()
+        self.worker.busy_changed.connect(self.on_worker_busy)
+        if self.db.backend == 'offline':
+            self.sync_label = QLabel()
+            self.statusBar().addPermanentWidget(self.sync_label)
+            self.sync_timer = QTimer(self)
+            self.sync_timer.timeout.connect(self.update_sync_status)
+            self.sync_timer.start(SYNC_STATUS_INTERVAL_MS)
+        if background_connect:
+            # A failed connection is tried again on a timer, or straight
+            # away with the status bar's Retry button
+            self.connect_failures = 0
+            self.retry_timer = QTimer(self)
+            self.retry_timer.setSingleShot(True)
+            self.retry_timer.timeout.connect(self.start_background_connect)
+            self.retry_button = QPushButton("Retry")
+            self.retry_button.clicked.connect(self.start_background_connect)
+            self.retry_button.hide()
+            self.statusBar().addPermanentWidget(self.retry_button)
+            self.start_background_connect()
+
+    def start_background_connect(self):
+        self.retry_timer.stop()
+        self.retry_button.hide()
+        for index in range(self.tabs.count()):
+            self.tabs.widget(index).setEnabled(False)
+        self.statusBar().showMessage("Connecting to database…")
+        self.worker.submit(
+            connect_database, self.db,
+            on_result=lambda _: self.on_database_connected(),
+            on_error=self.on_database_failed
+        )
+
+    def on_database_connected(self):
+        logger.info("Database ready after %.0f ms", (time.perf_counter() - _process_start) * 1000)
+        self.statusBar().showMessage("Connected", 5000)
+        self.load_startup_data()
+
+    def load_startup_data(self):
+        # The three startup queries are independent, so they run concurrently
+        # on the async driver and each tab fills in as soon as its own answer
+        # arrives instead of waiting behind the others. The local backends
+        # answer from memory, so they go through the thread pool instead.
+        if self.db.backend == 'mongo':
+            submit, source = self.worker.submit_async, get_async_database()
+        else:
+            submit, source = self.worker.submit, self.db
+        self.startup_queries = STARTUP_QUERIES
+        submit(
+            source.get_inventory, refresh=True,
+            on_result=self.on_inventory_ready,
+            on_error=lambda error: show_error(self, error, "load inventory"),
+            on_done=lambda: self.on_startup_query_done(self.inventory)
+        )
+        submit(
+            source.get_customer_index,
+            on_error=lambda error: show_error(self, error, "load customers"),
+            on_done=lambda: self.on_startup_query_done(self.billing)
+        )
+        submit(
+            source.search_bills, fields=BILL_SUMMARY_FIELDS, page_size=SEARCH_PAGE_SIZE,
+            on_result=self.search.show_recent_bills,
+            on_error=lambda error: show_error(self, error, "load bills"),
+            on_done=lambda: self.on_startup_query_done(self.search)
+        )
+
+    def on_startup_query_done(self, tab):
+        tab.setEnabled(True)
+        self.startup_queries -= 1
+        if self.startup_queries == 0 and self.db.backend == 'mongo':
+            # The async client's pool was only needed for these reads
+            self.worker.submit_async(close_async_database)
+
+    def on_inventory_ready(self, inventory):
+        self.inventory.populate_inventory(inventory)
+        self.billing.populate_model_list(inventory)
+        logger.info("Inventory shown after %.0f ms", (time.perf_counter() - _process_start) * 1000)
+
+    def on_database_failed(self, error):
+        self.connect_failures += 1
+        logger.warning("Database connection attempt %d failed: %s", self.connect_failures, error)
+        self.statusBar().showMessage(
+            f"Not connected to database, retrying in {CONNECT_RETRY_INTERVAL_MS // 1000} s"
+        )
+        self.retry_button.show()
+        self.retry_timer.start(CONNECT_RETRY_INTERVAL_MS)
+        # Only the first failure interrupts the user; retries just update the status bar
+        if self.connect_failures == 1:
+            show_error(self, error, "connect to database")
+
+    def update_sync_status(self):
+        status = self.db.sync_status()
+        if status is None:
+            return
+        if status['pending']:
+            text = f"{status['pending']} changes waiting to sync"
+            if status['last_error']:
+                text += " (offline)"
+        elif status['last_synced_at']:
+            text = f"Synced at {status['last_synced_at'].strftime('%H:%M')}"
+        else:
+            text = "Not synced yet"
+        self.sync_label.setText(text)
+
+    def on_worker_busy(self, busy):
+        # Database calls never block the window; show that one is in flight
+        if busy:
+            QApplication.setOverrideCursor(Qt.BusyCursor)
+        else:
+            QApplication.restoreOverrideCursor()
+
+    def event(self, event):
+        if self.first_paint_ms is None and event.type() == QEvent.Paint:
+            self.first_paint_ms = (time.perf_counter() - _process_start) * 1000
+            logger.info("Time to first paint: %.0f ms", self.first_paint_ms)
+            # Once the window is up, get the bill preview ready for the first bill
+            QTimer.singleShot(0, lambda: warm_up_preview(self))
+        return super().event(event)
+
+def install_diagnostics(app):
+    # Optional freeze diagnostics, written to a rotating log:
+    # UI_WATCHDOG=1 logs the GUI thread's stack whenever the event loop is
+    # blocked for UI_STALL_MS; UI_PROFILE_SLOT=module.Class.method runs that
+    # handler under cProfile on every call
+    watchdog = os.getenv('UI_WATCHDOG', '').lower() in ('1', 'true', 'yes')
+    slot = os.getenv('UI_PROFILE_SLOT')
+    if not watchdog and not slot:
+        return
+    setup_log(os.getenv('UI_WATCHDOG_LOG') or os.path.join(get_data_path(), 'ui_stalls.log'))
+    if slot:
+        profile_slot(slot)
+    if watchdog:
+        app.watchdog = StallWatchdog(_int_env('UI_STALL_MS', 300), app)
+        app.watchdog.start()
 
 def main():
     try:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
         app = QApplication(sys.argv)
-        window = MainWindow()
+        load_env()
+        install_diagnostics(app)
+        background_connect = os.getenv('STARTUP_MODE', 'background').lower() != 'blocking'
+        window = MainWindow(background_connect=background_connect)
         window.show()
         sys.exit(app.exec_())
     except Exception as e:
@@ -0,0 +1,137 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# Bill arithmetic in integer paise, with percentages in basis points
+# (hundredths of a percent), so nothing drifts. Rounding is half to even,
+# as Python's round() did for the float amounts of bills saved before.
+# Saved bills keep their amounts as rupee floats.
+
+PAISE_PER_RUPEE = 100
+# 100% in basis points
+WHOLE = 10000
+
+# Saved fields the audit reads
+AUDIT_FIELDS = ['invoice_number', 'bill_type', 'items.quantity', 'items.discounted_price', 'items.price',
+                'items.total', 'subtotal', 'gst_percent', 'cgst', 'sgst', 'buyback', 'total']
+
+BillTotals = namedtuple('BillTotals', ['subtotal', 'cgst', 'sgst', 'total'])
+
+def to_paise(rupees):
+    return int(Decimal(str(rupees)).quantize(Decimal('0.01'), rounding=ROUND_HALF_EVEN) * PAISE_PER_RUPEE)
+
+def to_basis_points(percent):
+    return int(Decimal(str(percent)).quantize(Decimal('0.01'), rounding=ROUND_HALF_EVEN) * 100)
+
+def to_rupees(paise):
+    return paise / PAISE_PER_RUPEE
+
+def format_rupees(paise):
+    sign = '-' if paise < 0 else ''
+    rupees, paise = divmod(abs(paise), PAISE_PER_RUPEE)
+    return f"₹{sign}{rupees}.{paise:02d}"
+
+def divide(numerator, denominator):
+    # numerator / denominator rounded half to even; denominator > 0
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+def round_to_rupee(numerator, denominator):
+    # (numerator / denominator) paise, to the nearest whole rupee
+    return divide(numerator, denominator * PAISE_PER_RUPEE) * PAISE_PER_RUPEE
+
+def line_rate(price, discount, gst=None):
+    # Unit rate of a line item from the entered price: the discount comes
+    # off and the result is rounded to the rupee. On GST bills the price
+    # includes GST, so it is then reduced to the base rate, again to the rupee.
+    rate = round_to_rupee(price * (WHOLE - discount), WHOLE)
+    if gst is not None:
+        rate = round_to_rupee(rate * WHOLE, WHOLE + gst)
+    return rate
+
+def bill_totals(subtotal, gst=None, buyback=0):
+    # GST bills: CGST and SGST are each half the GST on the subtotal, to the
+    # paisa, and the total is subtotal plus GST rounded to the rupee.
+    # Non-GST bills: the subtotal less the buyback.
+    if gst is None:
+        return BillTotals(subtotal, 0, 0, subtotal - buyback)
+    half = divide(subtotal * gst, 2 * WHOLE)
+    return BillTotals(subtotal, half, half, round_to_rupee(subtotal * (WHOLE + gst), WHOLE))
+
+def audit_bills(bills):
+    # Recomputes every saved bill's line totals, subtotal, CGST/SGST and
+    # total with NumPy and returns the fields that disagree, as dicts of
+    # invoice_number, bill_type, field, saved and expected (rupees).
+    # Saved CGST/SGST may be unrounded, so they only count when off by
+    # more than half a paisa.
+    import numpy as np
+
+    def divide_array(numerator, denominator):
+        quotient, remainder = np.divmod(numerator, denominator)
+        return quotient + ((2 * remainder > denominator) | ((2 * remainder == denominator) & (quotient % 2 == 1)))
+
+    def paise(values):
+        return np.rint(np.asarray(values, dtype=np.float64) * PAISE_PER_RUPEE).astype(np.int64)
+
+    quantities = []
+    rates = []
+    line_totals = []
+    item_counts = []
+    for bill in bills:
+        items = bill.get('items') or []
+        item_counts.append(len(items))
+        for item in items:
+            quantities.append(item['quantity'])
+            rates.append(item.get('discounted_price', item.get('price', 0)))
+            line_totals.append(item['total'])
+    quantities = np.asarray(quantities, dtype=np.int64)
+    rates = paise(rates)
+    line_totals = paise(line_totals)
+    item_counts = np.asarray(item_counts, dtype=np.int64)
+
+    is_gst = np.array([bill.get('bill_type') == 'gst' for bill in bills], dtype=bool)
+    saved_subtotals = paise([bill.get('subtotal', 0) for bill in bills])
+    saved_totals = paise([bill.get('total', 0) for bill in bills])
+    saved_cgst = np.array([bill.get('cgst', 0) for bill in bills], dtype=np.float64) * PAISE_PER_RUPEE
+    saved_sgst = np.array([bill.get('sgst', 0) for bill in bills], dtype=np.float64) * PAISE_PER_RUPEE
+    gst = np.where(is_gst, paise([bill.get('gst_percent', 0) for bill in bills]), 0)
+    buybacks = paise([bill.get('buyback', 0) for bill in bills])
+
+    # Items are stored bill by bill, so each bill's lines are one slice
+    ends = np.cumsum(item_counts)
+    running = np.concatenate([[0], np.cumsum(line_totals)])
+    subtotals = running[ends] - running[ends - item_counts]
+    expected_lines = quantities * rates
+    half_gst = saved_subtotals * gst / (2 * WHOLE)
+    expected_totals = np.where(
+        is_gst,
+        divide_array(saved_subtotals * (WHOLE + gst), WHOLE * PAISE_PER_RUPEE) * PAISE_PER_RUPEE,
+        saved_subtotals - buybacks
+    )
+
+    discrepancies = []
+
+    def report(bill_index, field, saved, expected):
+        bill = bills[bill_index]
+        discrepancies.append({
+            'invoice_number': bill.get('invoice_number'),
+            'bill_type': bill.get('bill_type'),
+            'field': field,
+            'saved': to_rupees(float(saved)),
+            'expected': to_rupees(float(expected)),
+        })
+
+    item_bills = np.repeat(np.arange(len(bills)), item_counts)
+    item_starts = ends - item_counts
+    for index in np.nonzero(line_totals != expected_lines)[0]:
+        bill_index = item_bills[index]
+        report(bill_index, f"items.{index - item_starts[bill_index]}.total", line_totals[index], expected_lines[index])
+    for index in np.nonzero(saved_subtotals != subtotals)[0]:
+        report(index, 'subtotal', saved_subtotals[index], subtotals[index])
+    for field, saved in (('cgst', saved_cgst), ('sgst', saved_sgst)):
+        for index in np.nonzero(is_gst & (np.abs(saved - half_gst) > 0.5 + 1e-6))[0]:
+            report(index, field, saved[index], half_gst[index])
+    for index in np.nonzero(saved_totals != expected_totals)[0]:
+        report(index, 'total', saved_totals[index], expected_totals[index])
+    return discrepancies
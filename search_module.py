@@ -1,13 +1,95 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
-                            QTableWidget, QTableWidgetItem, QLabel, QLineEdit, 
+                            QTableView, QHeaderView, QLabel, QLineEdit, 
                             QMessageBox, QCalendarWidget, QDialog, QComboBox, 
                             QFileDialog)
-from PyQt5.QtCore import Qt, QDate, pyqtSignal
+from PyQt5.QtCore import Qt, QDate, QModelIndex, QAbstractTableModel, pyqtSignal
 from PyQt5.QtGui import QFont
-from db_connection import Database, DatabaseError
+from db_connection import get_database, DatabaseError, BILL_SUMMARY_FIELDS, stock_quantities
 from datetime import datetime, timedelta
-from billing_module import BillPreviewDialog, BillingModule
-import pandas as pd
+from db_worker import get_worker, show_error, BusyMixin
+from billing_module import BillingModule, preview_bill
+from button_delegate import ButtonDelegate
+
+# Bills fetched per request; more are loaded as the table is scrolled
+SEARCH_PAGE_SIZE = 100
+
+BILL_TYPE_FILTERS = {"All": None, "GST": 'gst', "Non-GST": 'non-gst'}
+
+GST_EXPORT_FIELDS = ['invoice_number', 'customer_name', 'customer_gstin', 'date',
+                     'gst_percent', 'subtotal', 'cgst', 'sgst', 'total']
+
+RESULT_HEADERS = ['Invoice #', 'Date', 'Customer', 'Type', 'Items', 'Total', 'Actions']
+ACTIONS_COLUMN = 6
+
+class BillResultsModel(QAbstractTableModel):
+    # Bill summaries of the pages loaded so far. The view calls fetchMore as
+    # it is scrolled near the end; fetch_page is called with the last loaded
+    # bill and must answer with append_bills or fetch_failed.
+    def __init__(self, fetch_page, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.bills = []
+        self.has_more = False
+        self.fetching = False
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.bills)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(RESULT_HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return RESULT_HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        bill = self.bills[index.row()]
+        column = index.column()
+        if column == 0:
+            return str(bill['invoice_number'])
+        if column == 1:
+            # Date without time
+            return bill['date'].strftime('%Y-%m-%d')
+        if column == 2:
+            return bill['customer_name']
+        if column == 3:
+            return bill['bill_type'].upper()
+        if column == 4:
+            return ", ".join([f"{item['model']}({item['quantity']})" for item in bill['items']])
+        if column == 5:
+            return f"₹{bill['total']:.2f}"
+        return None
+    
+    def reset(self, has_more=False):
+        self.beginResetModel()
+        self.bills = []
+        self.has_more = has_more
+        self.fetching = False
+        self.endResetModel()
+    
+    def append_bills(self, bills, has_more):
+        self.fetching = False
+        if bills:
+            self.beginInsertRows(QModelIndex(), len(self.bills), len(self.bills) + len(bills) - 1)
+            self.bills.extend(bills)
+            self.endInsertRows()
+        self.has_more = has_more
+    
+    def fetch_failed(self):
+        # Stop asking until the next search rather than retrying on every scroll
+        self.fetching = False
+        self.has_more = False
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and not self.fetching
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetching = True
+            self.fetch_page(self.bills[-1] if self.bills else None)
 
 class DatePickerDialog(QDialog):
     def __init__(self, parent=None):
@@ -38,12 +120,16 @@ class DatePickerDialog(QDialog):
     def get_date(self):
         return self.calendar.selectedDate().toPyDate()
 
-class SearchModule(QWidget):
-    bill_changed = pyqtSignal()
-    def __init__(self, parent=None):
+class SearchModule(BusyMixin, QWidget):
+    # {model: change in stock} of an edited or deleted bill
+    bill_changed = pyqtSignal(object)
+    def __init__(self, parent=None, db=None):
         super().__init__(parent)
         try:
-            self.db = Database()
+            self.db = db if db is not None else get_database()
+            self.worker = get_worker()
+            self.search_filters = None
+            self.results = BillResultsModel(self.load_more_bills, self)
             self.setup_ui()
         except DatabaseError as e:
             QMessageBox.critical(self, "Database Error", str(e))
@@ -90,6 +176,10 @@ class SearchModule(QWidget):
             search_btn.clicked.connect(self.search_bills)
             search_layout.addWidget(search_btn)
             
+            self.status_label = QLabel("")
+            self.status_label.setFont(QFont('Arial', 12))
+            search_layout.addWidget(self.status_label)
+            
             layout.addLayout(search_layout)
             
             # Filter section
@@ -110,15 +200,19 @@ class SearchModule(QWidget):
             layout.addLayout(filter_layout)
             self.bill_type_filter.currentIndexChanged.connect(self.search_bills)
             
-            # Results table
-            self.table = QTableWidget()
-            self.table.setColumnCount(7)
-            self.table.setHorizontalHeaderLabels(['Invoice #', 'Date', 'Customer', 'Type', 'Items', 'Total', 'Actions'])
+            # Results table; rows are fetched page by page as it is scrolled
+            self.table = QTableView()
+            self.table.setModel(self.results)
+            # Edit/Delete are painted, not a widget pair per row
+            self.actions = ButtonDelegate(("Edit", "Delete"), QFont('Arial', 10), parent=self.table)
+            self.actions.clicked.connect(self.on_action_clicked)
+            self.table.setItemDelegateForColumn(ACTIONS_COLUMN, self.actions)
             self.table.horizontalHeader().setStretchLastSection(True)
             self.table.setFont(QFont('Arial', 12))
+            self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
             self.table.verticalHeader().setDefaultSectionSize(40)
             self.table.setStyleSheet("""
-                QTableWidget {
+                QTableView {
                     font-size: 14px;
                 }
                 QHeaderView::section {
@@ -145,78 +239,93 @@ class SearchModule(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to show calendar: {str(e)}")
     
+    def busy_widgets(self):
+        return [self.download_button]
+    
     def search_bills(self):
         try:
-            self.table.setRowCount(0)
-            
             customer_name = self.customer_search.text()
             from_date = self.from_date.text()
             to_date = self.to_date.text()
             
             try:
-                if from_date:
-                    from_date = datetime.strptime(from_date, '%Y-%m-%d')
-                if to_date:
-                    to_date = datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1)
+                from_date = datetime.strptime(from_date, '%Y-%m-%d') if from_date else None
+                to_date = datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1) if to_date else None
             except ValueError:
                 QMessageBox.warning(self, "Error", "Invalid date format")
                 return
             
-            bill_type = self.bill_type_filter.currentText()
-            bills = self.db.search_bills(customer_name, from_date, to_date)
-            
-            if bill_type == "GST":
-                bills = [b for b in bills if b.get('bill_type', '').lower() == 'gst']
-            elif bill_type == "Non-GST":
-                bills = [b for b in bills if b.get('bill_type', '').lower() == 'non-gst']
-            
-            self.current_bills = bills
-
-            for row, bill in enumerate(bills):
-                items_text = ", ".join([f"{item['model']}({item['quantity']})" for item in bill['items']])
-                self.table.insertRow(row)
-                
-                # Add invoice number
-                self.table.setItem(row, 0, QTableWidgetItem(str(bill['invoice_number'])))
-                
-                # Add date (without time)
-                self.table.setItem(row, 1, QTableWidgetItem(bill['date'].strftime('%Y-%m-%d')))
-                self.table.setItem(row, 2, QTableWidgetItem(bill['customer_name']))
-                self.table.setItem(row, 3, QTableWidgetItem(bill['bill_type'].upper()))
-                self.table.setItem(row, 4, QTableWidgetItem(items_text))
-                self.table.setItem(row, 5, QTableWidgetItem(f"₹{bill['total']:.2f}"))
-                
-                # Add action buttons
-                action_widget = QWidget()
-                action_layout = QHBoxLayout()
-                action_layout.setContentsMargins(0, 0, 0, 0)
-                
-                edit_btn = QPushButton("Edit")
-                edit_btn.setFont(QFont('Arial', 10))
-                edit_btn.clicked.connect(lambda checked, b=bill: self.edit_bill(b))
-                
-                delete_btn = QPushButton("Delete")
-                delete_btn.setFont(QFont('Arial', 10))
-                delete_btn.clicked.connect(lambda checked, b=bill: self.delete_bill(b))
-                
-                action_layout.addWidget(edit_btn)
-                action_layout.addWidget(delete_btn)
-                action_widget.setLayout(action_layout)
-                
-                self.table.setCellWidget(row, 6, action_widget)
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+            self.search_filters = {
+                'customer_name': customer_name or None,
+                'start_date': from_date,
+                'end_date': to_date,
+                'bill_type': BILL_TYPE_FILTERS[self.bill_type_filter.currentText()],
+            }
+            self.results.reset(has_more=True)
+            self.results.fetchMore()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to search bills: {str(e)}")
     
+    def load_more_bills(self, after):
+        # A new search supersedes any page still being fetched for the old one
+        self.set_busy(True, "Searching…")
+        self.worker.submit(
+            self.db.search_bills,
+            fields=BILL_SUMMARY_FIELDS, page_size=SEARCH_PAGE_SIZE, after=after, **self.search_filters,
+            key=('bill-search', id(self)),
+            on_result=self.on_bills_loaded,
+            on_error=self.on_search_failed,
+            on_done=lambda: self.set_busy(False)
+        )
+    
+    def show_recent_bills(self, bills):
+        # First page of an unfiltered search, fetched at startup. Ignored if
+        # the user has already run a search of their own.
+        if self.search_filters is not None:
+            return
+        self.search_filters = {'customer_name': None, 'start_date': None, 'end_date': None, 'bill_type': None}
+        self.results.reset()
+        self.on_bills_loaded(bills)
+    
+    def on_bills_loaded(self, bills):
+        self.results.append_bills(bills, has_more=len(bills) == SEARCH_PAGE_SIZE)
+    
+    def on_search_failed(self, error):
+        self.results.fetch_failed()
+        show_error(self, error, "search bills")
+    
+    def on_action_clicked(self, row, button):
+        bill = self.results.bills[row]
+        if button == 0:
+            self.edit_bill(bill)
+        else:
+            self.delete_bill(bill)
+    
+    def fetch_full_bill(self, summary, on_bill, action):
+        # Search results only carry the summary fields
+        self.set_busy(True, "Loading bill…")
+        self.worker.submit(
+            self.db.get_bill, summary['invoice_number'], summary['bill_type'],
+            key=('bill-open', id(self)),
+            on_result=on_bill,
+            on_error=lambda error: show_error(self, error, action),
+            on_done=lambda: self.set_busy(False)
+        )
+    
     def edit_bill(self, bill):
+        self.fetch_full_bill(bill, self.open_edit_dialog, "edit bill")
+    
+    def open_edit_dialog(self, bill):
         try:
-            edit_dialog = BillingModule(self)
+            if not bill:
+                QMessageBox.warning(self, "Error", "Bill no longer exists")
+                return
+            edit_dialog = BillingModule(self, db=self.db)
             edit_dialog.setWindowTitle(f"Edit Bill #{bill['invoice_number']}")
             edit_dialog.setup_for_edit(bill)
+            edit_dialog.bill_generated.connect(self.bill_changed)
             if edit_dialog.exec_() == QDialog.Accepted:
                 self.search_bills()
-                self.bill_changed.emit()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to edit bill: {str(e)}")
     
@@ -228,78 +337,100 @@ class SearchModule(QWidget):
                 QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                if self.db.delete_bill(bill['invoice_number']):
-                    QMessageBox.information(self, "Success", "Bill deleted successfully")
-                    self.search_bills()
-                    self.bill_changed.emit()
-                else:
-                    QMessageBox.warning(self, "Error", "Failed to delete bill")
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+                self.set_busy(True, "Deleting…")
+                self.worker.submit(
+                    self.db.delete_bill, bill['invoice_number'], bill['bill_type'],
+                    on_result=lambda deleted: self.on_bill_deleted(deleted, bill),
+                    on_error=lambda error: show_error(self, error, "delete bill"),
+                    on_done=lambda: self.set_busy(False)
+                )
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to delete bill: {str(e)}")
     
+    def on_bill_deleted(self, deleted, bill):
+        if deleted:
+            QMessageBox.information(self, "Success", "Bill deleted successfully")
+            self.search_bills()
+            # Its items went back into stock
+            self.bill_changed.emit(stock_quantities(bill['items']))
+        else:
+            QMessageBox.warning(self, "Error", "Failed to delete bill")
+    
     def show_bill_details(self, index):
         try:
-            row = index.row()
-            date = self.table.item(row, 1).text()
-            customer = self.table.item(row, 2).text()
-            
-            # Search for the bill
-            bills = self.db.search_bills(customer, datetime.strptime(date, '%Y-%m-%d'))
-            if not bills:
-                return
-            
-            bill = bills[0]
-            
-            # Show bill preview
-            dialog = BillPreviewDialog(bill, self)
-            dialog.exec_()
-        except DatabaseError as e:
-            QMessageBox.critical(self, "Database Error", str(e))
+            self.fetch_full_bill(self.results.bills[index.row()], self.open_bill_preview, "show bill details")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to show bill details: {str(e)}")
     
+    def open_bill_preview(self, bill):
+        if not bill:
+            return
+        preview_bill(self, bill)
+    
     def download_gst_bills(self):
         try:
             if self.bill_type_filter.currentText() != "GST":
                 QMessageBox.warning(self, "Warning", "Download is only available for GST bills.")
                 return
                 
-            if not hasattr(self, 'current_bills') or not self.current_bills:
+            if not self.search_filters or not self.results.bills:
                  QMessageBox.warning(self, "Warning", "No GST bills to download.")
                  return
             
-            # Filter for GST bills explicitly (redundant if filter is checked, but safe)
-            gst_bills = [bill for bill in self.current_bills if bill.get('bill_type', '').lower() == 'gst']
-            
-            if not gst_bills:
+            # The table only holds the loaded pages, so fetch every matching
+            # GST bill (export columns only) from the server
+            filters = dict(self.search_filters, bill_type='gst')
+            self.set_busy(True, "Preparing download…")
+            self.worker.submit(
+                self._build_gst_export, filters,
+                on_result=self.save_gst_export,
+                on_error=lambda error: show_error(self, error, "download GST bills"),
+                on_done=lambda: self.set_busy(False)
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to download GST bills: {str(e)}")
+    
+    def _build_gst_export(self, filters):
+        # Runs on the worker
+        gst_bills = self.db.search_bills(fields=GST_EXPORT_FIELDS, **filters)
+        if not gst_bills:
+            return None
+
+        # Prepare data for DataFrame - select only the required fields
+        data = []
+        for bill in gst_bills:
+             data.append({
+                'invoice_number': bill.get('invoice_number'),
+                'customer_name': bill.get('customer_name'),
+                'customer_gstin': bill.get('customer_gstin',''),
+                'date': bill.get('date').strftime('%Y-%m-%d') if bill.get('date') else '',
+                'gst_percent': bill.get('gst_percent', 0),
+                'subtotal': bill.get('subtotal', 0),
+                'cgst': bill.get('cgst', 0),
+                'sgst': bill.get('sgst', 0),
+                'total': bill.get('total', 0)
+             })
+        
+        # pandas is slow to import, so only pay for it when exporting
+        import pandas as pd
+        return pd.DataFrame(data)
+    
+    def save_gst_export(self, df):
+        try:
+            if df is None:
                 QMessageBox.warning(self, "Warning", "No GST bills found for download based on current search criteria.")
                 return
 
-            # Prepare data for DataFrame - select only the required fields
-            data = []
-            for bill in gst_bills:
-                 data.append({
-                    'invoice_number': bill.get('invoice_number'),
-                    'customer_name': bill.get('customer_name'),
-                    'customer_gstin': bill.get('customer_gstin',''),
-                    'date': bill.get('date').strftime('%Y-%m-%d') if bill.get('date') else '',
-                    'gst_percent': bill.get('gst_percent', 0),
-                    'subtotal': bill.get('subtotal', 0),
-                    'cgst': bill.get('cgst', 0),
-                    'sgst': bill.get('sgst', 0),
-                    'total': bill.get('total', 0)
-                 })
-            
-            df = pd.DataFrame(data)
-
             # Get save file path from user
             filePath, _ = QFileDialog.getSaveFileName(self, "Save GST Bills", "GST_Bills.xlsx", "Excel Files (*.xlsx);;All Files (*)")
             
             if filePath:
-                df.to_excel(filePath, index=False)
-                QMessageBox.information(self, "Success", f"GST bills saved to {filePath}")
-            
+                self.set_busy(True, "Saving…")
+                self.worker.submit(
+                    df.to_excel, filePath, index=False,
+                    on_result=lambda _: QMessageBox.information(self, "Success", f"GST bills saved to {filePath}"),
+                    on_error=lambda error: show_error(self, error, "download GST bills"),
+                    on_done=lambda: self.set_busy(False)
+                )
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to download GST bills: {str(e)}") 
\ No newline at end of file
+            QMessageBox.critical(self, "Error", f"Failed to download GST bills: {str(e)}")
@@ -0,0 +1,128 @@
+from PyQt5.QtCore import QObject, QTimer
+from logging.handlers import RotatingFileHandler
+import cProfile
+import functools
+import importlib
+import inspect
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# How often the GUI thread reports in; stalls shorter than this go unseen
+HEARTBEAT_MS = 50
+
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+
+# Profile rows written per profiled call
+PROFILE_ROWS = 30
+
+def setup_log(path):
+    handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+
+def _app_frame(stack, app_dir):
+    # Innermost frame from our own modules: the handler to blame
+    for frame in reversed(stack):
+        if os.path.dirname(os.path.abspath(frame.filename)) == app_dir:
+            return frame
+    return stack[-1] if stack else None
+
+class StallWatchdog(QObject):
+    # Measures how late the GUI thread's event loop runs a repeating timer.
+    # A monitor thread notices when the loop has not come back for
+    # threshold_ms and logs the GUI thread's Python stack while it is still
+    # blocked, then logs the total length once the loop recovers.
+    def __init__(self, threshold_ms=300, parent=None):
+        super().__init__(parent)
+        self.threshold = threshold_ms / 1000
+        self.app_dir = os.path.dirname(os.path.abspath(__file__))
+        self.gui_thread_id = threading.get_ident()
+        self.max_latency_ms = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._stalled_since = None
+        self._stall_frame = None
+        self._stop = threading.Event()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._beat)
+
+    def start(self):
+        self._last_beat = time.monotonic()
+        self.timer.start(HEARTBEAT_MS)
+        threading.Thread(target=self._monitor, name='ui-watchdog', daemon=True).start()
+        logger.info("Stall watchdog started, threshold %.0f ms", self.threshold * 1000)
+
+    def stop(self):
+        self._stop.set()
+        self.timer.stop()
+
+    def _beat(self):
+        now = time.monotonic()
+        latency_ms = max((now - self._last_beat) * 1000 - HEARTBEAT_MS, 0)
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self._last_beat = now
+        stalled_since = self._stalled_since
+        if stalled_since is not None:
+            self._stalled_since = None
+            frame = self._stall_frame
+            where = f"{frame.name} ({os.path.basename(frame.filename)}:{frame.lineno})" if frame else "unknown"
+            logger.warning("GUI thread blocked for %.0f ms in %s", (now - stalled_since) * 1000, where)
+
+    def _monitor(self):
+        while not self._stop.wait(HEARTBEAT_MS / 1000):
+            last_beat = self._last_beat
+            if self._stalled_since is not None or time.monotonic() - last_beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.gui_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self.stalls += 1
+            self._stall_frame = _app_frame(stack, self.app_dir)
+            self._stalled_since = last_beat
+            logger.warning("GUI thread stalled for over %.0f ms; stack:\n%s",
+                           self.threshold * 1000, "".join(traceback.format_list(stack)))
+
+def profile_slot(path):
+    # Wraps 'module.Class.method' (or 'module.function') so each call runs
+    # under cProfile and its top functions are logged. Must be installed
+    # before the widgets connect their signals.
+    module_name, _, attribute_path = path.partition('.')
+    owner = importlib.import_module(module_name)
+    *owner_path, name = attribute_path.split('.')
+    for part in owner_path:
+        owner = getattr(owner, part)
+    original = getattr(owner, name)
+    # PyQt passes a slot every signal argument it can take; keep the
+    # wrapper from accepting more than the original does
+    parameters = inspect.signature(original).parameters.values()
+    max_args = None
+    if not any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+        max_args = sum(parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+                       for parameter in parameters)
+
+    @functools.wraps(original)
+    def profiled(*args, **kwargs):
+        if max_args is not None:
+            args = args[:max_args]
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(original, *args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_ROWS)
+            logger.info("Profile of %s (%.0f ms):\n%s", path, elapsed_ms, output.getvalue())
+
+    setattr(owner, name, profiled)
+    return profiled